@@ -0,0 +1,173 @@
+"""
+Bot API Telegram simulée pour les benchmarks (aucun accès réseau)
+
+- Latence de chaque appel : `latency` secondes ± `jitter`
+- Limites de Telegram : `chat_rate` messages/s par chat et `global_rate`
+  messages/s au total (fenêtre glissante d'une seconde) ; au-delà,
+  réponse 429 avec retry_after, comme l'API réelle
+- `retry_after_rate` : proportion d'envois refusés au hasard (RetryAfter)
+- Compteurs par méthode (appels, erreurs 429) lus par le runner
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Deque, Dict
+from urllib.parse import parse_qsl
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Méthodes qui publient un message (soumises aux limites d'envoi)
+SEND_METHODS = {
+    "sendmessage", "sendphoto", "sendvideo", "senddocument", "sendaudio", "sendvoice",
+    "sendanimation", "sendsticker", "sendmediagroup", "copymessage", "copymessages"
+}
+
+
+class FakeBotAPI:
+    """Serveur Bot API simulé, lancé dans un thread (boucle séparée de celle du bot)"""
+
+    def __init__(
+        self,
+        latency: float = 0.03,
+        jitter: float = 0.01,
+        chat_rate: float = 30.0,
+        global_rate: float = 1000.0,
+        retry_after_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 42
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+        self._ids = itertools.count(1000)
+        self._chat_sends: Dict[str, Deque[float]] = defaultdict(deque)
+        self._global_sends: Deque[float] = deque()
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.sent_messages = 0
+
+        self.app = FastAPI()
+        self.app.add_api_route("/bot{token}/{method}", self._handle, methods=["POST", "GET"])
+        self._server = None
+
+    # --- Cycle de vie ---
+    def start(self, host: str = "127.0.0.1", port: int = 8081):
+        config = uvicorn.Config(self.app, host=host, port=port, log_level="warning", access_log=False)
+        self._server = uvicorn.Server(config)
+        threading.Thread(target=self._server.run, name="fake-bot-api", daemon=True).start()
+        while not self._server.started:
+            time.sleep(0.02)
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.throttled.clear()
+        self.sent_messages = 0
+
+    # --- Limites ---
+    def _over_limit(self, window: Deque[float], rate: float, now: float) -> bool:
+        while window and now - window[0] > 1.0:
+            window.popleft()
+        return len(window) >= rate
+
+    def _throttle(self, chat_id: str):
+        """Délai imposé (secondes) si l'envoi dépasse une limite, sinon None"""
+        now = time.monotonic()
+        chat_window = self._chat_sends[chat_id]
+        if (
+            self._over_limit(chat_window, self.chat_rate, now)
+            or self._over_limit(self._global_sends, self.global_rate, now)
+            or (self.retry_after_rate and self._random.random() < self.retry_after_rate)
+        ):
+            return self.retry_after
+        chat_window.append(now)
+        self._global_sends.append(now)
+        return None
+
+    # --- Réponses ---
+    async def _handle(self, token: str, method: str, request: Request):
+        body = await request.body()
+        if "json" in request.headers.get("content-type", ""):
+            data = json.loads(body or b"{}")
+        else:
+            data = dict(parse_qsl(body.decode()))
+
+        name = method.lower()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+        if name in SEND_METHODS:
+            retry_after = self._throttle(str(data.get("chat_id")))
+            if retry_after is not None:
+                self.throttled[method] += 1
+                return JSONResponse(status_code=429, content={
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}
+                })
+            self.sent_messages += 1
+
+        return {"ok": True, "result": self._result(name, data)}
+
+    def _message(self, chat_id, **extra) -> Dict:
+        try:
+            chat = int(chat_id)
+        except (TypeError, ValueError):
+            chat = 1
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat, "type": "channel" if chat < 0 else "private"}
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, name: str, data: Dict):
+        if name == "getme":
+            return {
+                "id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                "can_join_groups": True, "can_read_all_group_messages": False,
+                "supports_inline_queries": False
+            }
+        if name == "getwebhookinfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if name in ("setwebhook", "deletewebhook", "answercallbackquery"):
+            return True
+        if name == "copymessages":
+            ids = data.get("message_ids")
+            if isinstance(ids, str):
+                ids = json.loads(ids)
+            return [{"message_id": next(self._ids)} for _ in ids]
+        if name == "copymessage":
+            return {"message_id": next(self._ids)}
+        if name == "sendmediagroup":
+            media = data.get("media")
+            if isinstance(media, str):
+                media = json.loads(media)
+            photo = [{"file_id": "x", "file_unique_id": "y", "width": 1, "height": 1}]
+            return [self._message(data.get("chat_id"), photo=photo) for _ in media]
+        return self._message(data.get("chat_id"), text=data.get("text") or data.get("caption") or "")
+
+    def get_stats(self) -> Dict:
+        return {
+            "calls": dict(self.calls),
+            "throttled": dict(self.throttled),
+            "sent_messages": self.sent_messages
+        }
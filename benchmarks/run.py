@@ -0,0 +1,407 @@
+"""
+Benchmarks hors ligne : main.app piloté par POST /webhook contre une Bot API simulée
+
+    python -m benchmarks.run                                  # tous les scénarios
+    python -m benchmarks.run text album --updates 2000 --concurrency 20
+    python -m benchmarks.run bulk --bulk-sizes 100,1000,10000
+    python -m benchmarks.run --database-url postgresql://...  # base jetable uniquement
+    python -m benchmarks.run --json results.json --tracemalloc
+
+Par scénario : débit, latence de la réponse du webhook (p50/p99/max), durée
+de bout en bout (jusqu'au dernier envoi), requêtes SQL par update, appels
+à la Bot API, refus 429 et mémoire.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+
+SCENARIOS = ("text", "media", "album", "callback", "bulk")
+TARGET_CHAT = -1001234567890
+BENCH_TOKEN = "123456:BENCHMARK"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du webhook contre une Bot API simulée")
+    parser.add_argument("scenarios", nargs="*", help=f"Scénarios parmi {', '.join(SCENARIOS)} (tous par défaut)")
+    parser.add_argument("--updates", type=int, default=1000, help="Updates par scénario (hors bulk)")
+    parser.add_argument("--users", type=int, default=20, help="Utilisateurs simulés")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requêtes webhook simultanées")
+    parser.add_argument("--bulk-sizes", default="100,1000,10000", help="Tailles des traitements massifs")
+    parser.add_argument("--album-size", type=int, default=4)
+    parser.add_argument("--prefix", default="📢 ", help="Préfixe des utilisateurs (vide : chemin copy_message)")
+    parser.add_argument("--processing", choices=("direct", "queue"), default="direct", help="WEBHOOK_PROCESSING")
+    parser.add_argument("--database-url", help="Base à utiliser (SQLite temporaire par défaut)")
+    parser.add_argument("--latency", type=float, default=0.03, help="Latence simulée de la Bot API (s)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--chat-rate", type=float, default=30.0, help="Envois/s par chat avant 429")
+    parser.add_argument("--global-rate", type=float, default=1000.0, help="Envois/s au total avant 429")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Proportion de 429 aléatoires")
+    parser.add_argument("--bot-rate-limits", action="store_true",
+                        help="Garder les limites du bot (RATE_*) ; sinon seules celles de l'API simulée s'appliquent")
+    parser.add_argument("--port", type=int, default=8081, help="Port de la Bot API simulée")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Attente max de fin d'un scénario (s)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Pic d'allocations Python (plus lent)")
+    parser.add_argument("--json", help="Écrit les résultats dans ce fichier")
+    parser.add_argument("--verbose", action="store_true", help="Logs INFO du bot")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"scénarios inconnus: {', '.join(sorted(unknown))}")
+    return args
+
+
+def configure_environment(args, api_url: str):
+    """Variables lues à l'import de main/db : à fixer avant"""
+    if args.database_url:
+        database_url = args.database_url
+    else:
+        database_url = f"sqlite:///{tempfile.mkdtemp(prefix='bot-bench-')}/bench.db"
+    os.environ.update(
+        DATABASE_URL=database_url,
+        TELEGRAM_BOT_TOKEN=BENCH_TOKEN,
+        WEBHOOK_URL="http://127.0.0.1/webhook",
+        TELEGRAM_API_BASE_URL=api_url,
+        WEBHOOK_PROCESSING=args.processing,
+        MULTI_INSTANCE="false"
+    )
+    if not args.bot_rate_limits:
+        os.environ.update(
+            RATE_GLOBAL_PER_SEC="1000000",
+            RATE_GROUP_PER_MIN="60000000",
+            RATE_GROUP_BURST="1000000",
+            RATE_PRIVATE_PER_SEC="1000000",
+            RATE_PRIVATE_BURST="1000000"
+        )
+    return database_url
+
+
+# --- Updates synthétiques ---
+class UpdateFactory:
+    """Updates au format Telegram, update_id croissants d'un lancement à l'autre"""
+
+    def __init__(self):
+        self._next = int(time.time() * 1000)
+
+    def _id(self) -> int:
+        self._next += 1
+        return self._next
+
+    def _user(self, user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Bench{user_id}"}
+
+    def message(self, user_id: int, text: str = None, **extra) -> Dict:
+        message = {
+            "message_id": self._id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id)
+        }
+        if text is not None:
+            message["text"] = text
+        message.update(extra)
+        return {"update_id": self._id(), "message": message}
+
+    def command(self, user_id: int, text: str) -> Dict:
+        update = self.message(user_id, text)
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return update
+
+    def photo(self, user_id: int, caption: str = None, media_group_id: str = None) -> Dict:
+        extra = {"photo": [{"file_id": f"PHOTO{self._id()}", "file_unique_id": "u", "width": 1, "height": 1}]}
+        if caption:
+            extra["caption"] = caption
+        if media_group_id:
+            extra["media_group_id"] = media_group_id
+        return self.message(user_id, **extra)
+
+    def callback(self, user_id: int, data: str) -> Dict:
+        return {
+            "update_id": self._id(),
+            "callback_query": {
+                "id": str(self._id()),
+                "chat_instance": "bench",
+                "data": data,
+                "from": self._user(user_id),
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "menu"
+                }
+            }
+        }
+
+
+# --- Mesures ---
+class StatementCounter:
+    """Requêtes SQL exécutées (moteurs sync et async de db.py)"""
+
+    def __init__(self, *engines):
+        from sqlalchemy import event
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def rss_mb() -> float:
+    """Mémoire résidente actuelle (Linux), sinon pic du processus"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Bench:
+    def __init__(self, args, api: FakeBotAPI, main, client):
+        self.args = args
+        self.api = api
+        self.main = main
+        self.client = client
+        self.factory = UpdateFactory()
+        import db
+        self.statements = StatementCounter(db.get_engine(), db.get_async_engine().sync_engine)
+        self.users = [100000 + i for i in range(args.users)]
+
+    async def post(self, update: Dict) -> float:
+        start = time.perf_counter()
+        response = await self.client.post("/webhook", json=update)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200 or response.json().get("ok") is False:
+            raise RuntimeError(f"Webhook {response.status_code}: {response.text[:200]}")
+        return elapsed
+
+    async def post_all(self, updates: List[Dict]):
+        """Envoie les updates avec `concurrency` requêtes en vol ; (latences, erreurs)"""
+        latencies: List[float] = []
+        errors = 0
+        queue = iter(updates)
+
+        async def worker():
+            nonlocal errors
+            for update in queue:
+                try:
+                    latencies.append(await self.post(update))
+                except Exception:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return latencies, errors
+
+    async def wait_idle(self, quiet: float = 0.5):
+        """Attend la fin des envois différés (file, albums, outbox)"""
+        main = self.main
+        deadline = time.monotonic() + self.args.timeout
+        last_calls, stable_since = -1, time.monotonic()
+        while time.monotonic() < deadline:
+            calls = sum(self.api.calls.values())
+            busy = (
+                (main.dispatcher is not None and main.dispatcher.pending_count > 0)
+                or main.media_group_aggregator.get_stats()["pending_albums"] > 0
+                or main.outbox_worker.get_stats()["active_jobs"]
+            )
+            if calls != last_calls or busy:
+                last_calls, stable_since = calls, time.monotonic()
+            elif time.monotonic() - stable_since >= quiet:
+                return
+            await asyncio.sleep(0.05)
+        raise TimeoutError("Scénario non terminé dans le délai")
+
+    def _begin(self):
+        if self.args.tracemalloc:
+            tracemalloc.reset_peak()
+        self.api.reset_counters()
+        return time.perf_counter(), self.statements.count
+
+    def _result(self, name: str, units: int, started: float, statements: int,
+                latencies: List[float], errors: int, webhook_seconds: float) -> Dict:
+        elapsed = time.perf_counter() - started
+        result = {
+            "scenario": name,
+            "units": units,
+            "seconds": round(elapsed, 3),
+            "throughput": round(units / elapsed, 1) if elapsed else 0.0,
+            "webhook_throughput": round(len(latencies) / webhook_seconds, 1) if webhook_seconds else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(max(latencies, default=0) * 1000, 2),
+            "errors": errors,
+            "db_statements_per_unit": round((self.statements.count - statements) / units, 2) if units else 0.0,
+            "api_calls": sum(self.api.calls.values()),
+            "throttled_429": sum(self.api.throttled.values()),
+            "rss_mb": round(rss_mb(), 1)
+        }
+        if self.args.tracemalloc:
+            result["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        return result
+
+    # --- Préparation ---
+    async def setup_users(self):
+        """Utilisateurs créés et préfixe défini (non mesuré)"""
+        for user_id in self.users:
+            await self.post(self.factory.command(user_id, "/start"))
+            if self.args.prefix:
+                await self.post(self.factory.callback(user_id, "set_prefix"))
+                await self.post(self.factory.message(user_id, self.args.prefix))
+        await self.wait_idle()
+
+    async def _stream(self, name: str, updates: List[Dict], units: int = None) -> Dict:
+        started, statements = self._begin()
+        latencies, errors = await self.post_all(updates)
+        webhook_seconds = time.perf_counter() - started
+        await self.wait_idle()
+        return self._result(name, units or len(updates), started, statements, latencies, errors, webhook_seconds)
+
+    # --- Scénarios ---
+    async def text(self) -> List[Dict]:
+        users = self.users
+        updates = [
+            self.factory.message(users[i % len(users)], f"Message de test numéro {i} avec un peu de texte")
+            for i in range(self.args.updates)
+        ]
+        return [await self._stream("text", updates)]
+
+    async def media(self) -> List[Dict]:
+        users = self.users
+        updates = [self.factory.photo(users[i % len(users)], f"Légende {i}") for i in range(self.args.updates)]
+        return [await self._stream("media", updates)]
+
+    async def album(self) -> List[Dict]:
+        users, size = self.users, self.args.album_size
+        updates = []
+        for album in range(max(1, self.args.updates // size)):
+            user_id = users[album % len(users)]
+            group = f"bench-{self.factory._id()}"
+            for index in range(size):
+                updates.append(self.factory.photo(user_id, f"Album {album}" if index == 0 else None, group))
+        return [await self._stream("album", updates)]
+
+    async def callback(self) -> List[Dict]:
+        users = self.users
+        menus = ("menu_main", "menu_status", "menu_prefix", "menu_bulk")
+        updates = [
+            self.factory.callback(users[i % len(users)], menus[i % len(menus)])
+            for i in range(self.args.updates)
+        ]
+        return [await self._stream("callback", updates)]
+
+    async def bulk(self) -> List[Dict]:
+        results = []
+        for size in (int(value) for value in self.args.bulk_sizes.split(",") if value.strip()):
+            user_id = 900000 + size
+            for update in (
+                self.factory.command(user_id, "/start"),
+                self.factory.callback(user_id, "set_target_chat"),
+                self.factory.message(user_id, str(TARGET_CHAT)),
+                self.factory.callback(user_id, "toggle_publish"),
+                self.factory.callback(user_id, "toggle_bulk")
+            ):
+                await self.post(update)
+            if self.args.prefix:
+                await self.post(self.factory.callback(user_id, "set_prefix"))
+                await self.post(self.factory.message(user_id, self.args.prefix))
+            await self.wait_idle()
+
+            # Remplissage du buffer : une update par message
+            fill = [self.factory.message(user_id, f"Message massif {i}") for i in range(size)]
+            results.append(await self._stream(f"bulk-{size}-fill", fill))
+
+            # Traitement : du clic jusqu'à la fin du job dans l'outbox
+            completed = self.main.outbox_worker.jobs_completed
+            started, statements = self._begin()
+            latency = await self.post(self.factory.callback(user_id, "process_bulk"))
+            deadline = time.monotonic() + self.args.timeout
+            while self.main.outbox_worker.jobs_completed == completed:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Job de {size} messages non terminé")
+                await asyncio.sleep(0.05)
+            results.append(self._result(f"bulk-{size}-process", size, started, statements, [latency], 0, latency))
+        return results
+
+
+def print_table(results: List[Dict]):
+    columns = ("scenario", "units", "seconds", "throughput", "webhook_throughput", "p50_ms", "p99_ms",
+               "max_ms", "errors", "db_statements_per_unit", "api_calls", "throttled_429", "rss_mb")
+    if results and "python_peak_mb" in results[0]:
+        columns += ("python_peak_mb",)
+    headers = {"throughput": "units/s", "webhook_throughput": "webhook/s", "db_statements_per_unit": "sql/unit"}
+    rows = [[headers.get(column, column) for column in columns]]
+    rows += [[str(result.get(column, "")) for column in columns] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+async def run(args) -> List[Dict]:
+    import httpx
+
+    api = FakeBotAPI(
+        latency=args.latency, jitter=args.jitter, chat_rate=args.chat_rate,
+        global_rate=args.global_rate, retry_after_rate=args.retry_after_rate
+    )
+    api_url = api.start(port=args.port)
+    database_url = configure_environment(args, api_url)
+
+    import main
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"Base: {database_url} | Bot API simulée: {api_url} | mode {args.processing}")
+    results = []
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            # Initialisation en arrière-plan : mesures à partir d'un bot prêt
+            await main.ready.wait()
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                bench = Bench(args, api, main, client)
+                await bench.setup_users()
+                for name in args.scenarios or SCENARIOS:
+                    scenario_results = await getattr(bench, name)()
+                    for result in scenario_results:
+                        print(f"✅ {result['scenario']}: {result['throughput']} units/s, "
+                              f"p99 {result['p99_ms']}ms, {result['db_statements_per_unit']} sql/unit")
+                    results.extend(scenario_results)
+    finally:
+        api.stop()
+    return results
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    if args.tracemalloc:
+        tracemalloc.start()
+    results = asyncio.run(run(args))
+    print()
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
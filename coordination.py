@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from db import IS_POSTGRES, create_coordination_engine
+
+logger = logging.getLogger(__name__)
+
+# Espace de noms des verrous consultatifs du bot (octet de poids fort),
+# pour ne pas entrer en collision avec ceux d'autres applications
+_LOCK_NAMESPACE = 0x54
+
+_LOCK = text("SELECT pg_advisory_lock(:key)")
+_UNLOCK = text("SELECT pg_advisory_unlock(:key)")
+_NOTIFY = text("SELECT pg_notify(:channel, :payload)")
+
+
+def lock_key(user_id: int) -> int:
+    """Clé 64 bits signée du verrou d'un utilisateur"""
+    key = ((_LOCK_NAMESPACE << 56) ^ user_id) & 0xFFFFFFFFFFFFFFFF
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class Coordinator:
+    """
+    Coordination entre plusieurs instances derrière un même webhook
+
+    - Sérialisation par utilisateur : un verrou local (asyncio) puis un
+      verrou consultatif PostgreSQL tenu pendant tout le traitement de
+      l'update, quelle que soit l'instance qui la reçoit
+    - Au plus `pool_size` verrous tenus à la fois (une connexion chacun) :
+      les updates suivantes attendent une connexion libre, jamais de
+      traitement sans verrou faute de connexion
+    - Caches : les invalidations (préférences, règles) sont diffusées par
+      NOTIFY avant de relâcher le verrou, les autres instances les
+      appliquent à leurs caches locaux
+    - Désactivée (SQLite, instance unique) : seul le verrou local subsiste
+    """
+
+    CHANNEL = "bot_invalidate"
+
+    def __init__(self, enabled: bool, pool_size: int = 10, lock_timeout: float = 30.0):
+        self.enabled = enabled
+        self.pool_size = pool_size
+        self.lock_timeout = lock_timeout
+        self._slots = asyncio.Semaphore(pool_size)
+        self.instance_id = uuid.uuid4().hex[:12]
+
+        self._engine = None
+        self._listener = None
+        self._on_invalidate: Optional[Callable[[int], None]] = None
+        # user_id -> [verrou, nombre d'utilisateurs]
+        self._locks: Dict[int, list] = {}
+        self._pending: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.lock_count = 0
+        self.lock_timeouts = 0
+        self.lock_errors = 0
+        self.pool_waits = 0
+        self.notify_sent = 0
+        self.notify_received = 0
+
+    def _get_engine(self):
+        if self._engine is None:
+            # + LISTEN et diffusion des invalidations hors verrou
+            self._engine = create_coordination_engine(self.pool_size + 2, self.lock_timeout)
+        return self._engine
+
+    # --- Cycle de vie ---
+    async def start(self, on_invalidate: Callable[[int], None]):
+        """Écoute les invalidations des autres instances (à appeler dans la boucle d'événements)"""
+        self._on_invalidate = on_invalidate
+        if not self.enabled:
+            return
+
+        try:
+            self._listener = await self._get_engine().connect()
+            raw = await self._listener.get_raw_connection()
+            await raw.driver_connection.add_listener(self.CHANNEL, self._handle_notification)
+            logger.info(f"✅ Coordination multi-instances active (instance {self.instance_id})")
+        except Exception as e:
+            logger.error(f"❌ Écoute des invalidations impossible: {e}")
+            await self._close_listener()
+
+    async def stop(self):
+        """Diffuse les dernières invalidations puis ferme les connexions"""
+        if self._flush_task:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._close_listener()
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+    async def _close_listener(self):
+        if self._listener is not None:
+            try:
+                await self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+
+    # --- Sérialisation par utilisateur ---
+    @asynccontextmanager
+    async def user_lock(self, user_id: int):
+        """Traitement exclusif pour cet utilisateur, toutes instances confondues"""
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if not self.enabled:
+                    yield
+                    return
+
+                key = lock_key(user_id)
+                async with self._slots:
+                    conn = await self._acquire(key)
+                    try:
+                        yield
+                    finally:
+                        if conn is not None:
+                            await self._release(conn, key)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    async def _acquire(self, key: int):
+        """Connexion tenant le verrou, None si non obtenu (traitement quand même)"""
+        while True:
+            try:
+                conn = await self._get_engine().connect()
+                break
+            except PoolTimeoutError:
+                # Pool épuisé : on attend une connexion, le verrou reste obligatoire
+                self.pool_waits += 1
+                logger.warning(f"⚠️ Pool de coordination épuisé, attente d'une connexion (verrou {key})")
+            except Exception as e:
+                self.lock_errors += 1
+                logger.error(f"❌ Verrou {key} indisponible: {e}")
+                return None
+
+        try:
+            await conn.execute(_LOCK, {"key": key})
+            self.lock_count += 1
+            return conn
+        except Exception as e:
+            if "lock timeout" in str(e).lower():
+                self.lock_timeouts += 1
+                logger.warning(f"⚠️ Verrou {key} non obtenu après {self.lock_timeout}s, traitement sans verrou")
+            else:
+                self.lock_errors += 1
+                logger.error(f"❌ Verrou {key} indisponible: {e}")
+            await conn.close()
+            return None
+
+    async def _release(self, conn, key: int):
+        """Diffuse les invalidations puis relâche le verrou"""
+        try:
+            await self._notify(conn)
+            await conn.execute(_UNLOCK, {"key": key})
+        except Exception as e:
+            # Connexion douteuse : la fermer relâche aussi le verrou côté serveur
+            logger.error(f"❌ Libération du verrou {key}: {e}")
+            await conn.invalidate()
+        finally:
+            await conn.close()
+
+    # --- Invalidation des caches ---
+    def invalidated(self, user_id: int):
+        """Signale une modification des paramètres de l'utilisateur aux autres instances"""
+        if not self.enabled:
+            return
+        self._pending.add(user_id)
+        # Hors d'un user_lock (tâches de fond), diffusion au plus tôt
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+            except RuntimeError:
+                pass
+
+    async def _flush(self):
+        await asyncio.sleep(0)  # Regroupe les invalidations de la même itération
+        try:
+            async with self._get_engine().connect() as conn:
+                await self._notify(conn)
+        except Exception as e:
+            logger.error(f"❌ Diffusion des invalidations: {e}")
+
+    async def _notify(self, conn):
+        if not self._pending:
+            return
+        user_ids: List[int] = list(self._pending)
+        self._pending.clear()
+        # Charge utile limitée à 8000 octets : découpée par paquets
+        for i in range(0, len(user_ids), 400):
+            chunk = ",".join(str(user_id) for user_id in user_ids[i:i + 400])
+            await conn.execute(_NOTIFY, {"channel": self.CHANNEL, "payload": f"{self.instance_id}:{chunk}"})
+            self.notify_sent += 1
+
+    def _handle_notification(self, connection, pid, channel, payload: str):
+        instance, _, ids = payload.partition(":")
+        if instance == self.instance_id or self._on_invalidate is None:
+            return
+        self.notify_received += 1
+        for user_id in ids.split(","):
+            try:
+                self._on_invalidate(int(user_id))
+            except ValueError:
+                continue
+
+    def get_stats(self) -> Dict:
+        """Statistiques de coordination"""
+        return {
+            "enabled": self.enabled,
+            "instance": self.instance_id,
+            "listening": self._listener is not None,
+            "active_users": len(self._locks),
+            "locks": self.lock_count,
+            "lock_timeouts": self.lock_timeouts,
+            "lock_errors": self.lock_errors,
+            "pool_waits": self.pool_waits,
+            "notify_sent": self.notify_sent,
+            "notify_received": self.notify_received
+        }
+
+
+# Plusieurs instances derrière le webhook : "auto" = oui avec PostgreSQL
+# (verrous consultatifs et NOTIFY n'existent pas avec SQLite)
+_multi_instance = os.getenv("MULTI_INSTANCE", "auto").lower()
+
+# Instance globale (une par processus)
+coordinator = Coordinator(
+    enabled=IS_POSTGRES and _multi_instance in ("auto", "true"),
+    # Une connexion par update en cours : autant que de workers (mode file d'attente)
+    pool_size=int(os.getenv("COORDINATION_POOL_SIZE", os.getenv("UPDATE_WORKERS", "8"))),
+    lock_timeout=float(os.getenv("COORDINATION_LOCK_TIMEOUT", "30"))
+)
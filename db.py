@@ -1,36 +1,157 @@
+import asyncio
 import os
-from contextlib import contextmanager
-from sqlalchemy import create_engine, Column, Integer, BigInteger, Text, DateTime, Boolean, func
+import time
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import (
+    create_engine, Column, Integer, BigInteger, Float, Text, DateTime, Boolean, Index,
+    case, func, select, insert, update, delete, inspect, literal, or_, text
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateColumn
+
+from metrics import db_session_seconds
 
-# --- Vérification critique ---
+# --- Configuration ---
+# Rien n'est créé ni connecté à l'import : les moteurs le sont au premier
+# usage, le schéma au démarrage (init_db)
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError(
-        "❌ La variable d'environnement DATABASE_URL est manquante.\n"
-        "➡️ Dans Railway, assure-toi d'avoir ajouté une base PostgreSQL à ton service."
-    )
-
-# Configuration optimisée pour production
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,  # Vérification des connexions
-    pool_size=10,  # Connexions dans le pool
-    max_overflow=20,  # Connexions supplémentaires
-    pool_recycle=3600,  # Recycler les connexions après 1h
-    poolclass=QueuePool
-)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _require_database_url() -> str:
+    """Vérification critique, au premier accès à la base"""
+    if not DATABASE_URL:
+        raise RuntimeError(
+            "❌ La variable d'environnement DATABASE_URL est manquante.\n"
+            "➡️ Dans Railway, assure-toi d'avoir ajouté une base PostgreSQL à ton service."
+        )
+    return DATABASE_URL
+
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
+_engine = None
+
+
+def get_engine():
+    """Moteur synchrone (configuration optimisée pour production), créé au premier usage"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            _require_database_url(),
+            echo=False,
+            pool_pre_ping=True,  # Vérification des connexions
+            pool_size=10,  # Connexions dans le pool
+            max_overflow=20,  # Connexions supplémentaires
+            pool_recycle=3600,  # Recycler les connexions après 1h
+            poolclass=QueuePool
+        )
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+# --- Moteur asynchrone (handlers) ---
+# Même base, driver async : les handlers ne bloquent plus la boucle d'événements
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def _async_database_url(url: str):
+    """Convertit l'URL synchrone (psycopg2) en URL pour le driver async"""
+    parsed = make_url(url)
+    async_driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if async_driver:
+        parsed = parsed.set(drivername=async_driver)
+    return parsed
+
+
+# Coordination multi-instances (verrous consultatifs, NOTIFY, seaux partagés) :
+# PostgreSQL uniquement, sans effet avec SQLite
+IS_POSTGRES = bool(DATABASE_URL) and make_url(DATABASE_URL).get_backend_name() == "postgresql"
+
+
+def create_coordination_engine(pool_size: int = 10, lock_timeout: float = 30.0):
+    """
+    Moteur async séparé pour les verrous consultatifs et LISTEN
+
+    Ces connexions restent occupées pendant tout le traitement d'une update :
+    un pool dédié évite d'épuiser celui des requêtes (autocommit, aucune
+    transaction ouverte pendant l'attente). lock_timeout borne l'attente
+    d'un verrou (0 = illimitée).
+    """
+    return create_async_engine(
+        _async_database_url(_require_database_url()),
+        echo=False,
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=0,
+        poolclass=AsyncAdaptedQueuePool,
+        isolation_level="AUTOCOMMIT",
+        connect_args={"server_settings": {"lock_timeout": str(int(lock_timeout * 1000))}}
+    )
+
+
+# expire_on_commit=False : les objets restent lisibles après le commit
+# (un accès paresseux hors session est impossible en async)
+AsyncSessionLocal = async_sessionmaker(
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+_async_engine = None
+
+
+def get_async_engine():
+    """Moteur asynchrone, créé au premier usage"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(
+            _async_database_url(_require_database_url()),
+            echo=False,
+            pool_pre_ping=True,
+            pool_size=10,
+            max_overflow=20,
+            pool_recycle=3600,
+            poolclass=AsyncAdaptedQueuePool
+        )
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+
+async def dispose_engines():
+    """Ferme les connexions des moteurs déjà créés"""
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def __getattr__(name: str):
+    """db.engine / db.async_engine : créés au premier accès"""
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 class UserPreferences(Base):
     """Préférences utilisateur avec tous les paramètres"""
     __tablename__ = "user_preferences"
+    # Récupère les valeurs serveur (created_at, updated_at...) au flush :
+    # pas de rechargement paresseux, impossible avec une AsyncSession
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(BigInteger, unique=True, index=True, nullable=False)
@@ -43,6 +164,9 @@ class UserPreferences(Base):
     keyword_find = Column(Text, default="")
     keyword_replace = Column(Text, default="")
     
+    # Conserver la mise en forme (gras, liens...) via les entités Telegram
+    keep_formatting = Column(Boolean, default=False)
+    
     # Mode publication
     publish_mode = Column(Boolean, default=False)
     target_chat_id = Column(BigInteger, nullable=True)
@@ -64,10 +188,210 @@ class UserPreferences(Base):
 class MessageBuffer(Base):
     """Buffer temporaire pour le traitement en lot"""
     __tablename__ = "message_buffer"
+    # Comptage et pagination par clé sans parcourir la table.
+    # L'id (séquence) suit l'ordre d'insertion, sans les égalités ni les
+    # problèmes de précision d'un horodatage
+    __table_args__ = (
+        Index("ix_message_buffer_user_position", "user_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(BigInteger, index=True, nullable=False)
     message_text = Column(Text, nullable=False)
+    
+    # Média republié via son file_id (aucun nouvel upload)
+    media_type = Column(Text, nullable=True)  # None = texte (anciennes lignes)
+    media_file_id = Column(Text, nullable=True)
+    media_group_id = Column(Text, nullable=True)  # Album Telegram
+    entities = Column(Text, nullable=True)  # Mise en forme (JSON des MessageEntity)
+    
+    # Message d'origine, republié tel quel via copy_message(s) quand rien n'est transformé
+    source_chat_id = Column(BigInteger, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class KeywordRule(Base):
+    """Règle de remplacement (plusieurs par utilisateur, appliquées en une seule passe)"""
+    __tablename__ = "keyword_rules"
+    __table_args__ = (
+        Index("ix_keyword_rules_user_position", "user_id", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, index=True, nullable=False)
+    find = Column(Text, nullable=False)
+    replace = Column(Text, nullable=False, default="")
+    
+    # Options
+    whole_word = Column(Boolean, nullable=False, default=False)  # Mot entier uniquement
+    case_insensitive = Column(Boolean, nullable=False, default=False)
+    is_regex = Column(Boolean, nullable=False, default=False)  # find est une expression régulière
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class PublishTarget(Base):
+    """Canal cible supplémentaire (le canal principal reste UserPreferences.target_chat_id)"""
+    __tablename__ = "publish_targets"
+    __table_args__ = (
+        Index("ix_publish_targets_user_chat", "user_id", "chat_id", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+def encode_targets(chat_ids) -> str:
+    """Cibles supplémentaires figées dans un job : "id,id,..." (None si aucune)"""
+    return ",".join(str(chat_id) for chat_id in chat_ids) or None
+
+
+def decode_targets(value: str) -> tuple:
+    """Inverse de encode_targets"""
+    return tuple(int(chat_id) for chat_id in value.split(",")) if value else ()
+
+
+def encode_pending_targets(progress: dict) -> str:
+    """Cibles restantes d'un message de l'outbox : "id" ou "id:morceaux déjà reçus", séparés par des virgules"""
+    return ",".join(f"{chat_id}:{done}" if done else str(chat_id) for chat_id, done in progress.items()) or None
+
+
+def decode_pending_targets(value: str) -> dict:
+    """Inverse de encode_pending_targets : chat_id -> morceaux déjà reçus"""
+    progress = {}
+    for target in value.split(",") if value else ():
+        chat_id, _, done = target.partition(":")
+        progress[int(chat_id)] = int(done or 0)
+    return progress
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class PublishJob(Base):
+    """Traitement massif persistant : survit aux redémarrages, repris par n'importe quelle instance"""
+    __tablename__ = "publish_jobs"
+    __table_args__ = (
+        Index("ix_publish_jobs_claim", "status", "next_attempt_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, index=True, nullable=False)
+    target_chat_id = Column(BigInteger, nullable=True)  # None = transformer sans publier
+    extra_targets = Column(Text, nullable=True)  # Cibles supplémentaires (encode_targets)
+    total = Column(Integer, nullable=False, default=0)
+    status = Column(Text, nullable=False, default="pending")  # pending | completed
+    
+    # Message de progression à mettre à jour
+    status_chat_id = Column(BigInteger, nullable=True)
+    status_message_id = Column(Integer, nullable=True)
+    
+    # Bail : instance qui traite le job, jusqu'à quand (renouvelé pendant le traitement)
+    owner = Column(Text, nullable=True)
+    lease_until = Column(DateTime(timezone=True), nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=_utcnow)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class OutboxMessage(Base):
+    """Message d'un job persistant, marqué individuellement une fois publié"""
+    __tablename__ = "publish_outbox"
+    __table_args__ = (
+        Index("ix_publish_outbox_job_position", "job_id", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    
+    # Copie de la ligne du buffer
+    message_text = Column(Text, nullable=False)
+    media_type = Column(Text, nullable=True)
+    media_file_id = Column(Text, nullable=True)
+    media_group_id = Column(Text, nullable=True)
+    entities = Column(Text, nullable=True)
+    source_chat_id = Column(BigInteger, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
+    
+    # pending | sending | done | skipped | failed
+    status = Column(Text, nullable=False, default="pending")
+    # Échec sur une partie des cibles : seules celles-ci sont retentées, à partir
+    # du premier morceau non reçu (encode_pending_targets)
+    pending_targets = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=_utcnow)
+    last_error = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class ScheduledPost(Base):
+    """
+    Message du buffer programmé (/schedule, /drip)
+    
+    Supprimé de la table à l'échéance, quand il passe dans l'outbox :
+    la table ne contient que des publications à venir.
+    """
+    __tablename__ = "scheduled_posts"
+    __table_args__ = (
+        Index("ix_scheduled_posts_publish_at", "publish_at", "id"),
+        Index("ix_scheduled_posts_user", "user_id", "publish_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, nullable=False)
+    target_chat_id = Column(BigInteger, nullable=True)  # Figé à la programmation
+    extra_targets = Column(Text, nullable=True)  # Cibles supplémentaires (encode_targets)
+    publish_at = Column(DateTime(timezone=True), nullable=False)
+    
+    # Copie de la ligne du buffer
+    message_text = Column(Text, nullable=False)
+    media_type = Column(Text, nullable=True)
+    media_file_id = Column(Text, nullable=True)
+    media_group_id = Column(Text, nullable=True)
+    entities = Column(Text, nullable=True)
+    source_chat_id = Column(BigInteger, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class RateBucket(Base):
+    """Seau à jetons partagé par toutes les instances (limiteur de débit)"""
+    __tablename__ = "rate_buckets"
+    
+    key = Column(Text, primary_key=True)  # "global" ou "chat:<chat_id>"
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    blocked_until = Column(DateTime(timezone=True), nullable=True)  # RetryAfter
+
+
+class MediaGroup(Base):
+    """Album en cours de regroupement : instance qui le publiera (plusieurs instances)"""
+    __tablename__ = "media_groups"
+    
+    media_group_id = Column(Text, primary_key=True)
+    owner = Column(Text, nullable=False)  # Première instance à avoir reçu un élément
+    last_item_at = Column(DateTime(timezone=True), nullable=False)
+    # Publication par une autre instance si `owner` a disparu
+    user_id = Column(BigInteger, nullable=True)
+    chat_id = Column(BigInteger, nullable=True)
+
+
+class MediaGroupItem(Base):
+    """Élément d'album reçu par n'importe quelle instance, en attente de publication"""
+    __tablename__ = "media_group_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    media_group_id = Column(Text, nullable=False, index=True)
+    message_id = Column(BigInteger, nullable=False)
+    item = Column(Text, nullable=False)  # JSON (type, file_id, légende, entités)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -82,15 +406,130 @@ class BotSettings(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
-# Créer les tables
-Base.metadata.create_all(bind=engine)
+# --- Schéma (migrations) ---
+# Appliquées au démarrage par init_db(), jamais à l'import. Chaque migration
+# s'exécute une seule fois, dans l'ordre ; la version atteinte est enregistrée
+# dans bot_settings. Une table ou une colonne nouvelle = une migration ajoutée
+# à la fin de MIGRATIONS.
+SCHEMA_VERSION_KEY = "schema_version"
+
+# Verrou consultatif des migrations (espace de noms des verrous du bot, voir
+# coordination.lock_key ; l'user_id 0 n'existe pas) : une instance à la fois
+_SCHEMA_LOCK = 0x54 << 56
+
+
+def _create_tables(conn):
+    """Tables absentes"""
+    Base.metadata.create_all(conn)
+
+
+def _add_column(conn, column):
+    """Ajoute une colonne du modèle si la table ne l'a pas encore"""
+    existing = {info["name"] for info in inspect(conn).get_columns(column.table.name)}
+    if column.name not in existing:
+        column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f"ALTER TABLE {column.table.name} ADD COLUMN {column_ddl}")
+
+
+def _add_missing_columns(conn):
+    """
+    Colonnes et index apparus avant les migrations versionnées
+    (create_all ne modifie pas les tables existantes)
+    
+    Les nouvelles colonnes doivent être nullables ou avoir un server_default.
+    """
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            _add_column(conn, column)
+    
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _create_media_group_tables(conn):
+    """Albums regroupés entre instances"""
+    MediaGroup.__table__.create(conn, checkfirst=True)
+    MediaGroupItem.__table__.create(conn, checkfirst=True)
+
+
+def _add_outbox_pending_targets(conn):
+    """Cibles restant à servir d'un message de l'outbox"""
+    _add_column(conn, OutboxMessage.__table__.c.pending_targets)
+
+
+def _add_media_group_origin(conn):
+    """Utilisateur et conversation d'un album, pour le reprendre sans son instance"""
+    _add_column(conn, MediaGroup.__table__.c.user_id)
+    _add_column(conn, MediaGroup.__table__.c.chat_id)
+
+
+MIGRATIONS = (
+    _create_tables,
+    _add_missing_columns,
+    _create_media_group_tables,
+    _add_outbox_pending_targets,
+    _add_media_group_origin,
+)
+
+
+def _schema_version(conn) -> int:
+    if not inspect(conn).has_table(BotSettings.__tablename__):
+        return 0
+    value = conn.execute(
+        select(BotSettings.value).where(BotSettings.key == SCHEMA_VERSION_KEY)
+    ).scalar()
+    return int(value) if value else 0
+
+
+def _migrate(conn) -> tuple:
+    """Applique les migrations en attente : (version avant, version après)"""
+    if IS_POSTGRES:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _SCHEMA_LOCK})
+    
+    version = _schema_version(conn)
+    for migration in MIGRATIONS[version:]:
+        migration(conn)
+    
+    latest = len(MIGRATIONS)
+    if version < latest:
+        result = conn.execute(
+            update(BotSettings).where(BotSettings.key == SCHEMA_VERSION_KEY).values(value=str(latest))
+        )
+        if not result.rowcount:
+            conn.execute(insert(BotSettings).values(key=SCHEMA_VERSION_KEY, value=str(latest)))
+    return version, latest
+
+
+_schema_ready = False
+_schema_lock = asyncio.Lock()
+
+
+async def init_db() -> tuple:
+    """
+    Met le schéma à jour (une seule fois par processus, les appels
+    simultanés attendent la même exécution)
+    
+    Returns:
+        (version avant, version après)
+    """
+    global _schema_ready
+    async with _schema_lock:
+        if _schema_ready:
+            return len(MIGRATIONS), len(MIGRATIONS)
+        async with get_async_engine().begin() as conn:
+            versions = await conn.run_sync(_migrate)
+        _schema_ready = True
+        return versions
 
 
 # --- Context Manager pour la DB ---
 @contextmanager
 def get_db():
     """Context manager sécurisé pour les sessions DB"""
+    get_engine()
     db = SessionLocal()
+    start = time.perf_counter()
     try:
         yield db
         db.commit()
@@ -99,6 +538,7 @@ def get_db():
         raise e
     finally:
         db.close()
+        db_session_seconds.observe(time.perf_counter() - start, "sync")
 
 
 def get_or_create_user(user_id: int) -> UserPreferences:
@@ -140,4 +580,779 @@ def add_to_buffer(user_id: int, text: str):
     """Ajoute un message au buffer"""
     with get_db() as db:
         buffer_msg = MessageBuffer(user_id=user_id, message_text=text)
-        db.add(buffer_msg)
\ No newline at end of file
+        db.add(buffer_msg)
+
+
+# --- Context Manager async pour la DB ---
+@asynccontextmanager
+async def get_async_db():
+    """Équivalent async de get_db() pour les coroutines (handlers)"""
+    get_async_engine()
+    db = AsyncSessionLocal()
+    start = time.perf_counter()
+    try:
+        yield db
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+    finally:
+        await db.close()
+        db_session_seconds.observe(time.perf_counter() - start, "async")
+
+
+async def get_user_prefs_async(db: AsyncSession, user_id: int, create: bool = True):
+    """Charge les préférences dans une session existante (création optionnelle)"""
+    result = await db.execute(
+        select(UserPreferences).where(UserPreferences.user_id == user_id)
+    )
+    prefs = result.scalar_one_or_none()
+    if not prefs and create:
+        prefs = UserPreferences(user_id=user_id)
+        db.add(prefs)
+        await db.flush()  # Pour obtenir l'ID et les valeurs par défaut
+    return prefs
+
+
+async def get_or_create_user_async(user_id: int) -> UserPreferences:
+    """Récupère ou crée un utilisateur (async)"""
+    async with get_async_db() as db:
+        return await get_user_prefs_async(db, user_id)
+
+
+async def clear_buffer_async(user_id: int, db: AsyncSession = None):
+    """Vide le buffer d'un utilisateur (async, session existante optionnelle)"""
+    if db is None:
+        async with get_async_db() as db:
+            return await clear_buffer_async(user_id, db)
+    await db.execute(delete(MessageBuffer).where(MessageBuffer.user_id == user_id))
+
+
+async def count_buffer_messages_async(user_id: int, db: AsyncSession = None) -> int:
+    """Nombre de messages dans le buffer (COUNT sur l'index, sans charger les lignes)"""
+    if db is None:
+        async with get_async_db() as db:
+            return await count_buffer_messages_async(user_id, db)
+    return await db.scalar(
+        select(func.count()).select_from(MessageBuffer).where(MessageBuffer.user_id == user_id)
+    )
+
+
+async def add_to_buffer_async(
+    user_id: int,
+    text: str,
+    db: AsyncSession = None,
+    media_type: str = None,
+    media_file_id: str = None,
+    media_group_id: str = None,
+    entities: str = None,
+    source_chat_id: int = None,
+    source_message_id: int = None
+):
+    """Ajoute un message (texte ou média) au buffer (async, session existante optionnelle)"""
+    if db is None:
+        async with get_async_db() as db:
+            return await add_to_buffer_async(
+                user_id, text, db, media_type, media_file_id, media_group_id, entities,
+                source_chat_id, source_message_id
+            )
+    db.add(MessageBuffer(
+        user_id=user_id,
+        message_text=text,
+        media_type=media_type,
+        media_file_id=media_file_id,
+        media_group_id=media_group_id,
+        entities=entities,
+        source_chat_id=source_chat_id,
+        source_message_id=source_message_id
+    ))
+    await db.flush()  # Visible immédiatement pour les requêtes de la même session
+
+
+# --- Règles de remplacement (async) ---
+async def get_keyword_rules_async(user_id: int, db: AsyncSession = None) -> list:
+    """Règles de l'utilisateur, dans l'ordre de création"""
+    if db is None:
+        async with get_async_db() as db:
+            return await get_keyword_rules_async(user_id, db)
+    result = await db.execute(
+        select(KeywordRule)
+        .where(KeywordRule.user_id == user_id)
+        .order_by(KeywordRule.id)
+    )
+    return list(result.scalars().all())
+
+
+async def count_keyword_rules_async(user_id: int, db: AsyncSession = None) -> int:
+    """Nombre de règles de l'utilisateur"""
+    if db is None:
+        async with get_async_db() as db:
+            return await count_keyword_rules_async(user_id, db)
+    return await db.scalar(
+        select(func.count()).select_from(KeywordRule).where(KeywordRule.user_id == user_id)
+    )
+
+
+async def add_keyword_rules_async(user_id: int, rules: list, db: AsyncSession = None):
+    """Ajoute des règles (objets avec find, replace, whole_word, case_insensitive, is_regex)"""
+    if db is None:
+        async with get_async_db() as db:
+            return await add_keyword_rules_async(user_id, rules, db)
+    db.add_all([
+        KeywordRule(
+            user_id=user_id,
+            find=rule.find,
+            replace=rule.replace,
+            whole_word=rule.whole_word,
+            case_insensitive=rule.case_insensitive,
+            is_regex=rule.is_regex
+        )
+        for rule in rules
+    ])
+    await db.flush()
+
+
+async def clear_keyword_rules_async(user_id: int, db: AsyncSession = None):
+    """Supprime toutes les règles de l'utilisateur"""
+    if db is None:
+        async with get_async_db() as db:
+            return await clear_keyword_rules_async(user_id, db)
+    await db.execute(delete(KeywordRule).where(KeywordRule.user_id == user_id))
+
+
+async def get_publish_targets_async(user_id: int, db: AsyncSession = None) -> list:
+    """Cibles supplémentaires de l'utilisateur, dans l'ordre d'ajout"""
+    if db is None:
+        async with get_async_db() as db:
+            return await get_publish_targets_async(user_id, db)
+    return list((await db.execute(
+        select(PublishTarget.chat_id)
+        .where(PublishTarget.user_id == user_id)
+        .order_by(PublishTarget.id)
+    )).scalars())
+
+
+async def add_publish_targets_async(user_id: int, chat_ids: list, db: AsyncSession = None) -> int:
+    """Ajoute des cibles (celles déjà présentes sont ignorées) ; retourne le nombre ajouté"""
+    if db is None:
+        async with get_async_db() as db:
+            return await add_publish_targets_async(user_id, chat_ids, db)
+    existing = set(await get_publish_targets_async(user_id, db))
+    new = [chat_id for chat_id in dict.fromkeys(chat_ids) if chat_id not in existing]
+    if new:
+        await db.execute(insert(PublishTarget), [
+            {"user_id": user_id, "chat_id": chat_id} for chat_id in new
+        ])
+    return len(new)
+
+
+async def remove_publish_targets_async(user_id: int, chat_ids: list = None, db: AsyncSession = None) -> int:
+    """Retire des cibles (toutes si chat_ids est None) ; retourne le nombre retiré"""
+    if db is None:
+        async with get_async_db() as db:
+            return await remove_publish_targets_async(user_id, chat_ids, db)
+    query = delete(PublishTarget).where(PublishTarget.user_id == user_id)
+    if chat_ids is not None:
+        query = query.where(PublishTarget.chat_id.in_(chat_ids))
+    return (await db.execute(query)).rowcount
+
+
+# --- Paramètres globaux (async) ---
+async def get_setting_async(key: str, db: AsyncSession = None):
+    """
+    Paramètre global
+    
+    Returns:
+        (valeur, date de dernière écriture), None si absent
+    """
+    if db is None:
+        async with get_async_db() as db:
+            return await get_setting_async(key, db)
+    row = (await db.execute(
+        select(BotSettings.value, BotSettings.created_at, BotSettings.updated_at)
+        .where(BotSettings.key == key)
+    )).first()
+    if row is None:
+        return None
+    return row.value, row.updated_at or row.created_at
+
+
+async def set_setting_async(key: str, value: str, db: AsyncSession = None):
+    """Écrit un paramètre global (créé si absent)"""
+    if db is None:
+        async with get_async_db() as db:
+            return await set_setting_async(key, value, db)
+    result = await db.execute(
+        update(BotSettings).where(BotSettings.key == key).values(value=value)
+    )
+    if not result.rowcount:
+        db.add(BotSettings(key=key, value=value))
+
+
+async def get_global_stats_async(db: AsyncSession = None) -> dict:
+    """Compteurs globaux (utilisateurs, messages, buffers) en une seule requête"""
+    if db is None:
+        async with get_async_db() as db:
+            return await get_global_stats_async(db)
+    row = (await db.execute(
+        select(
+            func.count(),
+            func.sum(case((UserPreferences.publish_mode == True, 1), else_=0)),
+            func.sum(case((UserPreferences.buffer_mode == True, 1), else_=0)),
+            func.sum(UserPreferences.messages_processed),
+            func.sum(UserPreferences.messages_failed),
+            select(func.count()).select_from(MessageBuffer).scalar_subquery()
+        ).select_from(UserPreferences)
+    )).one()
+    return {
+        "total_users": row[0] or 0,
+        "with_publish_mode": row[1] or 0,
+        "with_buffer_mode": row[2] or 0,
+        "total_processed": row[3] or 0,
+        "total_failed": row[4] or 0,
+        "buffered_messages": row[5] or 0
+    }
+
+
+# --- Traitements massifs persistants (async) ---
+# Un job est réclamé par une seule instance à la fois (bail + SKIP LOCKED),
+# ses messages sont publiés dans l'ordre et marqués un par un
+OUTBOX_OPEN_STATUSES = ("pending", "sending")
+
+
+async def enqueue_publish_job_async(
+    user_id: int,
+    target_chat_id: int = None,
+    status_chat_id: int = None,
+    status_message_id: int = None,
+    db: AsyncSession = None,
+    extra_targets: tuple = ()
+) -> PublishJob:
+    """
+    Transfère le buffer de l'utilisateur dans un nouveau job persistant
+    
+    Copie (INSERT ... SELECT) puis vidage du buffer dans la même transaction :
+    après un redémarrage, rien n'est perdu ni publié deux fois.
+    """
+    if db is None:
+        async with get_async_db() as db:
+            return await enqueue_publish_job_async(
+                user_id, target_chat_id, status_chat_id, status_message_id, db, extra_targets
+            )
+    job = PublishJob(
+        user_id=user_id,
+        target_chat_id=target_chat_id,
+        extra_targets=encode_targets(extra_targets),
+        status_chat_id=status_chat_id,
+        status_message_id=status_message_id,
+        next_attempt_at=_utcnow()
+    )
+    db.add(job)
+    await db.flush()  # Pour obtenir l'ID
+    
+    copied = [
+        "message_text", "media_type", "media_file_id", "media_group_id",
+        "entities", "source_chat_id", "source_message_id"
+    ]
+    result = await db.execute(
+        insert(OutboxMessage).from_select(
+            ["job_id", "user_id", *copied, "status", "attempts", "next_attempt_at"],
+            select(
+                literal(job.id), MessageBuffer.user_id,
+                *(getattr(MessageBuffer, name) for name in copied),
+                literal("pending"), literal(0), literal(job.next_attempt_at, DateTime(timezone=True))
+            )
+            .where(MessageBuffer.user_id == user_id)
+            .order_by(MessageBuffer.id)
+        )
+    )
+    job.total = result.rowcount
+    await db.execute(delete(MessageBuffer).where(MessageBuffer.user_id == user_id))
+    return job
+
+
+async def claim_publish_job_async(owner: str, lease_seconds: float) -> PublishJob:
+    """
+    Réclame un job à traiter (FOR UPDATE SKIP LOCKED : une instance par job)
+    
+    Un job dont le bail a expiré (instance arrêtée en cours de route) est
+    réclamable à nouveau : c'est ainsi que les jobs reprennent au démarrage.
+    La prise du bail est un UPDATE conditionnel : sans SKIP LOCKED (SQLite),
+    deux workers ne peuvent toujours pas réclamer le même job.
+    """
+    now = _utcnow()
+    available = or_(PublishJob.lease_until.is_(None), PublishJob.lease_until < now)
+    async with get_async_db() as db:
+        job = (await db.execute(
+            select(PublishJob)
+            .where(
+                PublishJob.status == "pending",
+                PublishJob.next_attempt_at <= now,
+                available
+            )
+            .order_by(PublishJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )).scalar_one_or_none()
+        if job is None:
+            return None
+        
+        lease_until = now + timedelta(seconds=lease_seconds)
+        claimed = await db.execute(
+            update(PublishJob)
+            .where(PublishJob.id == job.id, available)
+            .values(owner=owner, lease_until=lease_until)
+            .execution_options(synchronize_session=False)
+        )
+        if not claimed.rowcount:
+            return None
+        
+        db.expunge(job)  # Copie détachée : lue par le worker, jamais réécrite
+        job.owner = owner
+        job.lease_until = lease_until
+        return job
+
+
+async def renew_publish_job_async(job_id: int, owner: str, lease_seconds: float) -> bool:
+    """Prolonge le bail ; False si le job a été repris par une autre instance"""
+    async with get_async_db() as db:
+        result = await db.execute(
+            update(PublishJob)
+            .where(PublishJob.id == job_id, PublishJob.owner == owner)
+            .values(lease_until=_utcnow() + timedelta(seconds=lease_seconds))
+        )
+        return result.rowcount > 0
+
+
+async def get_outbox_counts_async(job_id: int, db: AsyncSession = None) -> dict:
+    """Nombre de messages du job par statut"""
+    if db is None:
+        async with get_async_db() as db:
+            return await get_outbox_counts_async(job_id, db)
+    return dict((await db.execute(
+        select(OutboxMessage.status, func.count())
+        .where(OutboxMessage.job_id == job_id)
+        .group_by(OutboxMessage.status)
+    )).all())
+
+
+async def release_publish_job_async(job_id: int, owner: str) -> dict:
+    """
+    Libère le job après un passage : terminé s'il ne reste aucun message,
+    sinon reprogrammé à l'échéance du premier message restant (un passage
+    s'arrête au premier échec : la suite attend son nouvel essai)
+    
+    Returns:
+        Compteurs par statut des messages et "completed"
+    """
+    async with get_async_db() as db:
+        counts = await get_outbox_counts_async(job_id, db)
+        next_attempt_at = await db.scalar(
+            select(OutboxMessage.next_attempt_at)
+            .where(OutboxMessage.job_id == job_id, OutboxMessage.status.in_(OUTBOX_OPEN_STATUSES))
+            .order_by(OutboxMessage.id)
+            .limit(1)
+        )
+        
+        values = {"owner": None, "lease_until": None}
+        if next_attempt_at is None:
+            values.update(status="completed", finished_at=_utcnow())
+        else:
+            values["next_attempt_at"] = next_attempt_at
+        await db.execute(
+            update(PublishJob)
+            .where(PublishJob.id == job_id, PublishJob.owner == owner)
+            .values(**values)
+        )
+    counts["completed"] = next_attempt_at is None
+    return counts
+
+
+async def iter_outbox_messages_async(job_id: int, page_size: int = 100):
+    """
+    Messages du job restant à publier, dans l'ordre (pagination par clé)
+    
+    Produit des lignes (message_text, media_type, media_file_id, media_group_id,
+    entities, source_chat_id, source_message_id, pending_targets, attempts),
+    une session par page.
+    Les messages "sending" sont ceux d'une instance arrêtée pendant l'envoi :
+    ils sont republiés (au moins une fois). Pas de filtre sur l'échéance :
+    le job n'est réclamé qu'à celle de son premier message restant, et un
+    message en attente de nouvel essai ne doit pas être doublé par les suivants.
+    """
+    last_id = 0
+    while True:
+        async with get_async_db() as db:
+            rows = (await db.execute(
+                select(
+                    OutboxMessage.id,
+                    OutboxMessage.message_text,
+                    OutboxMessage.media_type,
+                    OutboxMessage.media_file_id,
+                    OutboxMessage.media_group_id,
+                    OutboxMessage.entities,
+                    OutboxMessage.source_chat_id,
+                    OutboxMessage.source_message_id,
+                    OutboxMessage.pending_targets,
+                    OutboxMessage.attempts
+                )
+                .where(
+                    OutboxMessage.job_id == job_id,
+                    OutboxMessage.id > last_id,
+                    OutboxMessage.status.in_(OUTBOX_OPEN_STATUSES)
+                )
+                .order_by(OutboxMessage.id)
+                .limit(page_size)
+            )).all()
+        
+        for row in rows:
+            yield row
+        
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+
+
+async def start_outbox_attempt_async(message_ids: list):
+    """Marque des messages en cours d'envoi (tentative comptée avant l'appel API)"""
+    async with get_async_db() as db:
+        await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(message_ids))
+            .values(status="sending", attempts=OutboxMessage.attempts + 1, updated_at=_utcnow())
+        )
+
+
+async def mark_outbox_messages_async(
+    message_ids: list,
+    status: str,
+    error: str = None,
+    next_attempt_at: datetime = None,
+    pending_targets: dict = None
+):
+    """
+    Statut final (done, skipped, failed) ou nouvel essai (pending + échéance)
+    
+    pending_targets : cibles restant à servir (échec partiel) -> morceaux
+    déjà reçus ; les autres cibles ont reçu tout le message
+    """
+    values = {"status": status, "last_error": error, "updated_at": _utcnow()}
+    if next_attempt_at is not None:
+        values["next_attempt_at"] = next_attempt_at
+    if pending_targets is not None:
+        values["pending_targets"] = encode_pending_targets(pending_targets)
+    async with get_async_db() as db:
+        await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(message_ids))
+            .values(**values)
+        )
+
+
+# --- Publications programmées ---
+# Champs recopiés tels quels du buffer vers scheduled_posts puis vers l'outbox
+_POST_FIELDS = (
+    "message_text", "media_type", "media_file_id", "media_group_id",
+    "entities", "source_chat_id", "source_message_id"
+)
+
+
+async def schedule_buffer_async(
+    user_id: int,
+    target_chat_id: int,
+    first_at: datetime,
+    interval: float = 0,
+    db: AsyncSession = None,
+    extra_targets: tuple = ()
+) -> tuple:
+    """
+    Programme le buffer de l'utilisateur puis le vide (même transaction)
+    
+    interval = 0 : tout le buffer à first_at ; sinon un message toutes les
+    `interval` secondes (mode goutte-à-goutte). Les éléments d'un même album
+    partagent leur créneau.
+    
+    Returns:
+        (nombre de messages programmés, échéance du dernier)
+    """
+    if db is None:
+        async with get_async_db() as db:
+            return await schedule_buffer_async(user_id, target_chat_id, first_at, interval, db, extra_targets)
+    rows = (await db.execute(
+        select(*(getattr(MessageBuffer, name) for name in _POST_FIELDS))
+        .where(MessageBuffer.user_id == user_id)
+        .order_by(MessageBuffer.id)
+    )).all()
+    if not rows:
+        return 0, None
+    
+    posts = []
+    slot = -1
+    previous_group = None
+    for row in rows:
+        if not (row.media_group_id and row.media_group_id == previous_group):
+            slot += 1
+        previous_group = row.media_group_id
+        posts.append({
+            "user_id": user_id,
+            "target_chat_id": target_chat_id,
+            "extra_targets": encode_targets(extra_targets),
+            "publish_at": first_at + timedelta(seconds=interval * slot),
+            **row._asdict()
+        })
+    
+    await db.execute(insert(ScheduledPost), posts)
+    await db.execute(delete(MessageBuffer).where(MessageBuffer.user_id == user_id))
+    return len(posts), posts[-1]["publish_at"]
+
+
+async def get_scheduled_summary_async(user_id: int, db: AsyncSession = None) -> tuple:
+    """(nombre de publications programmées, prochaine échéance)"""
+    if db is None:
+        async with get_async_db() as db:
+            return await get_scheduled_summary_async(user_id, db)
+    row = (await db.execute(
+        select(func.count(), func.min(ScheduledPost.publish_at))
+        .where(ScheduledPost.user_id == user_id)
+    )).one()
+    return row[0], row[1]
+
+
+async def cancel_scheduled_posts_async(user_id: int, db: AsyncSession = None) -> int:
+    """Annule les publications programmées de l'utilisateur"""
+    if db is None:
+        async with get_async_db() as db:
+            return await cancel_scheduled_posts_async(user_id, db)
+    result = await db.execute(delete(ScheduledPost).where(ScheduledPost.user_id == user_id))
+    return result.rowcount
+
+
+async def load_scheduled_posts_async(until: datetime, limit: int = 10000) -> list:
+    """Échéances jusqu'à `until` (index sur publish_at) : [(id, publish_at)]"""
+    async with get_async_db() as db:
+        return (await db.execute(
+            select(ScheduledPost.id, ScheduledPost.publish_at)
+            .where(ScheduledPost.publish_at <= until)
+            .order_by(ScheduledPost.publish_at, ScheduledPost.id)
+            .limit(limit)
+        )).all()
+
+
+async def dispatch_scheduled_posts_async(post_ids: list) -> list:
+    """
+    Transfère des publications arrivées à échéance dans l'outbox
+    
+    Un job par (utilisateur, cibles). DELETE ... RETURNING : une publication
+    n'est transférée qu'une fois, même si plusieurs instances la voient
+    échoir ; celles déjà annulées sont ignorées.
+    
+    Returns:
+        Jobs créés : [(id, user_id, nombre de messages)]
+    """
+    async with get_async_db() as db:
+        rows = (await db.execute(
+            delete(ScheduledPost)
+            .where(ScheduledPost.id.in_(post_ids))
+            .returning(
+                ScheduledPost.id, ScheduledPost.user_id, ScheduledPost.target_chat_id,
+                ScheduledPost.extra_targets, ScheduledPost.publish_at, *(getattr(ScheduledPost, name) for name in _POST_FIELDS)
+            )
+        )).all()
+        
+        groups = {}
+        for row in sorted(rows, key=lambda row: (row.publish_at, row.id)):
+            groups.setdefault((row.user_id, row.target_chat_id, row.extra_targets), []).append(row)
+        
+        jobs = []
+        now = _utcnow()
+        for (user_id, target_chat_id, extra_targets), posts in groups.items():
+            job = PublishJob(
+                user_id=user_id, target_chat_id=target_chat_id, extra_targets=extra_targets,
+                total=len(posts), next_attempt_at=now
+            )
+            db.add(job)
+            await db.flush()  # Pour obtenir l'ID
+            await db.execute(insert(OutboxMessage), [
+                {
+                    "job_id": job.id,
+                    "user_id": user_id,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    **{name: getattr(post, name) for name in _POST_FIELDS}
+                }
+                for post in posts
+            ])
+            jobs.append((job.id, user_id, len(posts)))
+        return jobs
+
+
+# --- Seaux à jetons partagés (PostgreSQL) ---
+# Un seul UPSERT atomique par réservation ; l'horloge de la base fait foi
+# pour toutes les instances
+_RESERVE_TOKENS = text("""
+    INSERT INTO rate_buckets (key, tokens, updated_at)
+    VALUES (:key, CAST(:capacity AS float8) - :tokens, clock_timestamp())
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = LEAST(
+            CAST(:capacity AS float8),
+            rate_buckets.tokens
+                + EXTRACT(EPOCH FROM clock_timestamp() - rate_buckets.updated_at)::float8 * :rate
+        ) - :tokens,
+        updated_at = clock_timestamp()
+    WHERE NOT :conditional OR (
+        LEAST(
+            CAST(:capacity AS float8),
+            rate_buckets.tokens
+                + EXTRACT(EPOCH FROM clock_timestamp() - rate_buckets.updated_at)::float8 * :rate
+        ) >= :tokens
+        AND (rate_buckets.blocked_until IS NULL OR rate_buckets.blocked_until <= clock_timestamp())
+    )
+    RETURNING
+        tokens,
+        GREATEST(COALESCE(EXTRACT(EPOCH FROM blocked_until - clock_timestamp())::float8, 0), 0) AS blocked
+""")
+
+_BLOCK_BUCKET = text("""
+    INSERT INTO rate_buckets (key, tokens, updated_at, blocked_until)
+    VALUES (:key, 0, clock_timestamp(), clock_timestamp() + make_interval(secs => :seconds))
+    ON CONFLICT (key) DO UPDATE SET
+        blocked_until = GREATEST(
+            COALESCE(rate_buckets.blocked_until, clock_timestamp()),
+            clock_timestamp() + make_interval(secs => :seconds)
+        )
+""")
+
+
+async def reserve_rate_tokens_async(
+    key: str,
+    rate: float,
+    capacity: float,
+    tokens: float = 1,
+    conditional: bool = False
+):
+    """
+    Réserve des jetons dans un seau partagé
+    
+    Returns:
+        Délai d'attente en secondes (réservation faite dans tous les cas),
+        ou avec conditional=True : None si les jetons ne sont pas disponibles
+        tout de suite (rien n'est réservé)
+    """
+    async with get_async_engine().begin() as conn:
+        row = (await conn.execute(_RESERVE_TOKENS, {
+            "key": key,
+            "rate": float(rate),
+            "capacity": float(capacity),
+            "tokens": float(tokens),
+            "conditional": conditional
+        })).first()
+    if row is None:
+        return None
+    delay = -row.tokens / rate if row.tokens < 0 else 0.0
+    return max(delay, row.blocked)
+
+
+async def block_rate_bucket_async(key: str, seconds: float):
+    """Bloque un seau partagé (RetryAfter reçu par une instance, appliqué à toutes)"""
+    async with get_async_engine().begin() as conn:
+        await conn.execute(_BLOCK_BUCKET, {"key": key, "seconds": float(seconds)})
+
+
+# --- Albums regroupés entre instances (PostgreSQL) ---
+# Élément enregistré, puis album réclamé (ou simplement prolongé) en un seul UPSERT
+_STAGE_MEDIA_GROUP = text("""
+    INSERT INTO media_groups (media_group_id, owner, last_item_at, user_id, chat_id)
+    VALUES (:group_id, :owner, clock_timestamp(), :user_id, :chat_id)
+    ON CONFLICT (media_group_id) DO UPDATE SET last_item_at = clock_timestamp()
+    RETURNING owner
+""")
+
+# Album retiré seulement après `window` secondes sans nouvel élément
+_TAKE_MEDIA_GROUP = text("""
+    DELETE FROM media_groups
+    WHERE media_group_id = :group_id
+      AND last_item_at <= clock_timestamp() - make_interval(secs => :window)
+    RETURNING owner
+""")
+
+# Albums abandonnés (instance arrêtée sans stop()), quel que soit leur propriétaire
+_SWEEP_MEDIA_GROUPS = text("""
+    DELETE FROM media_groups
+    WHERE media_group_id IN (
+        SELECT media_group_id FROM media_groups
+        WHERE last_item_at <= clock_timestamp() - make_interval(secs => :age)
+        ORDER BY last_item_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING media_group_id, user_id, chat_id
+""")
+
+
+async def stage_media_group_item_async(
+    group_id: str,
+    message_id: int,
+    item: str,
+    owner: str,
+    user_id: int = None,
+    chat_id: int = None
+) -> bool:
+    """
+    Enregistre un élément d'album, quelle que soit l'instance qui l'a reçu
+    
+    Returns:
+        True si l'album est publié par `owner` (première instance à l'avoir reçu)
+    """
+    async with get_async_engine().begin() as conn:
+        await conn.execute(
+            insert(MediaGroupItem).values(media_group_id=group_id, message_id=message_id, item=item)
+        )
+        claimed_by = (await conn.execute(_STAGE_MEDIA_GROUP, {
+            "group_id": group_id, "owner": owner, "user_id": user_id, "chat_id": chat_id
+        })).scalar()
+    return claimed_by == owner
+
+
+async def take_media_group_async(group_id: str, window: float):
+    """
+    Retire un album complet (aucun élément depuis `window` secondes)
+    
+    Returns:
+        Éléments (JSON) triés par message_id ; None si l'album reçoit
+        encore des éléments, [] s'il a déjà été retiré
+    """
+    async with get_async_engine().begin() as conn:
+        if (await conn.execute(_TAKE_MEDIA_GROUP, {"group_id": group_id, "window": float(window)})).first() is None:
+            pending = await conn.scalar(
+                select(func.count()).select_from(MediaGroup).where(MediaGroup.media_group_id == group_id)
+            )
+            return None if pending else []
+        rows = (await conn.execute(
+            delete(MediaGroupItem)
+            .where(MediaGroupItem.media_group_id == group_id)
+            .returning(MediaGroupItem.message_id, MediaGroupItem.item)
+        )).all()
+    return [item for _, item in sorted(rows, key=lambda row: row[0])]
+
+
+async def take_stale_media_groups_async(age: float, limit: int = 20) -> list:
+    """
+    Retire les albums sans nouvel élément depuis `age` secondes, quel que soit leur propriétaire
+    
+    Returns:
+        [(media_group_id, user_id, chat_id, éléments JSON triés par message_id)]
+    """
+    async with get_async_engine().begin() as conn:
+        groups = (await conn.execute(_SWEEP_MEDIA_GROUPS, {"age": float(age), "limit": limit})).all()
+        if not groups:
+            return []
+        rows = (await conn.execute(
+            delete(MediaGroupItem)
+            .where(MediaGroupItem.media_group_id.in_([group[0] for group in groups]))
+            .returning(MediaGroupItem.media_group_id, MediaGroupItem.message_id, MediaGroupItem.item)
+        )).all()
+    items: dict = {}
+    for group_id, message_id, item in sorted(rows, key=lambda row: row[1]):
+        items.setdefault(group_id, []).append(item)
+    return [(group_id, user_id, chat_id, items.get(group_id, [])) for group_id, user_id, chat_id in groups]
@@ -1,15 +1,37 @@
+import os
+import html
+import json
 import logging
+from datetime import datetime, timezone
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
 
 from db import (
-    get_db, UserPreferences, get_or_create_user, 
-    clear_buffer, get_buffer_messages, add_to_buffer,
-    update_user_activity
+    get_async_db, UserPreferences, get_user_prefs_async,
+    clear_buffer_async, add_to_buffer_async,
+    count_buffer_messages_async, enqueue_publish_job_async,
+    get_keyword_rules_async, count_keyword_rules_async,
+    add_keyword_rules_async, clear_keyword_rules_async,
+    schedule_buffer_async, get_scheduled_summary_async, cancel_scheduled_posts_async,
+    get_publish_targets_async, add_publish_targets_async, remove_publish_targets_async
 )
 from keyboards import *
-from message_processor import handle_bulk_processing, validate_chat_id
+from prefs_cache import prefs_cache
+from rate_limiter import rate_limiter
+from media_group import media_group_aggregator
+from outbox import outbox_worker
+from scheduler import (
+    post_scheduler, parse_publish_time, parse_duration, format_local, MAX_DRIP_INTERVAL
+)
+from keyword_engine import keyword_engines, parse_rules, format_rule, MAX_KEYWORD_RULES
+from message_processor import (
+    send_parts_to_target, send_media_group_to_target, first_part_limit,
+    copy_messages_to_target, fan_out,
+    validate_chat_id, ALBUM_MEDIA_TYPES
+)
+from transform import PrefsSnapshot, transform_pipelines, CAPTION_LIMIT
+from profiling import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +40,15 @@ WAITING_PREFIX = "waiting_prefix"
 WAITING_SUFFIX = "waiting_suffix"
 WAITING_KEYWORD_FIND = "waiting_keyword_find"
 WAITING_KEYWORD_REPLACE = "waiting_keyword_replace"
+WAITING_KEYWORD_RULES = "waiting_keyword_rules"
 WAITING_TARGET_CHAT = "waiting_target_chat"
 
 # Images de bienvenue robustes (base64 ou URLs stables)
 WELCOME_IMAGE = "https://images.unsplash.com/photo-1614680376593-902f74cf0d41?w=800&q=80"
 
+# Nombre maximum de messages en attente par utilisateur
+BUFFER_QUOTA = int(os.getenv("BUFFER_QUOTA", "10000"))
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Commande /start avec interface complète"""
@@ -30,8 +56,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = user.id
     
     # Créer ou récupérer l'utilisateur
-    with get_db() as db:
-        prefs = db.query(UserPreferences).filter(UserPreferences.user_id == user_id).first()
+    async with get_async_db() as db:
+        prefs = await get_user_prefs_async(db, user_id, create=False)
         if not prefs:
             prefs = UserPreferences(user_id=user_id)
             db.add(prefs)
@@ -43,6 +69,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         prefs.conversation_state = ""
         prefs.buffer_mode = False
     
+    prefs_cache.invalidate(user_id)
+    
     welcome_text = (
         f"👋 <b>Bienvenue {user.first_name}!</b>\n\n"
         "🤖 <b>Bot de Messagerie Avancé v2.0</b>\n\n"
@@ -55,6 +83,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "💡 <b>Commandes rapides:</b>\n"
         "/start - Afficher ce menu\n"
         "/stats - Voir vos statistiques\n"
+        "/schedule - Programmer le buffer\n"
+        "/drip - Publier le buffer au compte-gouttes\n"
+        "/targets - Canaux de publication supplémentaires\n"
         "/reset - Tout réinitialiser\n\n"
         "📋 <b>Sélectionnez une option ci-dessous:</b>"
     )
@@ -74,7 +105,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="HTML"
         )
     
-    update_user_activity(user_id)
+    prefs_cache.touch(user_id)
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -89,12 +120,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "noop":
         return
     
-    with get_db() as db:
-        prefs = db.query(UserPreferences).filter(UserPreferences.user_id == user_id).first()
-        if not prefs:
-            prefs = UserPreferences(user_id=user_id)
-            db.add(prefs)
-            db.flush()
+    # Les statistiques affichées incluent les compteurs encore en mémoire
+    if data == "menu_stats":
+        await prefs_cache.flush()
+    
+    async with get_async_db() as db:
+        prefs = await get_user_prefs_async(db, user_id)
+        # Cache invalidé seulement si l'action modifie les paramètres (pas pour la navigation)
+        before = PrefsSnapshot.from_prefs(prefs)
         
         # Navigation dans les menus
         if data == "menu_main":
@@ -103,14 +136,21 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_edit_message(query, text, get_main_menu(), parse_mode="HTML")
         
         elif data == "menu_keyword":
+            rules = await get_keyword_rules_async(user_id, db)
             text = "🔄 <b>Remplacement de Mots-clés</b>\n\n"
             if prefs.keyword_find:
                 text += f"🔍 Chercher: <code>{prefs.keyword_find}</code>\n"
                 text += f"✨ Remplacer par: <code>{prefs.keyword_replace}</code>\n\n"
                 text += "Chaque occurrence sera remplacée automatiquement."
-            else:
+            elif not rules:
                 text += "Aucun remplacement défini."
-            await safe_edit_message(query, text, get_keyword_menu(prefs.keyword_find, prefs.keyword_replace), parse_mode="HTML")
+            if rules:
+                text += f"\n\n📚 <b>{len(rules)} règle(s):</b>\n"
+                for rule in rules[:10]:
+                    text += f"• <code>{html.escape(format_rule(rule), quote=False)}</code>\n"
+                if len(rules) > 10:
+                    text += f"… et {len(rules) - 10} autre(s)"
+            await safe_edit_message(query, text, get_keyword_menu(prefs.keyword_find, prefs.keyword_replace, len(rules)), parse_mode="HTML")
         
         elif data == "menu_publish":
             text = "📢 <b>Mode Publication</b>\n\n"
@@ -124,7 +164,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_edit_message(query, text, get_publish_menu(prefs.publish_mode, str(prefs.target_chat_id) if prefs.target_chat_id else ""), parse_mode="HTML")
         
         elif data == "menu_bulk":
-            buffer_count = len(get_buffer_messages(user_id))
+            buffer_count = await count_buffer_messages_async(user_id, db)
             text = "⚡ <b>Traitement Massif</b>\n\n"
             if prefs.buffer_mode:
                 text += f"🟢 Mode actif\n"
@@ -155,9 +195,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text += f"📌 Suffixe: <code>{prefs.suffix or '(vide)'}</code>\n"
             text += f"🔍 Chercher: <code>{prefs.keyword_find or '(vide)'}</code>\n"
             text += f"✨ Remplacer par: <code>{prefs.keyword_replace or '(vide)'}</code>\n"
+            text += f"📚 Règles de remplacement: {await count_keyword_rules_async(user_id, db)}\n"
+            text += f"🎨 Mise en forme: {'✅ Conservée' if prefs.keep_formatting else '❌ Texte brut'}\n"
             text += f"📢 Publication: {'✅ Activé' if prefs.publish_mode else '❌ Désactivé'}\n"
             if prefs.target_chat_id:
                 text += f"📍 Canal: <code>{prefs.target_chat_id}</code>\n"
+                extra = len(await get_publish_targets_async(user_id, db))
+                if extra:
+                    text += f"📡 Canaux supplémentaires: {extra} (/targets)\n"
             text += f"⚡ Buffer: {'🟢 Actif' if prefs.buffer_mode else '⚪ Inactif'}"
             await safe_edit_message(query, text, get_main_menu(), parse_mode="HTML")
         
@@ -178,8 +223,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             prefs.publish_mode = False
             prefs.target_chat_id = None
             prefs.buffer_mode = False
+            prefs.keep_formatting = False
             prefs.conversation_state = ""
-            clear_buffer(user_id)
+            await clear_buffer_async(user_id, db)
+            await cancel_scheduled_posts_async(user_id, db)
+            await remove_publish_targets_async(user_id, db=db)
+            await clear_keyword_rules_async(user_id, db)
+            keyword_engines.invalidate(user_id)
             
             text = "✅ <b>Réinitialisation réussie!</b>\n\n"
             text += "Tous vos paramètres ont été supprimés.\n"
@@ -215,6 +265,21 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text += "Exemple: <code>tarif exclusif</code>"
             await safe_edit_message(query, text, get_cancel_keyboard(), parse_mode="HTML")
         
+        elif data == "add_keyword_rules":
+            prefs.conversation_state = WAITING_KEYWORD_RULES
+            text = "📚 <b>Ajouter des règles</b>\n\n"
+            text += "Une règle par ligne:\n"
+            text += "<code>trouver => remplacer | options</code>\n\n"
+            text += "Options (facultatives):\n"
+            text += "• <code>mot</code> : mot entier uniquement\n"
+            text += "• <code>i</code> : ignorer majuscules/minuscules\n"
+            text += "• <code>regex</code> : le motif est une expression régulière\n\n"
+            text += "Exemple:\n"
+            text += "<code>prix => tarif exclusif | mot i\n"
+            text += "\\d+ ?€ => prix sur demande | regex</code>\n\n"
+            text += f"Maximum {MAX_KEYWORD_RULES} règles."
+            await safe_edit_message(query, text, get_cancel_keyboard(), parse_mode="HTML")
+        
         elif data == "set_target_chat":
             prefs.conversation_state = WAITING_TARGET_CHAT
             text = "📍 <b>Définir le canal cible</b>\n\n"
@@ -240,7 +305,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif data == "clear_keyword":
             prefs.keyword_find = ""
             prefs.keyword_replace = ""
-            text = "✅ <b>Remplacement supprimé</b>"
+            await clear_keyword_rules_async(user_id, db)
+            keyword_engines.invalidate(user_id)
+            text = "✅ <b>Remplacements supprimés</b>"
             await safe_edit_message(query, text, get_keyword_menu("", ""), parse_mode="HTML")
         
         # Toggle actions
@@ -255,13 +322,24 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             await safe_edit_message(query, text, get_publish_menu(prefs.publish_mode, str(prefs.target_chat_id) if prefs.target_chat_id else ""), parse_mode="HTML")
         
+        elif data == "toggle_formatting":
+            prefs.keep_formatting = not prefs.keep_formatting
+            if prefs.keep_formatting:
+                text = "🎨 <b>Mise en forme conservée ✅</b>\n\n"
+                text += "Gras, italique, liens... sont republiés tels quels,\n"
+                text += "même après préfixe, suffixe et remplacements."
+            else:
+                text = "🎨 <b>Mise en forme désactivée ❌</b>\n\n"
+                text += "Les messages sont republiés en texte brut."
+            await safe_edit_message(query, text, get_main_menu(), parse_mode="HTML")
+        
         elif data == "toggle_bulk":
             prefs.buffer_mode = not prefs.buffer_mode
             
             if not prefs.buffer_mode:
-                clear_buffer(user_id)
+                await clear_buffer_async(user_id, db)
             
-            buffer_count = len(get_buffer_messages(user_id))
+            buffer_count = await count_buffer_messages_async(user_id, db)
             status = "activé 🟢" if prefs.buffer_mode else "désactivé ⚪"
             text = f"⚡ <b>Mode buffer {status}</b>\n\n"
             
@@ -274,50 +352,38 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_edit_message(query, text, get_bulk_menu(prefs.buffer_mode, buffer_count), parse_mode="HTML")
         
         elif data == "clear_bulk":
-            clear_buffer(user_id)
+            await clear_buffer_async(user_id, db)
             text = "✅ <b>Buffer vidé</b>\n\nTous les messages en attente ont été supprimés."
             await safe_edit_message(query, text, get_bulk_menu(prefs.buffer_mode, 0), parse_mode="HTML")
         
         elif data == "process_bulk":
-            messages = get_buffer_messages(user_id)
+            buffer_count = await count_buffer_messages_async(user_id, db)
             
-            if not messages:
+            if not buffer_count:
                 text = "❌ <b>Aucun message à traiter</b>"
                 await safe_edit_message(query, text, get_bulk_menu(prefs.buffer_mode, 0), parse_mode="HTML")
                 return
             
             # Envoyer un message de statut
             status_msg = await query.message.reply_text(
-                f"⚙️ <b>Traitement de {len(messages)} messages...</b>\n\nInitialisation...",
+                f"⚙️ <b>Traitement de {buffer_count} messages...</b>\n\nInitialisation...",
                 parse_mode="HTML"
             )
             
-            # Traiter les messages
-            result = await handle_bulk_processing(
-                messages=messages,
-                prefs=prefs,
-                bot=context.bot,
-                status_message=status_msg
+            # Job persistant : le buffer passe dans l'outbox dans la même transaction,
+            # publié par les workers (repris après un redémarrage, sans doublon)
+            job = await enqueue_publish_job_async(
+                user_id,
+                target_chat_id=prefs.target_chat_id if prefs.publish_mode else None,
+                status_chat_id=status_msg.chat_id,
+                status_message_id=status_msg.message_id,
+                db=db,
+                extra_targets=await _extra_targets(prefs, db)
             )
-            
-            # Mettre à jour les statistiques
-            prefs.messages_processed += result.get('successful', 0)
-            prefs.messages_failed += result.get('failed', 0)
-            
-            # Vider le buffer
-            clear_buffer(user_id)
             prefs.buffer_mode = False
-            
-            # Message final
-            await status_msg.edit_text(
-                f"✅ <b>Traitement terminé!</b>\n\n"
-                f"📊 Total: {result['total']}\n"
-                f"✅ Réussis: {result['successful']}\n"
-                f"❌ Échecs: {result['failed']}\n"
-                f"⏭️ Ignorés: {result.get('skipped', 0)}\n\n"
-                f"Mode buffer désactivé automatiquement.",
-                parse_mode="HTML"
-            )
+            await db.commit()
+            outbox_worker.wake()
+            logger.info(f"📦 Job {job.id} créé: {job.total} messages (user {user_id})")
         
         elif data == "test_publish":
             if not prefs.target_chat_id:
@@ -328,6 +394,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             test_message = f"🧪 Test du bot\nUtilisateur: {user_id}\nHeure: {prefs.last_activity.strftime('%H:%M:%S')}"
             
             try:
+                await rate_limiter.acquire(prefs.target_chat_id)
                 await context.bot.send_message(
                     chat_id=prefs.target_chat_id,
                     text=test_message
@@ -356,8 +423,12 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text += f"<i>Actuel:</i> <code>{prefs.suffix or '(vide)'}</code>\n\n"
             text += "Le suffixe est ajouté à la fin de chaque message."
             await safe_edit_message(query, text, get_suffix_menu(prefs.suffix), parse_mode="HTML")
+        
+        changed = PrefsSnapshot.from_prefs(prefs) != before
     
-    update_user_activity(user_id)
+    if changed:
+        prefs_cache.invalidate(user_id)
+    prefs_cache.touch(user_id)
 
 
 async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -372,108 +443,114 @@ async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE
     message = update.message
     
     # === ÉTAPE 1: EXTRACTION DES DONNÉES ===
-    original_text = ""
-    has_media = False
-    media_type = None
-    media_file_id = None
-    
-    # 1.A - Texte pur
-    if message.text:
-        original_text = message.text
-        media_type = "text"
-    
-    # 1.B - Médias avec légende
-    elif message.caption:
-        original_text = message.caption
-        has_media = True
-        
-        if message.photo:
-            media_type = "photo"
-            media_file_id = message.photo[-1].file_id
-        elif message.video:
-            media_type = "video"
-            media_file_id = message.video.file_id
-        elif message.document:
-            media_type = "document"
-            media_file_id = message.document.file_id
-        elif message.audio:
-            media_type = "audio"
-            media_file_id = message.audio.file_id
-        elif message.voice:
-            media_type = "voice"
-            media_file_id = message.voice.file_id
-        elif message.animation:
-            media_type = "animation"
-            media_file_id = message.animation.file_id
-        elif message.sticker:
-            media_type = "sticker"
-            media_file_id = message.sticker.file_id
-    
-    # 1.C - Médias SANS légende (générer des descriptions)
-    else:
-        has_media = True
-        
-        if message.photo:
-            original_text = "[Photo sans légende]"
-            media_type = "photo"
-            media_file_id = message.photo[-1].file_id
-        elif message.video:
-            original_text = "[Vidéo sans légende]"
-            media_type = "video"
-            media_file_id = message.video.file_id
-        elif message.document:
-            original_text = f"[Document: {message.document.file_name or 'sans nom'}]"
-            media_type = "document"
-            media_file_id = message.document.file_id
-        elif message.audio:
-            original_text = f"[Audio: {message.audio.title or 'sans titre'}]"
-            media_type = "audio"
-            media_file_id = message.audio.file_id
-        elif message.voice:
-            original_text = "[Message vocal]"
-            media_type = "voice"
-            media_file_id = message.voice.file_id
-        elif message.contact:
-            original_text = f"[Contact: {message.contact.first_name or 'Inconnu'}]"
-            media_type = "contact"
-        elif message.location:
-            original_text = "[Position géographique]"
-            media_type = "location"
-        elif message.sticker:
-            original_text = "[Sticker]"
-            media_type = "sticker"
-            media_file_id = message.sticker.file_id
-        elif message.animation:
-            original_text = "[Animation]"
-            media_type = "animation"
-            media_file_id = message.animation.file_id
+    with tracer.span("handler.parse"):
+        original_text = ""
+        has_media = False
+        media_type = None
+        media_file_id = None
+        media_group_id = message.media_group_id  # Album (plusieurs médias)
+        
+        # Mise en forme d'origine (offsets en UTF-16), conservée si l'utilisateur le demande
+        source_entities = message.entities if message.text else message.caption_entities
+        entities = [entity.to_dict() for entity in source_entities] if source_entities else None
+        
+        # 1.A - Texte pur
+        if message.text:
+            original_text = message.text
+            media_type = "text"
+        
+        # 1.B - Médias avec légende
+        elif message.caption:
+            original_text = message.caption
+            has_media = True
+        
+            if message.photo:
+                media_type = "photo"
+                media_file_id = message.photo[-1].file_id
+            elif message.video:
+                media_type = "video"
+                media_file_id = message.video.file_id
+            elif message.document:
+                media_type = "document"
+                media_file_id = message.document.file_id
+            elif message.audio:
+                media_type = "audio"
+                media_file_id = message.audio.file_id
+            elif message.voice:
+                media_type = "voice"
+                media_file_id = message.voice.file_id
+            elif message.animation:
+                media_type = "animation"
+                media_file_id = message.animation.file_id
+            elif message.sticker:
+                media_type = "sticker"
+                media_file_id = message.sticker.file_id
+        
+        # 1.C - Médias SANS légende (générer des descriptions)
         else:
-            original_text = "[Message non pris en charge]"
-            media_type = "unknown"
+            has_media = True
+        
+            if message.photo:
+                original_text = "[Photo sans légende]"
+                media_type = "photo"
+                media_file_id = message.photo[-1].file_id
+            elif message.video:
+                original_text = "[Vidéo sans légende]"
+                media_type = "video"
+                media_file_id = message.video.file_id
+            elif message.document:
+                original_text = f"[Document: {message.document.file_name or 'sans nom'}]"
+                media_type = "document"
+                media_file_id = message.document.file_id
+            elif message.audio:
+                original_text = f"[Audio: {message.audio.title or 'sans titre'}]"
+                media_type = "audio"
+                media_file_id = message.audio.file_id
+            elif message.voice:
+                original_text = "[Message vocal]"
+                media_type = "voice"
+                media_file_id = message.voice.file_id
+            elif message.contact:
+                original_text = f"[Contact: {message.contact.first_name or 'Inconnu'}]"
+                media_type = "contact"
+            elif message.location:
+                original_text = "[Position géographique]"
+                media_type = "location"
+            elif message.sticker:
+                original_text = "[Sticker]"
+                media_type = "sticker"
+                media_file_id = message.sticker.file_id
+            elif message.animation:
+                original_text = "[Animation]"
+                media_type = "animation"
+                media_file_id = message.animation.file_id
+            else:
+                original_text = "[Message non pris en charge]"
+                media_type = "unknown"
+        
+    # === ÉTAPE 2: RÉCUPÉRATION DES PRÉFÉRENCES (cache) ===
+    with tracer.span("handler.prefs"):
+        prefs = await prefs_cache.get(user_id)
+    conversation_state = prefs.conversation_state or ""
     
-    # === ÉTAPE 2: RÉCUPÉRATION DES PRÉFÉRENCES ===
-    with get_db() as db:
-        prefs = db.query(UserPreferences).filter(UserPreferences.user_id == user_id).first()
-        if not prefs:
-            prefs = UserPreferences(user_id=user_id)
-            db.add(prefs)
-            db.flush()
+    # === ÉTAPE 3: GESTION DES ÉTATS DE CONVERSATION ===
+    # Si on attend une entrée spécifique (définition de paramètre)
+    if conversation_state in [WAITING_PREFIX, WAITING_SUFFIX, WAITING_KEYWORD_FIND, 
+                              WAITING_KEYWORD_REPLACE, WAITING_KEYWORD_RULES, WAITING_TARGET_CHAT]:
         
-        conversation_state = prefs.conversation_state or ""
+        # Seul le texte pur est accepté pour les paramètres
+        if media_type != "text":
+            await update.message.reply_text(
+                "❌ <b>Texte requis</b>\n\n"
+                "Veuillez envoyer uniquement du texte pour cette étape.",
+                parse_mode="HTML"
+            )
+            return
         
-        # === ÉTAPE 3: GESTION DES ÉTATS DE CONVERSATION ===
-        # Si on attend une entrée spécifique (définition de paramètre)
-        if conversation_state in [WAITING_PREFIX, WAITING_SUFFIX, WAITING_KEYWORD_FIND, 
-                                  WAITING_KEYWORD_REPLACE, WAITING_TARGET_CHAT]:
-            
-            # Seul le texte pur est accepté pour les paramètres
-            if media_type != "text":
-                await update.message.reply_text(
-                    "❌ <b>Texte requis</b>\n\n"
-                    "Veuillez envoyer uniquement du texte pour cette étape.",
-                    parse_mode="HTML"
-                )
-                return
+        # Écriture des paramètres : session dédiée puis invalidation du cache
+        async with get_async_db() as db:
+            prefs = await get_user_prefs_async(db, user_id)
+            conversation_state = prefs.conversation_state or ""
             
             # Traiter selon l'état
             if conversation_state == WAITING_PREFIX:
@@ -512,6 +589,27 @@ async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE
                     parse_mode="HTML"
                 )
             
+            elif conversation_state == WAITING_KEYWORD_RULES:
+                rules, errors = parse_rules(original_text)
+                
+                # Quota de règles par utilisateur
+                available = MAX_KEYWORD_RULES - await count_keyword_rules_async(user_id, db)
+                if len(rules) > available:
+                    errors.append(f"{len(rules) - max(available, 0)} règle(s) ignorée(s): maximum {MAX_KEYWORD_RULES}")
+                    rules = rules[:max(available, 0)]
+                
+                if rules:
+                    await add_keyword_rules_async(user_id, rules, db)
+                    keyword_engines.invalidate(user_id)
+                    prefs.conversation_state = ""
+                
+                text = f"✅ <b>{len(rules)} règle(s) ajoutée(s)</b>"
+                if errors:
+                    text += "\n\n⚠️ <b>Erreurs:</b>\n" + "\n".join(html.escape(error, quote=False) for error in errors[:20])
+                if not rules:
+                    text += "\n\nCorrigez puis renvoyez vos règles, ou annulez via /start."
+                await update.message.reply_text(text, parse_mode="HTML")
+            
             elif conversation_state == WAITING_TARGET_CHAT:
                 chat_id = validate_chat_id(original_text)
                 if chat_id:
@@ -529,116 +627,168 @@ async def handle_all_messages(update: Update, context: ContextTypes.DEFAULT_TYPE
                         "Exemple: <code>-1001234567890</code>",
                         parse_mode="HTML"
                     )
-            
-            update_user_activity(user_id)
-            return
         
-        # === ÉTAPE 4: MODE BUFFER ===
-        if prefs.buffer_mode:
-            # Seuls les messages avec texte/caption sont acceptés en buffer
-            if media_type in ["text", "photo", "video", "document", "audio", "voice", "animation"]:
-                add_to_buffer(user_id, original_text)
-                buffer_count = len(get_buffer_messages(user_id))
-                
-                if buffer_count >= 100:
-                    await update.message.reply_text(
-                        "⚠️ <b>Limite atteinte!</b>\n\n"
-                        f"Vous avez 100 messages en attente.\n"
-                        "Retournez au menu pour les traiter.",
-                        parse_mode="HTML"
+        prefs_cache.invalidate(user_id)
+        prefs_cache.touch(user_id)
+        return
+    
+    # === ÉTAPE 4: MODE BUFFER ===
+    if prefs.buffer_mode:
+        # Seuls les messages avec texte/caption sont acceptés en buffer
+        if media_type in ["text", "photo", "video", "document", "audio", "voice", "animation"]:
+            async with get_async_db() as db:
+                buffer_count = await count_buffer_messages_async(user_id, db)
+                if buffer_count < BUFFER_QUOTA:
+                    # Médias : la vraie légende (vide si aucune), pas la description générée
+                    buffer_text = original_text if media_type == "text" else (message.caption or "")
+                    await add_to_buffer_async(
+                        user_id, buffer_text, db,
+                        media_type=media_type,
+                        media_file_id=media_file_id,
+                        media_group_id=media_group_id,
+                        entities=json.dumps(entities) if entities else None,
+                        source_chat_id=update.effective_chat.id,
+                        source_message_id=message.message_id
                     )
+                    buffer_count += 1
+                    accepted = True
                 else:
-                    await update.message.reply_text(
-                        f"✅ Message {buffer_count}/100 ajouté au buffer"
-                    )
-            else:
+                    accepted = False
+            
+            if not accepted:
                 await update.message.reply_text(
-                    "❌ <b>Type non supporté en mode buffer</b>\n\n"
-                    "Seuls les messages avec du texte ou des légendes sont acceptés.",
+                    "⚠️ <b>Limite atteinte!</b>\n\n"
+                    f"Vous avez {buffer_count} messages en attente.\n"
+                    "Retournez au menu pour les traiter.",
                     parse_mode="HTML"
                 )
-            
-            update_user_activity(user_id)
-            return
+            else:
+                await update.message.reply_text(
+                    f"✅ Message {buffer_count}/{BUFFER_QUOTA} ajouté au buffer"
+                )
+        else:
+            await update.message.reply_text(
+                "❌ <b>Type non supporté en mode buffer</b>\n\n"
+                "Seuls les messages avec du texte ou des légendes sont acceptés.",
+                parse_mode="HTML"
+            )
         
-        # === ÉTAPE 5: TRAITEMENT NORMAL ===
-        await process_message_with_transformations(
-            update=update,
-            context=context,
-            prefs=prefs,
-            original_text=original_text,
-            media_type=media_type,
-            media_file_id=media_file_id,
-            has_media=has_media
+        prefs_cache.touch(user_id)
+        return
+    
+    # === ÉTAPE 5: ALBUMS (regroupés puis publiés en un seul envoi) ===
+    if media_group_id and media_type in ALBUM_MEDIA_TYPES:
+        chat_id = update.effective_chat.id
+        media_group_aggregator.add(
+            media_group_id,
+            message.message_id,
+            {
+                "media_type": media_type,
+                "media_file_id": media_file_id,
+                "caption": message.caption,
+                "entities": entities,
+                "message_id": message.message_id
+            },
+            lambda items: publish_album(context.bot, prefs, chat_id, items),
+            user_id=user_id,
+            chat_id=chat_id
         )
+        return
+    
+    # === ÉTAPE 6: TRAITEMENT NORMAL ===
+    await process_message_with_transformations(
+        update=update,
+        context=context,
+        prefs=prefs,
+        original_text=original_text,
+        media_type=media_type,
+        media_file_id=media_file_id,
+        has_media=has_media,
+        entities=entities
+    )
+
+
+async def _extra_targets(prefs, db) -> list:
+    """Cibles supplémentaires à figer dans un job (seulement en mode publication)"""
+    if not (prefs.publish_mode and prefs.target_chat_id):
+        return []
+    return await get_publish_targets_async(prefs.user_id, db)
+
+
+def _published_text(what: str, published: int, targets: int) -> str:
+    """Confirmation de publication, avec le détail si plusieurs canaux"""
+    if targets == 1:
+        return f"✅ {what} publié dans le canal!"
+    if published == targets:
+        return f"✅ {what} publié dans {targets} canaux!"
+    return f"⚠️ {what} publié dans {published}/{targets} canaux"
 
 
 async def process_message_with_transformations(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
-    prefs: UserPreferences,
+    prefs: PrefsSnapshot,
     original_text: str,
     media_type: str,
     media_file_id: str = None,
-    has_media: bool = False
+    has_media: bool = False,
+    entities: list = None
 ):
     """
     Applique toutes les transformations et publie/répond selon la config
+    Avec keep_formatting, les entités d'origine sont décalées et renvoyées
+    Un texte trop long est découpé (légende courte + messages de continuation)
+    Chemin rapide copy_message : média avec sa nouvelle légende, ou texte non transformé
     """
     # === TRANSFORMATIONS DU TEXTE ===
-    processed_text = original_text
-    
-    # 1. Remplacement de mots-clés
-    if prefs.keyword_find and prefs.keyword_replace:
-        processed_text = processed_text.replace(prefs.keyword_find, prefs.keyword_replace)
-    
-    # 2. Ajout préfixe/suffixe
-    processed_text = f"{prefs.prefix or ''}{processed_text}{prefs.suffix or ''}"
-    
-    # 3. Limite Telegram (4096 caractères)
-    if len(processed_text) > 4096:
-        processed_text = processed_text[:4093] + "..."
+    # Pipeline compilé de l'utilisateur : mots-clés, préfixe/suffixe, découpage
+    with tracer.span("handler.transform"):
+        pipeline = await transform_pipelines.get(prefs)
+        parts = pipeline.render(
+            original_text,
+            entities if prefs.keep_formatting else None,
+            first_part_limit(media_type, media_file_id)
+        )
+    source = (update.effective_chat.id, update.message.message_id)
     
     # === PUBLICATION / RÉPONSE ===
     try:
-        # MODE PUBLICATION vers un canal
-        if prefs.publish_mode and prefs.target_chat_id:
-            await send_message_to_target(
-                bot=context.bot,
-                chat_id=prefs.target_chat_id,
-                text=processed_text,
-                media_type=media_type,
-                media_file_id=media_file_id
-            )
-            
-            await update.message.reply_text("✅ Message publié dans le canal!")
+        # MODE PUBLICATION vers le(s) canal(aux), en parallèle
+        if prefs.publish_mode and prefs.targets:
+            with tracer.span("handler.send"):
+                published = await fan_out(prefs.targets, lambda chat_id: send_parts_to_target(
+                    bot=context.bot,
+                    chat_id=chat_id,
+                    parts=parts,
+                    media_type=media_type,
+                    media_file_id=media_file_id,
+                    source=source,
+                    untransformed=pipeline.is_identity
+                ))
+                
+                await update.message.reply_text(_published_text("Message", len(published.results), len(prefs.targets)))
             
-            # Incrémenter compteur succès
-            with get_db() as db:
-                user_prefs = db.query(UserPreferences).filter(
-                    UserPreferences.user_id == prefs.user_id
-                ).first()
-                if user_prefs:
-                    user_prefs.messages_processed += 1
+            # Incrémenter compteur succès (écriture différée)
+            with tracer.span("handler.counters"):
+                prefs_cache.record_result(prefs.user_id, processed=1)
         
         # MODE NORMAL (réponse dans le chat privé)
         else:
-            await send_message_to_target(
-                bot=context.bot,
-                chat_id=update.effective_chat.id,
-                text=processed_text,
-                media_type=media_type,
-                media_file_id=media_file_id,
-                reply_to=update.message.message_id
-            )
+            with tracer.span("handler.send"):
+                await send_parts_to_target(
+                    bot=context.bot,
+                    chat_id=update.effective_chat.id,
+                    parts=parts,
+                    media_type=media_type,
+                    media_file_id=media_file_id,
+                    reply_to=update.message.message_id,
+                    source=source,
+                    untransformed=pipeline.is_identity
+                )
             
-            # Incrémenter compteur succès
-            with get_db() as db:
-                user_prefs = db.query(UserPreferences).filter(
-                    UserPreferences.user_id == prefs.user_id
-                ).first()
-                if user_prefs:
-                    user_prefs.messages_processed += 1
+            # Incrémenter compteur succès (écriture différée)
+            with tracer.span("handler.counters"):
+                prefs_cache.record_result(prefs.user_id, processed=1)
     
     except TelegramError as e:
         logger.error(f"Erreur envoi message: {e}")
@@ -649,64 +799,88 @@ async def process_message_with_transformations(
             parse_mode="HTML"
         )
         
-        # Incrémenter compteur échecs
-        with get_db() as db:
-            user_prefs = db.query(UserPreferences).filter(
-                UserPreferences.user_id == prefs.user_id
-            ).first()
-            if user_prefs:
-                user_prefs.messages_failed += 1
-    
-    update_user_activity(prefs.user_id)
+        # Incrémenter compteur échecs (écriture différée)
+        prefs_cache.record_result(prefs.user_id, failed=1)
 
 
-async def send_message_to_target(
-    bot,
-    chat_id: int,
-    text: str,
-    media_type: str,
-    media_file_id: str = None,
-    reply_to: int = None
-):
+async def publish_album(bot, prefs: PrefsSnapshot, chat_id: int, items: list):
     """
-    Envoie un message (texte ou média) vers le chat cible
-    Gère tous les types de médias supportés par Telegram
+    Publie un album complet (appelé par l'agrégateur) en un seul send_media_group
+    La légende transformée est placée sur le premier média, la suite
+    éventuelle (au-delà de 1024) en messages de continuation.
+    Sans transformation, l'album est copié tel quel (copy_messages)
     """
-    send_kwargs = {"chat_id": chat_id}
-    if reply_to:
-        send_kwargs["reply_to_message_id"] = reply_to
-    
-    if media_type == "text":
-        await bot.send_message(text=text, **send_kwargs)
+    captioned = next((item for item in items if item["caption"]), None)
+    caption = captioned["caption"] if captioned else ""
+    source_entities = captioned["entities"] if captioned and prefs.keep_formatting else None
     
-    elif media_type == "photo" and media_file_id:
-        await bot.send_photo(photo=media_file_id, caption=text, **send_kwargs)
+    with tracer.span("album.transform"):
+        pipeline = await transform_pipelines.get(prefs)
+        parts = pipeline.render(caption, source_entities, CAPTION_LIMIT)
+    processed_caption, caption_entities = parts[0]
+    media = [(item["media_type"], item["media_file_id"]) for item in items]
+    message_ids = [item["message_id"] for item in items]
+    first_message_id = message_ids[0]
     
-    elif media_type == "video" and media_file_id:
-        await bot.send_video(video=media_file_id, caption=text, **send_kwargs)
-    
-    elif media_type == "document" and media_file_id:
-        await bot.send_document(document=media_file_id, caption=text, **send_kwargs)
-    
-    elif media_type == "audio" and media_file_id:
-        await bot.send_audio(audio=media_file_id, caption=text, **send_kwargs)
-    
-    elif media_type == "voice" and media_file_id:
-        await bot.send_voice(voice=media_file_id, caption=text, **send_kwargs)
-    
-    elif media_type == "animation" and media_file_id:
-        await bot.send_animation(animation=media_file_id, caption=text, **send_kwargs)
-    
-    elif media_type == "sticker" and media_file_id:
-        # Les stickers ne supportent pas de caption
-        await bot.send_sticker(sticker=media_file_id, **send_kwargs)
-        # Envoyer le texte séparément si nécessaire
-        if text and text != "[Sticker]":
-            await bot.send_message(text=text, chat_id=chat_id)
+    try:
+        # MODE PUBLICATION vers le(s) canal(aux), en parallèle
+        if prefs.publish_mode and prefs.targets:
+            async def publish(target: int):
+                if pipeline.is_identity:
+                    await copy_messages_to_target(bot, target, chat_id, message_ids)
+                    return
+                await send_media_group_to_target(
+                    bot=bot,
+                    chat_id=target,
+                    items=media,
+                    caption=processed_caption,
+                    caption_entities=caption_entities
+                )
+                await send_parts_to_target(bot, target, parts[1:], "text")
+            
+            with tracer.span("album.send"):
+                published = await fan_out(prefs.targets, publish)
+            
+            await rate_limiter.acquire(chat_id)
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"{_published_text('Album', len(published.results), len(prefs.targets))} ({len(items)} médias)",
+                reply_to_message_id=first_message_id
+            )
+        
+        # MODE NORMAL (réponse dans le chat privé)
+        else:
+            with tracer.span("album.send"):
+                await send_media_group_to_target(
+                    bot=bot,
+                    chat_id=chat_id,
+                    items=media,
+                    caption=processed_caption,
+                    reply_to=first_message_id,
+                    caption_entities=caption_entities
+                )
+                await send_parts_to_target(bot, chat_id, parts[1:], "text")
+        
+        prefs_cache.record_result(prefs.user_id, processed=len(items))
     
-    else:
-        # Fallback: envoyer juste le texte
-        await bot.send_message(text=text, **send_kwargs)
+    except TelegramError as e:
+        logger.error(f"Erreur envoi album: {e}")
+        
+        await bot.send_message(
+            chat_id=chat_id,
+            text=(
+                f"❌ <b>Erreur:</b>\n{str(e)}\n\n"
+                "Vérifiez que le bot a les permissions nécessaires."
+            ),
+            parse_mode="HTML"
+        )
+        
+        prefs_cache.record_result(prefs.user_id, failed=len(items))
+
+
+async def publish_orphan_album(bot, user_id: int, chat_id: int, items: list):
+    """Album abandonné par une autre instance : publié avec les préférences actuelles"""
+    await publish_album(bot, await prefs_cache.get(user_id), chat_id, items)
 
 
 async def safe_edit_message(query, text: str, markup, **kwargs):
@@ -767,10 +941,10 @@ async def show_tutorial(query, page: int):
         4: (
             "📖 <b>Tutoriel - Page 4/5</b>\n\n"
             "<b>⚡ Traitement Massif</b>\n\n"
-            "Traitez jusqu'à 100 messages d'un coup!\n\n"
+            f"Traitez jusqu'à {BUFFER_QUOTA} messages d'un coup!\n\n"
             "<b>Utilisation:</b>\n"
             "1. Activez le mode buffer\n"
-            "2. Envoyez vos messages (jusqu'à 100)\n"
+            f"2. Envoyez vos messages (jusqu'à {BUFFER_QUOTA})\n"
             "3. Cliquez sur 'Traiter tout'\n"
             "4. Le bot traite tout en parallèle\n\n"
             "Parfait pour les envois massifs!"
@@ -796,8 +970,11 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Commande /stats rapide"""
     user_id = update.effective_user.id
     
-    with get_db() as db:
-        prefs = db.query(UserPreferences).filter(UserPreferences.user_id == user_id).first()
+    # Les statistiques affichées incluent les compteurs encore en mémoire
+    await prefs_cache.flush()
+    
+    async with get_async_db() as db:
+        prefs = await get_user_prefs_async(db, user_id, create=False)
         
         if not prefs:
             await update.message.reply_text("❌ Aucune donnée disponible. Utilisez /start pour commencer.")
@@ -818,15 +995,15 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(text, parse_mode="HTML")
     
-    update_user_activity(user_id)
+    prefs_cache.touch(user_id)
 
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Commande /reset rapide"""
     user_id = update.effective_user.id
     
-    with get_db() as db:
-        prefs = db.query(UserPreferences).filter(UserPreferences.user_id == user_id).first()
+    async with get_async_db() as db:
+        prefs = await get_user_prefs_async(db, user_id, create=False)
         if prefs:
             prefs.prefix = ""
             prefs.suffix = ""
@@ -835,9 +1012,16 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             prefs.publish_mode = False
             prefs.target_chat_id = None
             prefs.buffer_mode = False
+            prefs.keep_formatting = False
             prefs.conversation_state = ""
+        
+        await clear_buffer_async(user_id, db)
+        await clear_keyword_rules_async(user_id, db)
+        await cancel_scheduled_posts_async(user_id, db)
+        await remove_publish_targets_async(user_id, db=db)
     
-    clear_buffer(user_id)
+    prefs_cache.invalidate(user_id)
+    keyword_engines.invalidate(user_id)
     
     await update.message.reply_text(
         "✅ <b>Réinitialisation réussie!</b>\n\n"
@@ -846,4 +1030,173 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="HTML"
     )
     
-    update_user_activity(user_id)
\ No newline at end of file
+    prefs_cache.touch(user_id)
+
+SCHEDULE_USAGE = (
+    "⏰ <b>Programmer le buffer</b>\n\n"
+    "<code>/schedule 14:30</code> - aujourd'hui (ou demain)\n"
+    "<code>/schedule 25/12 09:00</code> - à une date\n"
+    "<code>/schedule +2h</code> - dans un délai (m, h, j)\n"
+    "<code>/schedule cancel</code> - annuler les publications programmées\n\n"
+    "<code>/drip 30</code> - un message toutes les 30 minutes\n"
+    "<code>/drip 2h 08:00</code> - toutes les 2 heures à partir de 8h"
+)
+
+
+async def _schedule_buffer(update: Update, user_id: int, first_at, interval: float = 0):
+    """Programme tout le buffer (une échéance, ou une par créneau en goutte-à-goutte)"""
+    async with get_async_db() as db:
+        prefs = await get_user_prefs_async(db, user_id)
+        # Même destination que le traitement massif, figée à la programmation
+        count, last_at = await schedule_buffer_async(
+            user_id,
+            target_chat_id=prefs.target_chat_id if prefs.publish_mode else None,
+            first_at=first_at,
+            interval=interval,
+            db=db,
+            extra_targets=await _extra_targets(prefs, db)
+        )
+        if count:
+            prefs.buffer_mode = False
+    
+    prefs_cache.invalidate(user_id)
+    
+    if not count:
+        await update.message.reply_text(
+            "❌ <b>Aucun message à programmer</b>\n\nActivez le mode buffer puis envoyez vos messages.",
+            parse_mode="HTML"
+        )
+        return
+    
+    post_scheduler.refresh()
+    logger.info(f"⏰ {count} messages programmés (user {user_id})")
+    
+    text = f"⏰ <b>{count} messages programmés</b>\n\n"
+    if interval:
+        text += (
+            f"📅 Premier: {format_local(first_at)}\n"
+            f"📅 Dernier: {format_local(last_at)}\n"
+            f"⏱️ Intervalle: {interval / 60:g} min\n\n"
+        )
+    else:
+        text += f"📅 Publication: {format_local(first_at)}\n\n"
+    text += "Mode buffer désactivé automatiquement.\n<code>/schedule cancel</code> pour annuler."
+    await update.message.reply_text(text, parse_mode="HTML")
+
+
+async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Commande /schedule : publication du buffer à une date donnée"""
+    user_id = update.effective_user.id
+    args = " ".join(context.args or [])
+    
+    if not args:
+        count, next_at = await get_scheduled_summary_async(user_id)
+        text = SCHEDULE_USAGE
+        if count:
+            text = f"📋 <b>{count} publications programmées</b>\nProchaine: {format_local(next_at)}\n\n" + text
+        await update.message.reply_text(text, parse_mode="HTML")
+    
+    elif args.lower() in ("cancel", "annuler"):
+        count = await cancel_scheduled_posts_async(user_id)
+        await update.message.reply_text(
+            f"🗑️ <b>{count} publications programmées annulées</b>" if count
+            else "❌ <b>Aucune publication programmée</b>",
+            parse_mode="HTML"
+        )
+    
+    else:
+        publish_at = parse_publish_time(args)
+        if publish_at is None:
+            await update.message.reply_text(
+                "❌ <b>Date invalide ou passée</b>\n\n" + SCHEDULE_USAGE, parse_mode="HTML"
+            )
+            return
+        await _schedule_buffer(update, user_id, publish_at)
+    
+    prefs_cache.touch(user_id)
+
+
+async def drip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Commande /drip : un message du buffer toutes les N minutes"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    
+    interval = parse_duration(args[0]) if args else None
+    first_at = datetime.now(timezone.utc)
+    if len(args) > 1:
+        first_at = parse_publish_time(" ".join(args[1:]))
+    
+    if not interval or interval > MAX_DRIP_INTERVAL * 60 or first_at is None:
+        await update.message.reply_text(
+            f"❌ <b>Usage:</b> <code>/drip N [début]</code>\n"
+            f"Intervalle de 1 minute à {MAX_DRIP_INTERVAL // 1440} jours.\n\n" + SCHEDULE_USAGE,
+            parse_mode="HTML"
+        )
+        return
+    
+    await _schedule_buffer(update, user_id, first_at, interval)
+    prefs_cache.touch(user_id)
+
+
+# Nombre maximum de canaux supplémentaires par utilisateur
+MAX_PUBLISH_TARGETS = int(os.getenv("MAX_PUBLISH_TARGETS", "50"))
+
+TARGETS_USAGE = (
+    "<code>/targets add -1001234567890 -1009876543210</code> - ajouter\n"
+    "<code>/targets remove -1001234567890</code> - retirer\n"
+    "<code>/targets clear</code> - tout retirer\n\n"
+    "Chaque message est publié en parallèle dans le canal principal "
+    "et tous les canaux supplémentaires."
+)
+
+
+async def targets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Commande /targets : canaux de publication supplémentaires"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    action = args[0].lower() if args else ""
+    
+    async with get_async_db() as db:
+        prefs = await get_user_prefs_async(db, user_id)
+        
+        if action in ("add", "remove"):
+            chat_ids = [validate_chat_id(arg) for arg in args[1:]]
+            if not chat_ids or None in chat_ids:
+                await update.message.reply_text(
+                    "❌ <b>ID invalide</b>\n\n" + TARGETS_USAGE, parse_mode="HTML"
+                )
+                return
+            
+            if action == "add":
+                current = await get_publish_targets_async(user_id, db)
+                if len(set(current) | set(chat_ids)) > MAX_PUBLISH_TARGETS:
+                    await update.message.reply_text(
+                        f"❌ <b>Limite atteinte</b> ({MAX_PUBLISH_TARGETS} canaux supplémentaires)",
+                        parse_mode="HTML"
+                    )
+                    return
+                changed = await add_publish_targets_async(user_id, chat_ids, db)
+                text = f"✅ <b>{changed} canal(aux) ajouté(s)</b>"
+                if not prefs.target_chat_id:
+                    text += "\n\n⚠️ Définissez aussi un canal principal (menu Publication)."
+            else:
+                changed = await remove_publish_targets_async(user_id, chat_ids, db)
+                text = f"🗑️ <b>{changed} canal(aux) retiré(s)</b>"
+        
+        elif action == "clear":
+            changed = await remove_publish_targets_async(user_id, db=db)
+            text = f"🗑️ <b>{changed} canal(aux) retiré(s)</b>"
+        
+        else:
+            changed = 0
+            targets = await get_publish_targets_async(user_id, db)
+            text = "📡 <b>Canaux de publication</b>\n\n"
+            text += f"📍 Principal: <code>{prefs.target_chat_id or '(aucun)'}</code>\n"
+            for chat_id in targets:
+                text += f"• <code>{chat_id}</code>\n"
+            text += "\n" + TARGETS_USAGE
+    
+    if changed:
+        prefs_cache.invalidate(user_id)
+    await update.message.reply_text(text, parse_mode="HTML")
+    prefs_cache.touch(user_id)
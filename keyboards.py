@@ -10,6 +10,7 @@ def get_main_menu(show_tutorial: bool = False):
         ],
         [
             InlineKeyboardButton("🔄 Remplacement", callback_data="menu_keyword"),
+            InlineKeyboardButton("🎨 Mise en forme", callback_data="toggle_formatting")
         ],
         [
             InlineKeyboardButton("📢 Mode Publication", callback_data="menu_publish"),
@@ -56,7 +57,7 @@ def get_suffix_menu(current_value: str = ""):
     return InlineKeyboardMarkup(keyboard)
 
 
-def get_keyword_menu(find_value: str = "", replace_value: str = ""):
+def get_keyword_menu(find_value: str = "", replace_value: str = "", rules_count: int = 0):
     """Menu pour gérer les remplacements de mots-clés"""
     status_find = f"Chercher: {find_value[:15]}..." if find_value else "Non défini"
     status_replace = f"→ {replace_value[:15]}..." if replace_value else "Non défini"
@@ -66,6 +67,8 @@ def get_keyword_menu(find_value: str = "", replace_value: str = ""):
         [InlineKeyboardButton(f"✨ {status_replace}", callback_data="noop")],
         [InlineKeyboardButton("🔍 Définir mot à remplacer", callback_data="set_keyword_find")],
         [InlineKeyboardButton("✨ Définir remplacement", callback_data="set_keyword_replace")],
+        [InlineKeyboardButton(f"📚 Règles multiples: {rules_count}", callback_data="noop")],
+        [InlineKeyboardButton("➕ Ajouter des règles", callback_data="add_keyword_rules")],
         [InlineKeyboardButton("🗑️ Tout supprimer", callback_data="clear_keyword")],
         [InlineKeyboardButton("◀️ Retour", callback_data="menu_main")]
     ]
@@ -0,0 +1,232 @@
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from coordination import coordinator
+from db import UserPreferences, get_keyword_rules_async
+
+logger = logging.getLogger(__name__)
+
+# Nombre maximum de règles par utilisateur
+MAX_KEYWORD_RULES = int(os.getenv("KEYWORD_RULES_MAX", "500"))
+
+# Options acceptées après " | " dans une ligne de règle
+RULE_FLAGS = {
+    "mot": "whole_word",
+    "i": "case_insensitive",
+    "regex": "is_regex",
+}
+
+# Références internes interdites dans une regex utilisateur : les groupes
+# sont renumérotés une fois toutes les règles combinées
+_FORBIDDEN_REGEX = re.compile(r"\\[1-9]|\(\?P[<=]")
+
+
+class Rule(NamedTuple):
+    """Règle de remplacement (données simples, indépendantes de l'ORM)"""
+    find: str
+    replace: str
+    whole_word: bool = False
+    case_insensitive: bool = False
+    is_regex: bool = False
+
+
+def _rule_pattern(rule: Rule) -> str:
+    """Expression d'une règle, options incluses (drapeaux locaux)"""
+    body = rule.find if rule.is_regex else re.escape(rule.find)
+    if rule.whole_word:
+        body = rf"(?<!\w)(?:{body})(?!\w)"
+    if rule.case_insensitive:
+        body = f"(?i:{body})"
+    return body
+
+
+def validate_rule(rule: Rule) -> Optional[str]:
+    """
+    Vérifie qu'une règle peut être compilée
+
+    Returns:
+        Message d'erreur, None si la règle est valide
+    """
+    if not rule.find:
+        return "motif vide"
+    if rule.is_regex and _FORBIDDEN_REGEX.search(rule.find):
+        return "références de groupe (\\1, (?P<nom>...)) non supportées"
+    try:
+        # Compilée comme dans l'expression combinée
+        compiled = re.compile(f"(?P<_k0>{_rule_pattern(rule)})")
+    except re.error as e:
+        return f"regex invalide ({e})"
+    if compiled.match(""):
+        return "le motif ne doit pas correspondre à un texte vide"
+    return None
+
+
+def parse_rules(text: str) -> Tuple[List[Rule], List[str]]:
+    """
+    Lit des règles, une par ligne : `trouver => remplacer | options`
+
+    Options (facultatives, séparées par des espaces) :
+    `mot` (mot entier), `i` (ignorer la casse), `regex` (motif regex)
+
+    Returns:
+        (règles valides, erreurs par ligne)
+    """
+    rules: List[Rule] = []
+    errors: List[str] = []
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        if "=>" not in line:
+            errors.append(f"Ligne {number}: séparateur '=>' manquant")
+            continue
+
+        find, replace = line.split("=>", 1)
+        flags = {}
+        if " | " in replace:
+            head, tail = replace.rsplit(" | ", 1)
+            words = tail.split()
+            # Le texte après " | " n'est une liste d'options que s'il n'en contient que
+            if words and all(word.lower() in RULE_FLAGS for word in words):
+                replace = head
+                flags = {RULE_FLAGS[word.lower()]: True for word in words}
+
+        rule = Rule(find=find.strip(), replace=replace.strip(), **flags)
+        error = validate_rule(rule)
+        if error:
+            errors.append(f"Ligne {number}: {error}")
+        else:
+            rules.append(rule)
+
+    return rules, errors
+
+
+def format_rule(rule) -> str:
+    """Représentation d'une règle dans la syntaxe de parse_rules()"""
+    flags = [name for name, attr in RULE_FLAGS.items() if getattr(rule, attr)]
+    text = f"{rule.find} => {rule.replace}"
+    return f"{text} | {' '.join(flags)}" if flags else text
+
+
+class KeywordEngine:
+    """
+    Toutes les règles d'un utilisateur compilées en une seule expression
+
+    - Une alternative nommée par règle : un seul parcours du texte, quel
+      que soit le nombre de règles
+    - Priorité à la plus longue expression littérale à une même position,
+      puis aux regex dans leur ordre de création
+    - Le texte de remplacement est littéral (pas de \\1)
+    """
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = tuple(rules)
+
+        ordered = sorted(self.rules, key=lambda rule: (rule.is_regex, 0 if rule.is_regex else -len(rule.find)))
+        self._pattern = None
+        self._replacements: Dict[int, str] = {}
+
+        if ordered:
+            self._pattern = re.compile("|".join(
+                f"(?P<_k{i}>{_rule_pattern(rule)})" for i, rule in enumerate(ordered)
+            ))
+            # Numéro du groupe englobant de chaque règle -> remplacement
+            for i, rule in enumerate(ordered):
+                self._replacements[self._pattern.groupindex[f"_k{i}"]] = rule.replace
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _substitute(self, match) -> str:
+        # lastindex = groupe fermé en dernier = le groupe englobant de la règle
+        return self._replacements[match.lastindex]
+
+    def apply(self, text: str) -> str:
+        """Applique toutes les règles en une passe"""
+        if self._pattern is None or not text:
+            return text
+        return self._pattern.sub(self._substitute, text)
+
+    def edits(self, text: str) -> List[Tuple[int, int, str]]:
+        """Remplacements sous forme (début, fin, texte), sans les appliquer"""
+        if self._pattern is None or not text:
+            return []
+        return [
+            (match.start(), match.end(), self._replacements[match.lastindex])
+            for match in self._pattern.finditer(text)
+        ]
+
+
+def _legacy_rule(prefs: UserPreferences) -> Tuple[str, str]:
+    """Ancien couple unique keyword_find/keyword_replace des préférences"""
+    return (prefs.keyword_find or "", prefs.keyword_replace or "")
+
+
+class KeywordEngineCache:
+    """
+    Moteurs compilés, par utilisateur (LRU)
+
+    Recompilés seulement quand les règles changent : invalidate() après
+    toute modification des règles ; un changement du couple historique
+    keyword_find/keyword_replace est détecté automatiquement.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.builds = 0
+
+    async def get(self, prefs: UserPreferences) -> KeywordEngine:
+        """Moteur de l'utilisateur (règles en base + couple historique)"""
+        user_id = prefs.user_id
+        legacy = _legacy_rule(prefs)
+
+        entry = self._entries.get(user_id)
+        if entry and entry[0] == legacy:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        rules = []
+        if legacy[0] and legacy[1]:
+            rules.append(Rule(find=legacy[0], replace=legacy[1]))
+        for row in await get_keyword_rules_async(user_id):
+            rule = Rule(row.find, row.replace, row.whole_word, row.case_insensitive, row.is_regex)
+            if validate_rule(rule) is None:
+                rules.append(rule)
+            else:
+                logger.warning(f"⚠️ Règle {row.id} ignorée (user {user_id})")
+
+        engine = KeywordEngine(rules)
+        self.builds += 1
+
+        self._entries[user_id] = (legacy, engine)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return engine
+
+    def invalidate(self, user_id: int, broadcast: bool = True):
+        """Force la recompilation au prochain accès (règles modifiées)"""
+        self._entries.pop(user_id, None)
+        if broadcast:
+            coordinator.invalidated(user_id)
+
+    def get_stats(self) -> Dict:
+        """Statistiques du cache"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "builds": self.builds
+        }
+
+
+# Instance globale (une par processus)
+keyword_engines = KeywordEngineCache(
+    max_size=int(os.getenv("KEYWORD_CACHE_SIZE", "10000"))
+)
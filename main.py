@@ -1,6 +1,10 @@
 import os
+import hmac
+import time
+import asyncio
 import logging
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
 from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
@@ -8,10 +12,28 @@ from telegram.ext import (
 )
 from contextlib import asynccontextmanager
 
-from db import get_db, UserPreferences
+from db import init_db, dispose_engines
 from handlers import (
     start, button_callback, handle_all_messages,
-    stats_command, reset_command
+    stats_command, reset_command, schedule_command, drip_command, targets_command,
+    publish_orphan_album
+)
+from update_dispatcher import UpdateDispatcher
+from coordination import coordinator
+from prefs_cache import prefs_cache
+from rate_limiter import rate_limiter
+from media_group import media_group_aggregator
+from transform import transform_pipelines
+from keyword_engine import keyword_engines
+from message_processor import job_scheduler
+from outbox import outbox_worker
+from scheduler import post_scheduler
+from status_cache import status_cache
+from metrics import metrics
+from profiling import tracer, loop_monitor, profiler, LOOP_MONITOR_ENABLED
+from update_dedup import update_deduplicator
+from webhook_ingest import (
+    HANDLED_UPDATES, JSON_BACKEND, parse_update_body, is_handled, describe_update, webhook_timings
 )
 # --- Logging optimisé ---
 logging.basicConfig(
@@ -30,11 +52,27 @@ logger.info(f"Version: {telegram.__version__}")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 
+# Serveur Bot API : officiel par défaut, serveur local (telegram-bot-api)
+# ou simulé (benchmarks/fake_bot_api.py)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
+
 if not TELEGRAM_TOKEN:
     raise RuntimeError("❌ Variable manquante : TELEGRAM_BOT_TOKEN")
 if not WEBHOOK_URL:
     raise RuntimeError("❌ Variable manquante : WEBHOOK_URL")
 
+# Traitement des updates : "direct" (dans la requête) ou "queue" (workers en arrière-plan)
+WEBHOOK_PROCESSING = os.getenv("WEBHOOK_PROCESSING", "direct").lower()
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", "5"))
+
+# Attente max d'une update reçue pendant l'initialisation (au-delà : 503, Telegram la renverra)
+STARTUP_WAIT = float(os.getenv("STARTUP_WAIT", "25"))
+
+# Endpoints /admin/* (profilage) : désactivés sans jeton
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # --- Logging optimisé ---
 logging.basicConfig(
     level=logging.INFO,
@@ -51,64 +89,191 @@ logging.getLogger("telegram").setLevel(logging.WARNING)
 
 # --- Application Telegram ---
 application = None
+dispatcher = None
+# Initialisation en arrière-plan : les updates reçues avant attendent `ready`
+startup_task = None
+ready = asyncio.Event()
+
+
+def _buffered_messages():
+    snapshot = status_cache.snapshot
+    return snapshot["buffered_messages"] if snapshot else None
+
+
+# --- Métriques lues à l'export (état courant) ---
+metrics.gauge("bot_job_slots_max", "Envois simultanés autorisés (traitements massifs)", lambda: job_scheduler.max_concurrent)
+metrics.gauge("bot_job_slots_in_use", "Envois en cours (traitements massifs)", lambda: job_scheduler.in_use)
+metrics.gauge("bot_job_slots_waiting", "Envois en attente d'un slot", lambda: job_scheduler.waiting_count)
+metrics.gauge("bot_jobs_active", "Traitements massifs en cours", lambda: len(job_scheduler.list_jobs()))
+metrics.gauge("bot_outbox_jobs_active", "Jobs de l'outbox traités par cette instance", lambda: len(outbox_worker.get_stats()["active_jobs"]))
+metrics.gauge("bot_update_queue_pending", "Updates en file (mode queue)", lambda: dispatcher.pending_count if dispatcher else None)
+metrics.gauge("bot_media_groups_pending", "Albums en cours de regroupement", lambda: media_group_aggregator.get_stats()["pending_albums"])
+metrics.gauge("bot_prefs_pending_writes", "Utilisateurs dont les compteurs attendent l'écriture différée", lambda: prefs_cache.get_stats()["pending_users"])
+metrics.gauge("bot_scheduled_posts_loaded", "Publications programmées chargées en mémoire", lambda: post_scheduler.get_stats()["queued"])
+metrics.gauge("bot_buffered_messages", "Messages dans les buffers (dernier instantané de /stats)", _buffered_messages)
+
+
+def _invalidate_local(user_id: int):
+    """Paramètres modifiés sur une autre instance : caches locaux seulement"""
+    prefs_cache.invalidate(user_id, broadcast=False)
+    keyword_engines.invalidate(user_id, broadcast=False)
+
+
+def _build_application() -> Application:
+    """Application et handlers (aucun appel réseau)"""
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+        .build()
+    )
+    
+    # Enregistrer les handlers
+    # Capture TOUS les messages (texte, médias, etc.) sauf les commandes
+    # Utilise un seul filtre qui capture tout ce qui n'est pas une commande
+    all_media_filters = filters.ALL & ~filters.COMMAND
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("help", start))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("reset", reset_command))
+    app.add_handler(CommandHandler("schedule", schedule_command))
+    app.add_handler(CommandHandler("drip", drip_command))
+    app.add_handler(CommandHandler("targets", targets_command))
+    app.add_handler(CallbackQueryHandler(button_callback))
+    
+    # Handler universel pour TOUS les messages non-commandes
+    app.add_handler(MessageHandler(
+        all_media_filters & ~filters.COMMAND,
+        handle_all_messages
+    ))
+    return app
+
+
+async def _configure_webhook(bot):
+    """Enregistre le webhook s'il ne pointe pas déjà ici"""
+    webhook_info = await bot.get_webhook_info()
+    
+    if webhook_info.url != WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL,
+            allowed_updates=list(HANDLED_UPDATES),
+            drop_pending_updates=True
+        )
+        logger.info(f"✅ Webhook configuré: {WEBHOOK_URL}")
+    else:
+        logger.info(f"✅ Webhook déjà actif: {WEBHOOK_URL}")
+
+
+async def _initialize():
+    """
+    Initialisation complète, pendant que le serveur accepte déjà les updates
+    
+    Schéma (migrations), identité du bot (initialize() -> get_me) et webhook
+    en parallèle, puis démarrage des services. Réessayée tant qu'elle échoue
+    (base ou API pas encore joignable au démarrage à froid).
+    """
+    global dispatcher
+    started = time.perf_counter()
+    delay = 1.0
+    while True:
+        # CRITIQUE: Pour webhook, seulement initialize() - PAS start()
+        results = await asyncio.gather(
+            init_db(),
+            application.initialize(),
+            _configure_webhook(application.bot),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if not errors:
+            break
+        for error in errors:
+            logger.error(f"❌ Erreur initialisation: {error}", exc_info=error)
+        logger.info(f"🔁 Nouvel essai d'initialisation dans {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+    
+    previous_version, schema_version = results[0]
+    if previous_version != schema_version:
+        logger.info(f"✅ Schéma migré: version {previous_version} -> {schema_version}")
+    
+    # Identité lue par initialize() (get_me), gardée en cache par le bot
+    bot_info = application.bot.bot
+    logger.info(f"✅ Bot connecté: @{bot_info.username} (ID: {bot_info.id})")
+    
+    # Identité du bot, infos du webhook et compteurs globaux servis depuis la mémoire
+    status_cache.start(application.bot, bot_info)
+    
+    # Écriture différée des compteurs utilisateur
+    prefs_cache.start()
+    
+    # Invalidations diffusées par les autres instances ; updates renvoyées
+    # par Telegram ignorées (marque haute persistée)
+    await asyncio.gather(
+        coordinator.start(_invalidate_local),
+        update_deduplicator.start()
+    )
+    
+    # Traitements massifs persistants (reprise des jobs interrompus)
+    outbox_worker.start(application.bot)
+    
+    # Albums laissés en base par une instance arrêtée sans stop()
+    bot = application.bot
+    media_group_aggregator.start(
+        lambda user_id, chat_id, items: publish_orphan_album(bot, user_id, chat_id, items)
+    )
+    
+    # Publications programmées : transférées dans l'outbox à l'échéance
+    post_scheduler.start()
+    
+    # Mode file d'attente : le webhook répond immédiatement
+    if WEBHOOK_PROCESSING == "queue":
+        dispatcher = UpdateDispatcher(
+            application,
+            workers=UPDATE_WORKERS,
+            max_pending=UPDATE_QUEUE_SIZE,
+            enqueue_timeout=UPDATE_ENQUEUE_TIMEOUT
+        )
+        dispatcher.start()
+    
+    ready.set()
+    logger.info(f"✅ Bot prêt en {time.perf_counter() - started:.2f}s")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gestion du cycle de vie - MODE WEBHOOK"""
-    global application
+    global application, startup_task
     
     logger.info("🚀 Démarrage du bot en mode WEBHOOK...")
     
-    try:
-        # Créer l'application
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
-        
-        # Enregistrer les handlers
-        # Capture TOUS les messages (texte, médias, etc.) sauf les commandes
-        # Utilise un seul filtre qui capture tout ce qui n'est pas une commande
-        all_media_filters = filters.ALL & ~filters.COMMAND
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", start))
-        application.add_handler(CommandHandler("stats", stats_command))
-        application.add_handler(CommandHandler("reset", reset_command))
-        application.add_handler(CallbackQueryHandler(button_callback))
-        
-        # Handler universel pour TOUS les messages non-commandes
-        application.add_handler(MessageHandler(
-            all_media_filters & ~filters.COMMAND,
-            handle_all_messages
-        ))
-        
-        # CRITIQUE: Pour webhook, seulement initialize() - PAS start()
-        await application.initialize()
-        logger.info("✅ Application initialisée")
-        
-        # Configurer le webhook
-        webhook_info = await application.bot.get_webhook_info()
-        
-        if webhook_info.url != WEBHOOK_URL:
-            await application.bot.set_webhook(
-                url=WEBHOOK_URL,
-                allowed_updates=["message", "callback_query"],
-                drop_pending_updates=True
-            )
-            logger.info(f"✅ Webhook configuré: {WEBHOOK_URL}")
-        else:
-            logger.info(f"✅ Webhook déjà actif: {WEBHOOK_URL}")
-        
-        # Vérifier la connexion
-        bot_info = await application.bot.get_me()
-        logger.info(f"✅ Bot connecté: @{bot_info.username} (ID: {bot_info.id})")
-        
-    except Exception as e:
-        logger.error(f"❌ Erreur initialisation: {e}", exc_info=True)
-        raise
+    # Appels bloquants dans la boucle d'événements (opt-in)
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    
+    # Le serveur répond tout de suite ; l'initialisation se poursuit en arrière-plan
+    application = _build_application()
+    ready.clear()
+    startup_task = asyncio.create_task(_initialize(), name="startup")
     
     yield
     
     # Shutdown
     logger.info("🛑 Arrêt du bot...")
+    if not startup_task.done():
+        startup_task.cancel()
+    await asyncio.gather(startup_task, return_exceptions=True)
+    if dispatcher:
+        await dispatcher.stop()
+    await post_scheduler.stop()
+    await status_cache.stop()
+    await outbox_worker.stop()  # Jobs en cours libérés pour la prochaine instance
+    await media_group_aggregator.stop()  # Albums encore en attente
+    await prefs_cache.stop()
+    await update_deduplicator.stop()
+    await coordinator.stop()
+    await loop_monitor.stop()
+    
     try:
         await application.bot.delete_webhook(drop_pending_updates=True)
         logger.info("✅ Webhook supprimé")
@@ -116,6 +281,7 @@ async def lifespan(app: FastAPI):
         pass
     
     await application.shutdown()
+    await dispose_engines()
     logger.info("✅ Bot arrêté proprement")
 
 
@@ -133,28 +299,71 @@ async def telegram_webhook(request: Request):
     """
     Endpoint principal pour recevoir les updates Telegram
     CRITIQUE: Utiliser process_update() et non update_queue en mode webhook!
+    En mode "queue", l'update est confiée au dispatcher et la réponse est immédiate.
+    Durée de chaque étape : GET /webhook/timings
     """
     try:
-        # Récupérer les données
-        data = await request.json()
-        
-        # Logger pour debug (optionnel)
-        if data.get("message"):
-            user_id = data["message"].get("from", {}).get("id")
-            text = data["message"].get("text", "")
-            logger.info(f"📨 Message reçu de {user_id}: {text[:50]}")
-        elif data.get("callback_query"):
-            user_id = data["callback_query"].get("from", {}).get("id")
-            callback_data = data["callback_query"].get("data", "")
-            logger.info(f"🔘 Callback de {user_id}: {callback_data}")
-        
-        # Convertir en Update Telegram
-        update = Update.de_json(data, application.bot)
-        
-        # CRITIQUE: En webhook, utiliser process_update() directement
-        await application.process_update(update)
-        
-        return {"ok": True}
+        with webhook_timings.measure("total"):
+            # Corps brut parsé directement (orjson si disponible)
+            with webhook_timings.measure("read"):
+                body = await request.body()
+            with webhook_timings.measure("parse"):
+                data = parse_update_body(body)
+            
+            # Type non traité par les handlers : ignoré sans désérialisation
+            if not is_handled(data):
+                webhook_timings.record("ignored", 0.0)
+                return {"ok": True, "ignored": True}
+            
+            # Initialisation en cours : l'update attend (au plus STARTUP_WAIT secondes)
+            if not ready.is_set():
+                with webhook_timings.measure("startup_wait"):
+                    try:
+                        await asyncio.wait_for(ready.wait(), STARTUP_WAIT)
+                    except asyncio.TimeoutError:
+                        return JSONResponse(
+                            status_code=503,
+                            content={"ok": False, "error": "Initialisation en cours"}
+                        )
+            
+            # Update renvoyée (réponse trop lente) : ignorée avant tout traitement
+            update_id = data.get("update_id")
+            if update_deduplicator.is_duplicate(update_id):
+                logger.info(f"♻️ Update {update_id} déjà reçue, ignorée")
+                return {"ok": True, "duplicate": True}
+            
+            try:
+                # Résumé construit seulement si le niveau DEBUG est actif
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(describe_update(data))
+                
+                # Convertir en Update Telegram
+                with webhook_timings.measure("deserialize"):
+                    update = Update.de_json(data, application.bot)
+                
+                if dispatcher:
+                    # File pleine : 503 pour que Telegram renvoie l'update plus tard
+                    with webhook_timings.measure("enqueue"):
+                        queued = await dispatcher.enqueue(update)
+                    if not queued:
+                        update_deduplicator.forget(update_id)  # Telegram la renverra
+                        return JSONResponse(
+                            status_code=503,
+                            content={"ok": False, "error": "File d'attente saturée"}
+                        )
+                    return {"ok": True, "queued": True}
+                
+                # CRITIQUE: En webhook, utiliser process_update() directement
+                # (une seule update à la fois par utilisateur, toutes instances confondues)
+                with webhook_timings.measure("process"):
+                    async with coordinator.user_lock(UpdateDispatcher.partition_key(update)):
+                        await application.process_update(update)
+                
+                return {"ok": True}
+            finally:
+                # Traitée, mise en file ou en erreur (200) : Telegram ne la renverra pas.
+                # Sans effet après forget() (503)
+                update_deduplicator.confirm(update_id)
     
     except Exception as e:
         logger.error(f"❌ Erreur webhook: {e}", exc_info=True)
@@ -166,12 +375,16 @@ async def telegram_webhook(request: Request):
 @app.get("/")
 async def health_check():
     """Endpoint de santé"""
+    if not ready.is_set():
+        return {"status": "⏳ Starting", "ready": False}
+    
     try:
-        bot_info = await application.bot.get_me()
-        webhook_info = await application.bot.get_webhook_info()
+        bot_info = status_cache.bot_info
+        webhook_info = await status_cache.get_webhook_info()
         
         return {
             "status": "✅ Online",
+            "ready": True,
             "bot": {
                 "username": f"@{bot_info.username}",
                 "id": bot_info.id,
@@ -204,25 +417,10 @@ async def health_check():
 @app.get("/stats")
 async def global_stats():
     """Statistiques globales du bot"""
-    from sqlalchemy import func
-    
     try:
-        with get_db() as db:
-            total_users = db.query(UserPreferences).count()
-            active_publish = db.query(UserPreferences).filter(
-                UserPreferences.publish_mode == True
-            ).count()
-            active_buffer = db.query(UserPreferences).filter(
-                UserPreferences.buffer_mode == True
-            ).count()
-            
-            total_processed = db.query(UserPreferences).with_entities(
-                func.sum(UserPreferences.messages_processed)
-            ).scalar() or 0
-            
-            total_failed = db.query(UserPreferences).with_entities(
-                func.sum(UserPreferences.messages_failed)
-            ).scalar() or 0
+        totals = await status_cache.get_global_stats()
+        total_processed = totals["total_processed"]
+        total_failed = totals["total_failed"]
         
         success_rate = 0
         if total_processed + total_failed > 0:
@@ -230,19 +428,31 @@ async def global_stats():
         
         return {
             "users": {
-                "total": total_users,
-                "with_publish_mode": active_publish,
-                "with_buffer_mode": active_buffer
+                "total": totals["total_users"],
+                "with_publish_mode": totals["with_publish_mode"],
+                "with_buffer_mode": totals["with_buffer_mode"]
             },
             "messages": {
+                "buffered": totals["buffered_messages"],
                 "total_processed": total_processed,
                 "total_failed": total_failed,
                 "success_rate": f"{success_rate:.2f}%"
             },
-            "processor": {
-                "max_concurrent": 15,
-                "base_delay": 0.05,
-                "retry_count": 3
+            "processor": job_scheduler.get_stats(),
+            "updates": dispatcher.get_stats() if dispatcher else {"mode": "direct"},
+            "prefs_cache": prefs_cache.get_stats(),
+            "rate_limiter": rate_limiter.get_stats(),
+            "media_groups": media_group_aggregator.get_stats(),
+            "update_dedup": update_deduplicator.get_stats(),
+            "coordination": coordinator.get_stats(),
+            "status_cache": status_cache.get_stats(),
+            "profiling": {
+                "tracing": tracer.get_stats(),
+                "event_loop": loop_monitor.get_stats()
+            },
+            "transforms": {
+                "pipelines": transform_pipelines.get_stats(),
+                "keyword_engines": keyword_engines.get_stats()
             }
         }
     except Exception as e:
@@ -250,6 +460,32 @@ async def global_stats():
         return {"error": str(e)}
 
 
+@app.get("/jobs")
+async def list_jobs():
+    """Traitements massifs en cours"""
+    return {
+        "scheduler": job_scheduler.get_stats(),
+        "outbox": outbox_worker.get_stats(),
+        "scheduled_posts": post_scheduler.get_stats(),
+        "jobs": job_scheduler.list_jobs()
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métriques au format texte Prometheus"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/webhook/timings")
+async def webhook_stage_timings(reset: bool = False):
+    """Coût de chaque étape du webhook : lecture, parsing, désérialisation, traitement"""
+    stats = {"json_backend": JSON_BACKEND, "stages": webhook_timings.get_stats()}
+    if reset:
+        webhook_timings.reset()
+    return stats
+
+
 @app.get("/webhook/info")
 async def webhook_info():
     """Informations sur le webhook"""
@@ -275,15 +511,51 @@ async def reset_webhook():
         await application.bot.delete_webhook(drop_pending_updates=True)
         await application.bot.set_webhook(
             url=WEBHOOK_URL,
-            allowed_updates=["message", "callback_query"],
+            allowed_updates=list(HANDLED_UPDATES),
             drop_pending_updates=True
         )
+        status_cache.invalidate_webhook()
         return {"status": "✅ Webhook reconfiguré", "url": WEBHOOK_URL}
     except Exception as e:
         logger.error(f"Erreur reset webhook: {e}")
         return {"status": "❌ Erreur", "error": str(e)}
 
 
+# --- Administration (profilage) ---
+def _require_admin(request: Request):
+    """Jeton ADMIN_TOKEN attendu dans l'en-tête X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Jeton admin invalide")
+
+
+@app.post("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10.0, format: str = "json"):
+    """
+    Profil par échantillonnage de la boucle d'événements pendant `seconds`
+    (format=folded : piles repliées pour flamegraph/speedscope)
+    """
+    _require_admin(request)
+    try:
+        result = await profiler.profile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "folded":
+        return PlainTextResponse("\n".join(result["folded"]) + "\n")
+    return result
+
+
+@app.post("/admin/tracing")
+async def admin_tracing(request: Request, enabled: bool):
+    """Active ou coupe la mesure des étapes (bot_span_seconds dans /metrics)"""
+    _require_admin(request)
+    tracer.enabled = enabled
+    logger.info(f"🔎 Mesure des étapes {'activée' if enabled else 'désactivée'}")
+    return tracer.get_stats()
+
+
 # --- Gestion d'erreurs ---
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -0,0 +1,246 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from coordination import coordinator
+from db import stage_media_group_item_async, take_media_group_async, take_stale_media_groups_async
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupAggregator:
+    """
+    Regroupe les updates d'un même album (media_group_id)
+
+    Telegram envoie un album sous forme de N updates séparées, à quelques
+    millisecondes d'intervalle. Chaque nouvel élément repousse l'échéance ;
+    une fois la fenêtre écoulée sans nouvel élément, le callback reçoit
+    l'album complet, trié par message_id. add() ne bloque jamais : le
+    handler rend la main immédiatement.
+
+    Plusieurs instances (`distributed`) : les éléments peuvent arriver sur
+    des instances différentes. Ils sont enregistrés en base
+    (media_group_items) ; la première instance à recevoir un élément
+    réclame l'album (media_groups) et le publie seule, au complet. En cas
+    d'erreur base, l'élément est regroupé en mémoire comme avec une seule
+    instance. Un album resté en base plus de `sweep_after` secondes (instance
+    arrêtée sans stop()) est repris par n'importe quelle instance et publié
+    via le callback de start().
+    """
+
+    def __init__(
+        self,
+        window: float = 1.0,
+        distributed: bool = False,
+        instance_id: str = None,
+        sweep_after: float = 30.0
+    ):
+        self.window = window
+        self.distributed = distributed
+        self.instance_id = instance_id
+        self.sweep_after = sweep_after
+        # media_group_id -> {"items": [...], "on_complete": callback, "timer": handle}
+        self._groups: Dict[str, Dict] = {}
+        # Albums réclamés en base par cette instance : media_group_id -> {"on_complete", "watcher"}
+        self._claimed: Dict[str, Dict] = {}
+        self._staging: Set[asyncio.Task] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        # (user_id, chat_id, éléments) -> publication d'un album repris
+        self._on_orphan: Optional[Callable[[int, int, List], Awaitable]] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+        self.albums_count = 0
+        self.items_count = 0
+        self.staging_errors = 0
+        self.orphans = 0
+
+    def start(self, on_orphan: Callable[[int, int, List], Awaitable]):
+        """Reprise des albums abandonnés par une autre instance (à appeler dans la boucle d'événements)"""
+        self._on_orphan = on_orphan
+        if self.distributed:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="album-sweep")
+
+    def add(
+        self,
+        group_id: str,
+        message_id: int,
+        item,
+        on_complete: Callable[[List], Awaitable],
+        user_id: int = None,
+        chat_id: int = None
+    ):
+        """
+        Ajoute un élément à l'album
+
+        Le callback du premier élément est celui appelé pour tout l'album.
+        user_id / chat_id : pour publier l'album si cette instance disparaît.
+        """
+        self.items_count += 1
+        if self.distributed:
+            self._spawn(
+                self._staging,
+                self._stage(group_id, message_id, item, on_complete, user_id, chat_id),
+                f"album-stage-{group_id}"
+            )
+        else:
+            self._add_local(group_id, message_id, item, on_complete)
+
+    def _spawn(self, tasks: Set[asyncio.Task], coroutine, name: str) -> asyncio.Task:
+        task = asyncio.create_task(coroutine, name=name)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    # --- Une instance : regroupement en mémoire ---
+    def _add_local(self, group_id: str, message_id: int, item, on_complete: Callable[[List], Awaitable]):
+        group = self._groups.get(group_id)
+        if group is None:
+            group = self._groups[group_id] = {"items": [], "on_complete": on_complete, "timer": None}
+        else:
+            group["timer"].cancel()
+
+        group["items"].append((message_id, item))
+        group["timer"] = asyncio.get_running_loop().call_later(self.window, self._fire, group_id)
+
+    def _fire(self, group_id: str):
+        group = self._groups.pop(group_id, None)
+        if group is None:
+            return
+        items = [item for _, item in sorted(group["items"], key=lambda entry: entry[0])]
+        self._spawn(self._tasks, self._complete(group_id, items, group["on_complete"]), f"album-{group_id}")
+
+    async def _complete(self, group_id: str, items: List, on_complete: Callable[[List], Awaitable]):
+        self.albums_count += 1
+        try:
+            await on_complete(items)
+        except Exception as e:
+            logger.error(f"❌ Erreur publication album {group_id}: {e}", exc_info=True)
+
+    # --- Plusieurs instances : regroupement en base ---
+    async def _stage(
+        self,
+        group_id: str,
+        message_id: int,
+        item,
+        on_complete: Callable[[List], Awaitable],
+        user_id: int = None,
+        chat_id: int = None
+    ):
+        try:
+            owned = await stage_media_group_item_async(
+                group_id, message_id, json.dumps(item), self.instance_id, user_id, chat_id
+            )
+        except Exception as e:
+            self.staging_errors += 1
+            logger.error(f"❌ Album {group_id} non partagé, regroupement local: {e}")
+            self._add_local(group_id, message_id, item, on_complete)
+            return
+
+        if owned and group_id not in self._claimed:
+            self._claimed[group_id] = {
+                "on_complete": on_complete,
+                "watcher": self._spawn(self._tasks, self._watch(group_id), f"album-{group_id}")
+            }
+
+    async def _watch(self, group_id: str):
+        """Attend la fin de l'album (toutes instances confondues) puis le publie"""
+        while True:
+            await asyncio.sleep(self.window)
+            if await self._take(group_id, self.window):
+                return
+
+    async def _take(self, group_id: str, window: float) -> bool:
+        """Publie l'album s'il est complet ; False s'il reçoit encore des éléments"""
+        try:
+            items = await take_media_group_async(group_id, window)
+        except Exception as e:
+            logger.error(f"❌ Lecture album {group_id}: {e}")
+            return False
+        if items is None:
+            return False
+        claim = self._claimed.pop(group_id, None)
+        if claim is None:  # Déjà repris par le balayage
+            return True
+        on_complete = claim["on_complete"]
+        if items:
+            # Tâche à part : l'arrêt d'un watcher n'interrompt pas une publication
+            items = [json.loads(item) for item in items]
+            self._spawn(self._tasks, self._complete(group_id, items, on_complete), f"album-{group_id}")
+        return True
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_after / 2)
+            try:
+                await self._sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Balayage des albums abandonnés: {e}")
+
+    async def _sweep(self):
+        """Publie les albums dont l'instance propriétaire a disparu"""
+        for group_id, user_id, chat_id, items in await take_stale_media_groups_async(self.sweep_after):
+            items = [json.loads(item) for item in items]
+            claim = self._claimed.pop(group_id, None)
+            if claim is not None:
+                # Le nôtre, en retard (base injoignable entre-temps)
+                claim["watcher"].cancel()
+                on_complete = claim["on_complete"]
+            elif user_id is not None and chat_id is not None and self._on_orphan is not None:
+                logger.warning(f"⚠️ Album {group_id} abandonné par son instance, repris ici")
+                self.orphans += 1
+                on_complete = functools.partial(self._on_orphan, user_id, chat_id)
+            else:
+                logger.warning(f"⚠️ Album {group_id} abandonné, supprimé ({len(items)} médias)")
+                continue
+            if items:
+                self._spawn(self._tasks, self._complete(group_id, items, on_complete), f"album-{group_id}")
+
+    async def stop(self):
+        """Publie immédiatement les albums en attente et attend leur envoi"""
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        # Éléments encore en cours d'enregistrement
+        if self._staging:
+            await asyncio.gather(*self._staging, return_exceptions=True)
+
+        # Albums réclamés : publiés avec les éléments déjà reçus par toutes les instances
+        watchers = [claim["watcher"] for claim in self._claimed.values()]
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+        for group_id in list(self._claimed):
+            self._spawn(self._tasks, self._take(group_id, 0), f"album-{group_id}")
+
+        for group_id, group in list(self._groups.items()):
+            group["timer"].cancel()
+            self._fire(group_id)
+        # Une lecture d'album peut encore lancer sa publication
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        """Statistiques de l'agrégateur"""
+        return {
+            "pending_albums": len(self._groups) + len(self._claimed),
+            "albums": self.albums_count,
+            "items": self.items_count,
+            "distributed": self.distributed,
+            "staging_errors": self.staging_errors,
+            "orphans": self.orphans
+        }
+
+
+# Instance globale (une par processus)
+media_group_aggregator = MediaGroupAggregator(
+    window=float(os.getenv("MEDIA_GROUP_WINDOW", "1.0")),
+    distributed=coordinator.enabled,
+    instance_id=coordinator.instance_id,
+    sweep_after=float(os.getenv("MEDIA_GROUP_SWEEP_AFTER", "30"))
+)
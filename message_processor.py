@@ -1,118 +1,776 @@
 import asyncio
+import json
 import logging
-from typing import List, Dict, Optional, Callable
-from telegram import Bot
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Dict, Optional, Callable, Awaitable, Iterable, AsyncIterable, AsyncIterator, NamedTuple, Sequence, Union
+from telegram import Bot, MessageEntity, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
 from telegram.error import TelegramError, RetryAfter, TimedOut
-from db import UserPreferences
+from metrics import telegram_api_seconds, telegram_api_errors
+from profiling import tracer
+from rate_limiter import rate_limiter
+from transform import (
+    PrefsSnapshot, TransformPipeline, check_length,
+    MESSAGE_LIMIT, CAPTION_LIMIT
+)
 
 logger = logging.getLogger(__name__)
 
+# Médias acceptés dans un album (send_media_group), 10 par envoi
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+ALBUM_MEDIA_TYPES = set(INPUT_MEDIA)
+MAX_ALBUM_SIZE = 10
 
-class MessageProcessor:
-    """Gestionnaire ultra-optimisé pour le traitement massif de messages"""
+# Médias dont la légende peut être remplacée lors d'un copy_message
+COPY_CAPTION_TYPES = ALBUM_MEDIA_TYPES | {"voice", "animation"}
+# copy_messages : 100 messages max par appel
+MAX_COPY_BATCH = 100
+
+
+# Médias envoyés par leur méthode dédiée (send_photo, send_video...)
+SEND_MEDIA_TYPES = {"photo", "video", "document", "audio", "voice", "animation", "sticker"}
+
+
+@contextmanager
+def api_call(method: str):
+    """Latence et erreurs d'un appel à l'API Telegram (GET /metrics)"""
+    start = time.perf_counter()
+    try:
+        yield
+    except TelegramError as e:
+        telegram_api_errors.inc(method, type(e).__name__)
+        raise
+    finally:
+        telegram_api_seconds.observe(time.perf_counter() - start, method)
+
+
+def first_part_limit(media_type: str, media_file_id: str = None) -> int:
+    """Limite du premier morceau : légende d'un média ou message texte"""
+    if media_file_id and media_type not in ("text", "sticker"):
+        return CAPTION_LIMIT
+    return MESSAGE_LIMIT
+
+
+async def send_message_to_target(
+    bot,
+    chat_id: int,
+    text: str,
+    media_type: str,
+    media_file_id: str = None,
+    reply_to: int = None,
+    entities: List[Dict] = None
+):
+    """
+    Envoie un message (texte ou média) vers le chat cible
+    Gère tous les types de médias supportés par Telegram
+    Chaque appel API passe par le limiteur de débit (global + par chat)
+    entities : mise en forme (dicts Telegram), envoyée telle quelle sans parse_mode
+    La longueur est vérifiée avant l'appel (ValueError) : un texte trop long
+    ne consomme ni jeton ni aller-retour
+    """
+    check_length(text, first_part_limit(media_type, media_file_id))
     
-    def __init__(self, max_concurrent: int = 15, base_delay: float = 0.05):
-        self.max_concurrent = max_concurrent
-        self.base_delay = base_delay
-        self.semaphore = asyncio.Semaphore(max_concurrent)
-        self.processed_count = 0
-        self.failed_count = 0
-        self.total_messages = 0
-        self.is_processing = False
+    send_kwargs = {"chat_id": chat_id}
+    if reply_to:
+        send_kwargs["reply_to_message_id"] = reply_to
+    
+    entity_objects = to_message_entities(entities)
+    text_kwargs = {"entities": entity_objects} if entity_objects else {}
+    caption_kwargs = {"caption_entities": entity_objects} if entity_objects else {}
+    
+    # Un seul jeton par appel API (le sticker + texte en consomme deux)
+    await rate_limiter.acquire(chat_id)
+    
+    method = f"send_{media_type}" if media_file_id and media_type in SEND_MEDIA_TYPES else "send_message"
+    try:
+        with api_call(method):
+            if media_type == "text":
+                await bot.send_message(text=text, **send_kwargs, **text_kwargs)
+            
+            elif media_type == "photo" and media_file_id:
+                await bot.send_photo(photo=media_file_id, caption=text, **send_kwargs, **caption_kwargs)
+            
+            elif media_type == "video" and media_file_id:
+                await bot.send_video(video=media_file_id, caption=text, **send_kwargs, **caption_kwargs)
+            
+            elif media_type == "document" and media_file_id:
+                await bot.send_document(document=media_file_id, caption=text, **send_kwargs, **caption_kwargs)
+            
+            elif media_type == "audio" and media_file_id:
+                await bot.send_audio(audio=media_file_id, caption=text, **send_kwargs, **caption_kwargs)
+            
+            elif media_type == "voice" and media_file_id:
+                await bot.send_voice(voice=media_file_id, caption=text, **send_kwargs, **caption_kwargs)
+            
+            elif media_type == "animation" and media_file_id:
+                await bot.send_animation(animation=media_file_id, caption=text, **send_kwargs, **caption_kwargs)
+            
+            elif media_type == "sticker" and media_file_id:
+                # Les stickers ne supportent pas de caption
+                await bot.send_sticker(sticker=media_file_id, **send_kwargs)
+            
+            else:
+                # Fallback: envoyer juste le texte
+                await bot.send_message(text=text, **send_kwargs, **text_kwargs)
+            
+        # Sticker : envoyer le texte séparément si nécessaire
+        if media_type == "sticker" and media_file_id and text and text != "[Sticker]":
+            await rate_limiter.acquire(chat_id)
+            with api_call("send_message"):
+                await bot.send_message(text=text, chat_id=chat_id, **text_kwargs)
+    
+    except RetryAfter as e:
+        # Mettre le chat en pause pour les envois suivants
+        rate_limiter.penalize(chat_id, e.retry_after)
+        raise
+
+
+async def send_media_group_to_target(
+    bot,
+    chat_id: int,
+    items: List[tuple],
+    caption: str = None,
+    reply_to: int = None,
+    caption_entities: List[Dict] = None
+):
+    """
+    Publie un album en un seul appel send_media_group
+    
+    Args:
+        items: (media_type, file_id) dans l'ordre de l'album (10 max)
+        caption: Légende placée sur le premier média
+        caption_entities: Mise en forme de la légende (dicts Telegram)
+    """
+    check_length(caption, CAPTION_LIMIT)
+    
+    entity_objects = to_message_entities(caption_entities) or None
+    media = [
+        INPUT_MEDIA[media_type](
+            media=file_id,
+            caption=caption if index == 0 and caption else None,
+            caption_entities=entity_objects if index == 0 and caption else None
+        )
+        for index, (media_type, file_id) in enumerate(items)
+    ]
+    
+    # Un album = un seul appel API = un seul jeton
+    await rate_limiter.acquire(chat_id)
+    
+    try:
+        with api_call("send_media_group"):
+            return await bot.send_media_group(
+                chat_id=chat_id,
+                media=media,
+                reply_to_message_id=reply_to
+            )
+    except RetryAfter as e:
+        rate_limiter.penalize(chat_id, e.retry_after)
+        raise
+
+
+async def send_parts_to_target(
+    bot,
+    chat_id: int,
+    parts: List[tuple],
+    media_type: str,
+    media_file_id: str = None,
+    reply_to: int = None,
+    run: Callable[[Callable[[], Awaitable]], Awaitable] = None,
+    source: tuple = None,
+    untransformed: bool = False,
+    progress: Dict[int, int] = None,
+    send_first: Callable[[], Awaitable] = None
+):
+    """
+    Envoie un message découpé par TransformPipeline.render()
+    
+    Le premier morceau accompagne le média (légende) ; les suivants partent
+    dans l'ordre en messages texte de continuation.
+    
+    Chemin rapide : avec la source (chat_id, message_id) du message d'origine,
+    un média est republié par copy_message avec sa nouvelle légende, et un
+    texte non transformé est copié tel quel (un seul appel, sans la chaîne
+    send_photo/send_video...).
+    
+    Args:
+        parts: [(texte, entités)]
+        run: Enveloppe de chaque envoi (ex. retry), appel direct par défaut ;
+            un morceau déjà envoyé n'est jamais renvoyé
+        source: (chat_id, message_id) d'origine, None si inconnu
+        untransformed: Le pipeline ne modifie pas le texte
+        progress: Morceaux déjà reçus par cible (chat_id -> nombre) : l'envoi
+            reprend après eux, et la valeur est mise à jour après chaque morceau
+        send_first: Envoi du premier morceau à la place du chemin standard (album)
+    """
+    run = run or (lambda send: send())
+    done = progress.get(chat_id, 0) if progress is not None else 0
+    for index, (text, entities) in enumerate(parts):
+        if index < done:
+            continue
+        if index == 0:
+            if send_first:
+                await run(send_first)
+            elif source and media_file_id and media_type in COPY_CAPTION_TYPES:
+                await run(lambda: copy_message_to_target(
+                    bot, chat_id, source, text, entities, reply_to
+                ))
+            elif source and media_type == "text" and untransformed:
+                await run(lambda: copy_message_to_target(
+                    bot, chat_id, source, reply_to=reply_to
+                ))
+            else:
+                await run(lambda: send_message_to_target(
+                    bot, chat_id, text, media_type, media_file_id, reply_to, entities
+                ))
+        else:
+            await run(lambda: send_message_to_target(
+                bot, chat_id, text, "text", entities=entities
+            ))
+        if progress is not None:
+            progress[chat_id] = index + 1
+
+
+async def copy_message_to_target(
+    bot,
+    chat_id: int,
+    source: tuple,
+    caption: str = None,
+    caption_entities: List[Dict] = None,
+    reply_to: int = None
+):
+    """
+    Republie un message existant en un seul appel copy_message
+    
+    Args:
+        source: (chat_id, message_id) du message d'origine
+        caption: Nouvelle légende d'un média (None : légende d'origine conservée)
+    """
+    kwargs = {}
+    if caption is not None:
+        check_length(caption, CAPTION_LIMIT)
+        kwargs["caption"] = caption
+        kwargs["caption_entities"] = to_message_entities(caption_entities) or None
+    if reply_to:
+        kwargs["reply_to_message_id"] = reply_to
+    
+    await rate_limiter.acquire(chat_id)
+    
+    try:
+        with api_call("copy_message"):
+            return await bot.copy_message(
+                chat_id=chat_id,
+                from_chat_id=source[0],
+                message_id=source[1],
+                **kwargs
+            )
+    except RetryAfter as e:
+        rate_limiter.penalize(chat_id, e.retry_after)
+        raise
+
+
+async def copy_messages_to_target(bot, chat_id: int, from_chat_id: int, message_ids: List[int]) -> int:
+    """
+    Republie jusqu'à 100 messages en un seul appel copy_messages
     
-    def reset_counters(self):
-        """Réinitialise les compteurs"""
+    Les albums sont conservés. Un message introuvable (supprimé entre-temps)
+    est ignoré par Telegram.
+    
+    Returns:
+        Nombre de messages effectivement copiés
+    """
+    await rate_limiter.acquire(chat_id)
+    
+    try:
+        with api_call("copy_messages"):
+            copied = await bot.copy_messages(
+                chat_id=chat_id,
+                from_chat_id=from_chat_id,
+                message_ids=message_ids
+            )
+    except RetryAfter as e:
+        rate_limiter.penalize(chat_id, e.retry_after)
+        raise
+    return len(copied)
+
+
+class FanOut(NamedTuple):
+    """Résultat d'un envoi vers plusieurs cibles"""
+    results: Dict[int, object]  # Cible -> résultat, envois réussis (ordre des cibles)
+    errors: Dict[int, BaseException]  # Cible -> erreur, envois échoués
+
+
+async def fan_out(targets: Sequence[int], send: Callable[[int], Awaitable]) -> FanOut:
+    """
+    Même envoi vers toutes les cibles, en parallèle
+    
+    Le message est transformé une seule fois par l'appelant ; chaque cible
+    garde sa propre cadence (limiteur par chat des send_*_to_target).
+    Un échec sur une partie des cibles n'interrompt pas les autres : il est
+    rendu par cible (errors), pour ne retenter que celles-là. L'erreur ne
+    remonte que si toutes échouent.
+    """
+    if len(targets) == 1:
+        return FanOut({targets[0]: await send(targets[0])}, {})
+    
+    outcomes = await asyncio.gather(*(send(chat_id) for chat_id in targets), return_exceptions=True)
+    results = {}
+    errors = {}
+    for chat_id, outcome in zip(targets, outcomes):
+        if isinstance(outcome, BaseException):
+            errors[chat_id] = outcome
+        else:
+            results[chat_id] = outcome
+    if not results:
+        raise errors[targets[0]]
+    for chat_id, error in errors.items():
+        logger.error(f"❌ Publication vers {chat_id} échouée: {error}")
+    return FanOut(results, errors)
+
+
+def to_message_entities(entities: Optional[List[Dict]]) -> List[MessageEntity]:
+    """Dicts d'entités (pipeline, buffer JSON) -> objets MessageEntity"""
+    if not entities:
+        return []
+    return [MessageEntity.de_json(entity) for entity in entities]
+
+
+def message_entities(message) -> Optional[List[Dict]]:
+    """Mise en forme d'un message à traiter (JSON stocké dans le buffer)"""
+    raw = getattr(message, "entities", None)
+    if not raw:
+        return None
+    return json.loads(raw)
+
+
+def copy_source(message) -> Optional[tuple]:
+    """(chat_id, message_id) d'origine d'une ligne du buffer, None si inconnu"""
+    chat_id = getattr(message, "source_chat_id", None)
+    message_id = getattr(message, "source_message_id", None)
+    if chat_id is None or message_id is None:
+        return None
+    return chat_id, message_id
+
+
+def message_fields(message) -> tuple:
+    """
+    (texte, type de média, file_id) d'un message à traiter
+    
+    Accepte un simple texte ou une ligne du buffer (media_type NULL = texte)
+    """
+    if isinstance(message, str):
+        return message, "text", None
+    return message.message_text, message.media_type or "text", message.media_file_id
+
+
+def _album_key(message) -> Optional[str]:
+    """media_group_id si le message fait partie d'un album publiable"""
+    if isinstance(message, str):
+        return None
+    if message.media_group_id and message.media_type in ALBUM_MEDIA_TYPES:
+        return message.media_group_id
+    return None
+
+
+async def group_albums(messages: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """
+    Regroupe les éléments consécutifs d'un même album
+    
+    Produit les messages isolés tels quels et les albums sous forme de liste
+    (MAX_ALBUM_SIZE éléments max). Source synchrone ou asynchrone.
+    """
+    async def source():
+        if hasattr(messages, "__aiter__"):
+            async for message in messages:
+                yield message
+        else:
+            for message in messages:
+                yield message
+    
+    album: List = []
+    album_key = None
+    async for message in source():
+        key = _album_key(message)
+        if album and (key != album_key or len(album) == MAX_ALBUM_SIZE):
+            yield album if len(album) > 1 else album[0]
+            album = []
+        if key:
+            album.append(message)
+            album_key = key
+        else:
+            yield message
+    if album:
+        yield album if len(album) > 1 else album[0]
+
+
+class CopyBatch(NamedTuple):
+    """Lignes consécutives du buffer republiées par un seul copy_messages"""
+    from_chat_id: int
+    rows: List
+
+
+async def batch_copies(items: AsyncIterable, size: int = MAX_COPY_BATCH) -> AsyncIterator:
+    """
+    Regroupe en CopyBatch les éléments consécutifs dont la source est connue
+    
+    Les albums (listes de group_albums) sont repris dans le lot : copy_messages
+    conserve le regroupement. Les autres éléments sont produits tels quels.
+    Un lot ne mélange pas des lignes aux cibles restantes différentes
+    (échec partiel, pending_targets de l'outbox).
+    """
+    batch: List = []
+    from_chat_id = pending = None
+    async for item in items:
+        rows = item if isinstance(item, list) else [item]
+        sources = [copy_source(row) for row in rows]
+        copyable = all(sources) and len({chat_id for chat_id, _ in sources}) == 1
+        targets = getattr(rows[0], "pending_targets", None)
+        
+        if batch and (not copyable or sources[0][0] != from_chat_id or targets != pending
+                      or len(batch) + len(rows) > size):
+            yield CopyBatch(from_chat_id, batch)
+            batch = []
+        if copyable:
+            from_chat_id, pending = sources[0][0], targets
+            batch.extend(rows)
+        else:
+            yield item
+    if batch:
+        yield CopyBatch(from_chat_id, batch)
+
+
+def result_counts(result: Dict) -> tuple:
+    """
+    (réussis, échecs, ignorés) d'un résultat de traitement
+    
+    Un album ou un lot compte pour chacun de ses messages ("count"),
+    dont "failed" éventuellement perdus en route. Publié sur une partie
+    des cibles seulement ("partial") : compté en échec.
+    """
+    count = result.get("count", 1)
+    if result["status"] in ("error", "partial"):
+        return 0, count, 0
+    if result["status"] == "skipped":
+        return 0, 0, count
+    failed = result.get("failed", 0)
+    return count - failed, failed, 0
+
+
+class BulkJob:
+    """Un traitement massif : compteurs et progression propres au job"""
+    
+    def __init__(self, user_id: int, total_messages: int = 0, job_id: str = None):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.total_messages = total_messages
         self.processed_count = 0
         self.failed_count = 0
+        self.skipped_count = 0
+        self.in_flight = 0  # Slots d'envoi détenus (géré par le JobScheduler)
+        self.status = "pending"
+        self.started_at = time.time()
+        self.finished_at = None
+    
+    @property
+    def is_processing(self) -> bool:
+        return self.status == "running"
+    
+    def get_progress_percentage(self) -> float:
+        """Retourne le pourcentage de progression"""
+        if self.total_messages == 0:
+            return 0.0
+        done = self.processed_count + self.failed_count + self.skipped_count
+        return done / self.total_messages * 100
+    
+    def to_dict(self) -> Dict:
+        """Vue sérialisable du job (endpoint /jobs)"""
+        return {
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "total": self.total_messages,
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+            "skipped": self.skipped_count,
+            "in_flight": self.in_flight,
+            "progress": round(self.get_progress_percentage(), 1),
+            "duration": round((self.finished_at or time.time()) - self.started_at, 1)
+        }
+
+
+class JobScheduler:
+    """
+    Répartit les slots d'envoi entre les jobs actifs
+    
+    - Capacité globale : max_concurrent envois simultanés, tous jobs confondus
+    - Équité : chaque job est limité à max_concurrent / nb_jobs slots
+    - Les slots libérés sont attribués à tour de rôle aux jobs en attente
+    """
+    
+    def __init__(self, max_concurrent: int = 15):
+        self.max_concurrent = max_concurrent
+        self.in_use = 0
+        self._jobs: Dict[str, BulkJob] = {}
+        # job_id -> futures en attente (ordre = tourniquet)
+        self._waiters: "OrderedDict[str, deque]" = OrderedDict()
+    
+    def register(self, job: BulkJob):
+        """Déclare un job actif"""
+        job.status = "running"
+        self._jobs[job.job_id] = job
+    
+    def unregister(self, job: BulkJob, status: str = "completed"):
+        """Retire un job terminé et redistribue sa part"""
+        job.status = status
+        job.finished_at = time.time()
+        self._jobs.pop(job.job_id, None)
+        self._wake()
+    
+    def fair_share(self) -> int:
+        """Nombre de slots auquel chaque job actif a droit"""
+        return max(1, self.max_concurrent // max(1, len(self._jobs)))
+    
+    @property
+    def waiting_count(self) -> int:
+        """Nombre d'envois en attente d'un slot"""
+        return sum(len(queue) for queue in self._waiters.values())
+    
+    async def acquire(self, job: BulkJob):
+        """Attend un slot d'envoi pour ce job"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job.job_id, deque()).append(future)
+        self._wake()
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot accordé juste avant l'annulation : le rendre
+                self.release(job)
+            else:
+                queue = self._waiters.get(job.job_id)
+                if queue and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiters[job.job_id]
+            raise
+    
+    def release(self, job: BulkJob):
+        """Libère un slot et le donne au prochain job éligible"""
+        self.in_use -= 1
+        job.in_flight -= 1
+        self._wake()
+    
+    @asynccontextmanager
+    async def slot(self, job: BulkJob):
+        """Context manager : un slot d'envoi pour la durée du bloc"""
+        await self.acquire(job)
+        try:
+            yield
+        finally:
+            self.release(job)
+    
+    def _wake(self):
+        """Attribue les slots libres à tour de rôle, dans la limite de la part de chaque job"""
+        share = self.fair_share()
+        granted = True
+        while granted and self.in_use < self.max_concurrent:
+            granted = False
+            for job_id, queue in self._waiters.items():
+                job = self._jobs.get(job_id)
+                # Job non enregistré (usage direct) : part complète
+                in_flight = job.in_flight if job else 0
+                if job and in_flight >= share:
+                    continue
+                
+                future = queue.popleft()
+                if not queue:
+                    del self._waiters[job_id]
+                else:
+                    self._waiters.move_to_end(job_id)  # Au suivant
+                
+                if future.done():
+                    granted = True  # Attente annulée, on passe
+                    break
+                
+                if job:
+                    job.in_flight += 1
+                self.in_use += 1
+                future.set_result(None)
+                granted = True
+                break
+    
+    def list_jobs(self) -> List[Dict]:
+        """Jobs en cours d'exécution"""
+        return [job.to_dict() for job in self._jobs.values()]
+    
+    def get_stats(self) -> Dict:
+        """Statistiques du scheduler"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_use": self.in_use,
+            "waiting": self.waiting_count,
+            "active_jobs": len(self._jobs),
+            "fair_share": self.fair_share()
+        }
+
+
+# Scheduler global : la capacité d'envoi est partagée par tous les jobs
+job_scheduler = JobScheduler(max_concurrent=15)
+
+
+class MessageProcessor:
+    """Traitement massif d'un job (une instance par job, compteurs isolés)"""
+    
+    def __init__(
+        self,
+        job: BulkJob,
+        scheduler: JobScheduler = None,
+        base_delay: float = 0.05,
+        pipeline: TransformPipeline = None
+    ):
+        self.job = job
+        self.scheduler = scheduler or job_scheduler
+        self.base_delay = base_delay
+        self.pipeline = pipeline  # Compilé une fois pour tout le job
+    
+    def items(self, messages, prefs: PrefsSnapshot) -> AsyncIterator:
+        """
+        Éléments à traiter : messages isolés, albums et, si rien n'est
+        transformé, lots copy_messages (jusqu'à 100 messages par appel)
+        """
+        items = group_albums(messages)
+        if prefs.publish_mode and prefs.targets and self.pipeline.is_identity:
+            items = batch_copies(items)
+        return items
+    
+    async def _send_with_retry(self, send: Callable[[], Awaitable], retry_count: int = 3):
+        """Exécute un envoi avec retry exponentiel (erreurs permanentes remontées)"""
+        attempt = 0
+        while attempt < retry_count:
+            try:
+                # Cadence limitée par send_*_to_target (global + par chat)
+                return await send()
+            
+            except RetryAfter:
+                # Le chat est déjà en pause (send_*_to_target) :
+                # le prochain essai attend la fin du délai imposé
+                attempt += 1
+            
+            except TimedOut:
+                # Timeout - retry avec délai exponentiel
+                wait_time = (2 ** attempt) * self.base_delay
+                logger.warning(f"Timeout: retry dans {wait_time}s")
+                await asyncio.sleep(wait_time)
+                attempt += 1
+            
+            except TelegramError as e:
+                error_msg = str(e).lower()
+                if any(x in error_msg for x in ["chat not found", "bot was blocked", "user is deactivated"]):
+                    raise  # Ne pas retry si erreur permanente
+                
+                # Retry avec délai exponentiel
+                wait_time = (2 ** attempt) * self.base_delay
+                await asyncio.sleep(wait_time)
+                attempt += 1
+        
+        # Si tous les retries échouent
+        raise Exception(f"Échec après {retry_count} tentatives")
+    
+    def _partial(self, sent: FanOut, count: int = 1, progress: Dict[int, int] = None, **details) -> Dict:
+        """
+        Publié sur une partie des cibles : seules les autres sont à retenter
+
+        failed_targets : cible en échec -> morceaux déjà reçus (reprise après eux)
+        """
+        self.job.failed_count += count
+        progress = progress or {}
+        return {
+            "status": "partial",
+            "count": count,
+            "failed_targets": {chat_id: progress.get(chat_id, 0) for chat_id in sent.errors},
+            "error": "; ".join(f"{chat_id}: {error}" for chat_id, error in sent.errors.items()),
+            **details
+        }
     
     async def process_single_message(
         self, 
-        message_text: str, 
-        prefs: UserPreferences,
+        message, 
+        prefs: PrefsSnapshot,
         bot: Bot,
-        retry_count: int = 3
+        retry_count: int = 3,
+        progress: Dict[int, int] = None
     ) -> Dict:
         """
         Traite un message unique avec retry exponentiel
         
+        Args:
+            message: Texte ou ligne du buffer (média republié via son file_id)
+            progress: Morceaux déjà reçus par cible lors d'un essai précédent
+        
+        Un texte trop long est découpé en plusieurs envois (légende courte
+        puis messages de continuation), chacun avec son propre retry
+        
         Returns:
-            Dict avec status, processed_text, et error si applicable
+            Dict avec status, processed_text, et error si applicable ;
+            "partial" + failed_targets si une partie des cibles a échoué
         """
-        async with self.semaphore:
+        message_text, media_type, media_file_id = message_fields(message)
+        
+        async with self.scheduler.slot(self.job):
             try:
-                # Validation
-                if not message_text or not message_text.strip():
+                # Validation (un média sans légende reste publiable)
+                if not media_file_id and (not message_text or not message_text.strip()):
+                    self.job.skipped_count += 1
                     return {
                         "status": "skipped",
                         "reason": "Message vide"
                     }
                 
-                # Appliquer les transformations
-                processed_text = message_text
-                
-                # Remplacement de mots-clés (support multi-occurrences)
-                if prefs.keyword_find and prefs.keyword_replace:
-                    processed_text = processed_text.replace(
-                        prefs.keyword_find, 
-                        prefs.keyword_replace
-                    )
-                
-                # Ajout préfixe/suffixe
-                processed_text = f"{prefs.prefix}{processed_text}{prefs.suffix}"
-                
-                # Validation de la longueur (Telegram limite à 4096 caractères)
-                if len(processed_text) > 4096:
-                    processed_text = processed_text[:4093] + "..."
+                # Appliquer les transformations (pipeline compilé du job)
+                first_limit = first_part_limit(media_type, media_file_id)
+                with tracer.span("bulk.transform"):
+                    source_entities = message_entities(message) if prefs.keep_formatting else None
+                    parts = self.pipeline.render(message_text, source_entities, first_limit)
+                processed_text = parts[0][0]
                 
-                # Envoi du message avec retry exponentiel
-                if prefs.publish_mode and prefs.target_chat_id:
-                    attempt = 0
-                    while attempt < retry_count:
-                        try:
-                            await bot.send_message(
-                                chat_id=prefs.target_chat_id,
-                                text=processed_text
-                            )
-                            
-                            # Délai anti-rate-limit
-                            await asyncio.sleep(self.base_delay)
-                            
-                            self.processed_count += 1
-                            return {
-                                "status": "success",
-                                "processed_text": processed_text,
-                                "original_text": message_text
-                            }
-                        
-                        except RetryAfter as e:
-                            # Telegram demande d'attendre
-                            wait_time = e.retry_after + 2
-                            logger.warning(f"Rate limit: attente de {wait_time}s")
-                            await asyncio.sleep(wait_time)
-                            attempt += 1
-                        
-                        except TimedOut:
-                            # Timeout - retry avec délai exponentiel
-                            wait_time = (2 ** attempt) * self.base_delay
-                            logger.warning(f"Timeout: retry dans {wait_time}s")
-                            await asyncio.sleep(wait_time)
-                            attempt += 1
-                        
-                        except TelegramError as e:
-                            error_msg = str(e).lower()
-                            if any(x in error_msg for x in ["chat not found", "bot was blocked", "user is deactivated"]):
-                                raise  # Ne pas retry si erreur permanente
-                            
-                            # Retry avec délai exponentiel
-                            wait_time = (2 ** attempt) * self.base_delay
-                            await asyncio.sleep(wait_time)
-                            attempt += 1
+                # Envoi du message avec retry exponentiel, vers toutes les cibles
+                if prefs.publish_mode and prefs.targets:
+                    delivered = dict(progress or {})
+                    with tracer.span("bulk.send"):
+                        sent = await fan_out(prefs.targets, lambda chat_id: send_parts_to_target(
+                            bot=bot,
+                            chat_id=chat_id,
+                            parts=parts,
+                            media_type=media_type,
+                            media_file_id=media_file_id,
+                            run=lambda send: self._send_with_retry(send, retry_count),
+                            source=copy_source(message),
+                            untransformed=self.pipeline.is_identity,
+                            progress=delivered
+                        ))
+                    if sent.errors:
+                        return self._partial(
+                            sent, progress=delivered, processed_text=processed_text, original_text=message_text
+                        )
                     
-                    # Si tous les retries échouent
-                    raise Exception(f"Échec après {retry_count} tentatives")
+                    self.job.processed_count += 1
+                    return {
+                        "status": "success",
+                        "parts": len(parts),
+                        "processed_text": processed_text,
+                        "original_text": message_text
+                    }
                 
                 else:
                     # Pas de mode publication - juste transformer
+                    self.job.processed_count += 1
                     return {
                         "status": "transformed",
                         "processed_text": processed_text,
@@ -120,7 +778,7 @@ class MessageProcessor:
                     }
             
             except Exception as e:
-                self.failed_count += 1
+                self.job.failed_count += 1
                 logger.error(f"Erreur traitement: {e}", exc_info=True)
                 return {
                     "status": "error",
@@ -128,149 +786,158 @@ class MessageProcessor:
                     "original_text": message_text
                 }
     
-    async def process_batch(
+    async def process_album(
         self,
-        messages: List[str],
-        prefs: UserPreferences,
+        album: List,
+        prefs: PrefsSnapshot,
         bot: Bot,
-        progress_callback: Optional[Callable] = None
+        retry_count: int = 3,
+        progress: Dict[int, int] = None
     ) -> Dict:
         """
-        Traite un lot de messages en parallèle avec progression
-        
-        Args:
-            messages: Liste des textes à traiter
-            prefs: Préférences utilisateur
-            bot: Instance du bot Telegram
-            progress_callback: Fonction appelée pour chaque message traité
+        Publie un album (lignes du buffer d'un même media_group_id) en un seul envoi
         
         Returns:
-            Dict avec statistiques et résultats détaillés
+            Dict comme process_single_message, avec "count" = nombre de médias
         """
-        self.reset_counters()
-        self.total_messages = len(messages)
-        self.is_processing = True
+        count = len(album)
+        # Légende de l'album : la première non vide, transformée, sur le premier média
+        captioned = next((row for row in album if row.message_text), None)
+        caption = captioned.message_text if captioned else ""
+        items = [(row.media_type, row.media_file_id) for row in album]
         
-        if not messages:
-            return {
-                "status": "error",
-                "error": "Aucun message à traiter"
-            }
-        
-        # Validation des préférences
-        if prefs.publish_mode and not prefs.target_chat_id:
-            return {
-                "status": "error",
-                "error": "Mode publication activé mais aucun canal cible défini"
-            }
-        
-        # Créer les tâches
-        tasks = []
-        for msg in messages:
-            task = self.process_single_message(
-                message_text=msg,
-                prefs=prefs,
-                bot=bot
-            )
-            tasks.append(task)
-        
-        # Exécuter en parallèle avec progression
-        results = []
-        completed = 0
-        
-        for task in asyncio.as_completed(tasks):
-            result = await task
-            results.append(result)
-            completed += 1
+        async with self.scheduler.slot(self.job):
+            try:
+                source_entities = message_entities(captioned) if prefs.keep_formatting else None
+                parts = self.pipeline.render(caption, source_entities, CAPTION_LIMIT)
+                processed_text, entities = parts[0]
+                
+                if prefs.publish_mode and prefs.targets:
+                    run = lambda send: self._send_with_retry(send, retry_count)
+                    delivered = dict(progress or {})
+                    
+                    async def publish(chat_id: int):
+                        # L'album puis la suite de la légende en messages de continuation
+                        await send_parts_to_target(
+                            bot, chat_id, parts, "text", run=run, progress=delivered,
+                            send_first=lambda: send_media_group_to_target(
+                                bot=bot,
+                                chat_id=chat_id,
+                                items=items,
+                                caption=processed_text,
+                                caption_entities=entities
+                            )
+                        )
+                    
+                    sent = await fan_out(prefs.targets, publish)
+                    if sent.errors:
+                        return self._partial(
+                            sent, count, progress=delivered, processed_text=processed_text, original_text=caption
+                        )
+                    status = "success"
+                else:
+                    status = "transformed"
+                
+                self.job.processed_count += count
+                return {
+                    "status": status,
+                    "count": count,
+                    "processed_text": processed_text,
+                    "original_text": caption
+                }
             
-            # Callback de progression
-            if progress_callback:
-                try:
-                    await progress_callback(completed, self.total_messages, result)
-                except Exception as e:
-                    logger.error(f"Erreur callback progression: {e}")
-        
-        self.is_processing = False
+            except Exception as e:
+                self.job.failed_count += count
+                logger.error(f"Erreur traitement album: {e}", exc_info=True)
+                return {
+                    "status": "error",
+                    "count": count,
+                    "error": str(e),
+                    "original_text": caption
+                }
+    
+    async def process_copy_batch(
+        self,
+        batch: CopyBatch,
+        prefs: PrefsSnapshot,
+        bot: Bot,
+        retry_count: int = 3
+    ) -> Dict:
+        """
+        Republie un lot de messages non transformés en un seul copy_messages
         
-        # Calculer les statistiques
-        successful = sum(1 for r in results if r["status"] in ["success", "transformed"])
-        failed = sum(1 for r in results if r["status"] == "error")
-        skipped = sum(1 for r in results if r["status"] == "skipped")
+        Returns:
+            Dict avec "count" = taille du lot et "failed" = messages non copiés
+            (supprimés de la conversation d'origine entre-temps)
+        """
+        count = len(batch.rows)
+        message_ids = [row.source_message_id for row in batch.rows]
         
-        return {
-            "status": "completed",
-            "total": len(messages),
-            "successful": successful,
-            "failed": failed,
-            "skipped": skipped,
-            "results": results
-        }
+        async with self.scheduler.slot(self.job):
+            try:
+                copied = await fan_out(prefs.targets, lambda chat_id: self._send_with_retry(
+                    lambda: copy_messages_to_target(bot, chat_id, batch.from_chat_id, message_ids),
+                    retry_count
+                ))
+                if copied.errors:
+                    return self._partial(copied, count)
+                # Messages introuvables : les mêmes pour toutes les cibles
+                missing = count - min(copied.results.values())
+                if missing:
+                    logger.warning(f"⚠️ {missing}/{count} messages introuvables, non copiés")
+                
+                self.job.processed_count += count - missing
+                self.job.failed_count += missing
+                return {
+                    "status": "success",
+                    "count": count,
+                    "failed": missing
+                }
+            
+            except Exception as e:
+                self.job.failed_count += count
+                logger.error(f"Erreur copie par lot: {e}", exc_info=True)
+                return {
+                    "status": "error",
+                    "count": count,
+                    "error": str(e)
+                }
     
-    def get_progress_percentage(self) -> float:
-        """Retourne le pourcentage de progression"""
-        if self.total_messages == 0:
-            return 0.0
-        return (self.processed_count + self.failed_count) / self.total_messages * 100
-
+    async def process_item(
+        self,
+        item,
+        prefs: PrefsSnapshot,
+        bot: Bot,
+        progress: Dict[int, int] = None
+    ) -> Dict:
+        """
+        Message isolé, album (group_albums) ou lot à copier (batch_copies)
 
-# Instance globale optimisée
-message_processor = MessageProcessor(max_concurrent=15, base_delay=0.05)
+        progress : morceaux déjà reçus par cible (un lot copié part en un seul appel)
+        """
+        if isinstance(item, CopyBatch):
+            return await self.process_copy_batch(batch=item, prefs=prefs, bot=bot)
+        if isinstance(item, list):
+            return await self.process_album(album=item, prefs=prefs, bot=bot, progress=progress)
+        return await self.process_single_message(message=item, prefs=prefs, bot=bot, progress=progress)
 
 
-async def handle_bulk_processing(
-    messages: List[str],
-    prefs: UserPreferences,
-    bot: Bot,
-    status_message=None
-) -> Dict:
-    """
-    Helper pour le traitement bulk avec mise à jour du statut
-    
-    Args:
-        messages: Liste des messages à traiter
-        prefs: Préférences utilisateur
-        bot: Instance du bot
-        status_message: Message Telegram à mettre à jour
+def format_progress(current: int, total: int, successful: int, failed: int) -> str:
+    """Texte du message de progression d'un traitement massif"""
+    progress_pct = (current / total) * 100 if total else 100.0
+    bar_length = 20
+    filled = int(bar_length * current / total) if total else bar_length
+    bar = "▓" * filled + "░" * (bar_length - filled)
     
-    Returns:
-        Dict avec les résultats du traitement
-    """
-    last_update = 0
+    status_emoji = "⚙️" if current < total else "✅"
     
-    async def update_progress(current: int, total: int, result: Dict):
-        nonlocal last_update
-        
-        # Mise à jour tous les 3 messages ou si terminé
-        if status_message and (current - last_update >= 3 or current == total):
-            try:
-                progress_pct = (current / total) * 100
-                bar_length = 20
-                filled = int(bar_length * current / total)
-                bar = "▓" * filled + "░" * (bar_length - filled)
-                
-                status_emoji = "⚙️" if current < total else "✅"
-                
-                text = (
-                    f"{status_emoji} <b>Traitement en cours...</b>\n\n"
-                    f"[{bar}] {progress_pct:.1f}%\n"
-                    f"📊 {current}/{total} messages\n\n"
-                    f"✅ Réussis: {message_processor.processed_count}\n"
-                    f"❌ Échecs: {message_processor.failed_count}"
-                )
-                
-                await status_message.edit_text(text, parse_mode="HTML")
-                last_update = current
-            except Exception as e:
-                logger.error(f"Erreur MAJ progression: {e}")
-    
-    result = await message_processor.process_batch(
-        messages=messages,
-        prefs=prefs,
-        bot=bot,
-        progress_callback=update_progress
+    return (
+        f"{status_emoji} <b>Traitement en cours...</b>\n\n"
+        f"[{bar}] {progress_pct:.1f}%\n"
+        f"📊 {current}/{total} messages\n\n"
+        f"✅ Réussis: {successful}\n"
+        f"❌ Échecs: {failed}"
     )
-    
-    return result
 
 
 def validate_chat_id(chat_id_str: str) -> Optional[int]:
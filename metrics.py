@@ -0,0 +1,172 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Union
+
+# Bornes (secondes) des histogrammes de latence, celles de Prometheus par défaut
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Compteur croissant, une série par combinaison de labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram:
+    """Distribution de durées (secondes) : buckets cumulés, somme et nombre"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [compte par bucket (+Inf inclus), somme]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Mesure le bloc, même s'il lève une exception"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Valeur instantanée lue au moment de l'export (état des files, caches...)
+
+    La fonction renvoie un nombre, ou {valeurs des labels: nombre}
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], Union[float, Dict[tuple, float]]], labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.read = read
+
+    def collect(self) -> List[str]:
+        value = self.read()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(number)}"
+            for key, number in value.items()
+        ]
+
+
+class MetricsRegistry:
+    """Métriques exportées au format texte Prometheus (GET /metrics)"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, read, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.collect()
+            except Exception:
+                continue  # Une jauge en erreur ne doit pas casser l'export
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# Instance globale (une par processus)
+metrics = MetricsRegistry()
+
+# --- Chemins critiques ---
+webhook_stage_seconds = metrics.histogram(
+    "bot_webhook_stage_seconds", "Durée de chaque étape de réception d'une update", ("stage",)
+)
+db_session_seconds = metrics.histogram(
+    "bot_db_session_seconds", "Durée des sessions de base de données", ("mode",)
+)
+telegram_api_seconds = metrics.histogram(
+    "bot_telegram_api_seconds", "Latence des appels à l'API Telegram", ("method",)
+)
+telegram_api_errors = metrics.counter(
+    "bot_telegram_api_errors_total", "Appels à l'API Telegram en erreur", ("method", "error")
+)
+retry_after_total = metrics.counter(
+    "bot_telegram_retry_after_total", "Limitations RetryAfter imposées par Telegram"
+)
+retry_after_seconds = metrics.counter(
+    "bot_telegram_retry_after_seconds_total", "Attente cumulée imposée par RetryAfter (secondes)"
+)
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from db import (
+    PublishJob, decode_targets, decode_pending_targets, claim_publish_job_async, renew_publish_job_async,
+    release_publish_job_async, get_outbox_counts_async, iter_outbox_messages_async,
+    start_outbox_attempt_async, mark_outbox_messages_async
+)
+from message_processor import (
+    BulkJob, CopyBatch, MessageProcessor, job_scheduler, format_progress, result_counts
+)
+from prefs_cache import prefs_cache
+from rate_limiter import rate_limiter
+from transform import transform_pipelines
+
+logger = logging.getLogger(__name__)
+
+
+def _item_rows(item) -> List:
+    """Lignes de l'outbox couvertes par un élément (message, album ou lot copié)"""
+    if isinstance(item, CopyBatch):
+        return item.rows
+    if isinstance(item, list):
+        return item
+    return [item]
+
+
+class OutboxWorker:
+    """
+    Publication des traitements massifs persistants (tables publish_jobs / publish_outbox)
+
+    - Un job est traité par un seul worker, toutes instances confondues
+      (SELECT ... FOR UPDATE SKIP LOCKED + bail renouvelé en tâche de fond,
+      même pendant un envoi bloqué par un flood wait)
+    - Messages publiés dans l'ordre et marqués un par un : après un arrêt,
+      seul le message en cours d'envoi peut être republié
+    - Échec : le passage s'arrête et le job reprend à partir de ce message
+      (délai exponentiel), rien n'est publié avant lui ; "failed" après max_attempts
+    - Échec sur une partie des cibles : seules celles-ci sont retentées
+    - Au démarrage, les jobs interrompus sont repris dès l'expiration de leur bail
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        lease: float = 60.0,
+        poll_interval: float = 5.0,
+        max_attempts: int = 5,
+        retry_delay: float = 30.0
+    ):
+        self.workers = workers
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # Identifiant de bail de cette instance
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self.bot = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._active: Dict[int, BulkJob] = {}  # id du job en base -> job en cours
+
+        self.jobs_completed = 0
+        self.messages_done = 0
+        self.messages_failed = 0
+        self.retries = 0
+
+    def start(self, bot):
+        """Démarre les workers (à appeler dans la boucle d'événements)"""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"outbox-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"✅ Outbox démarrée: {self.workers} workers ({self.instance_id})")
+
+    def wake(self):
+        """Nouveau job en base : réveille les workers sans attendre le prochain sondage"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def stop(self):
+        """Arrête les workers ; les jobs en cours sont libérés pour être repris"""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await claim_publish_job_async(self.instance_id, self.lease)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Erreur réclamation job: {e}")
+                job = None
+
+            if job is not None:
+                # Une erreur ne doit pas arrêter le worker : le job est repris
+                # à l'expiration de son bail
+                try:
+                    await self._run_job(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Erreur traitement job {job.id}: {e}", exc_info=True)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _heartbeat(self, job_id: int, taken_over: asyncio.Event):
+        """Prolonge le bail pendant tout le passage, y compris pendant un envoi long (flood wait, limiteur)"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await renew_publish_job_async(job_id, self.instance_id, self.lease):
+                    logger.warning(f"⚠️ Job {job_id} repris par une autre instance")
+                    taken_over.set()
+                    return
+            except Exception as e:
+                # Nouvel essai au prochain battement, avant l'expiration du bail
+                logger.error(f"❌ Renouvellement du bail du job {job_id}: {e}")
+
+    async def _run_job(self, job: PublishJob):
+        """Un passage sur les messages à publier du job, puis libération"""
+        # Destination figée à la création du job
+        prefs = (await prefs_cache.get(job.user_id))._replace(
+            publish_mode=job.target_chat_id is not None,
+            target_chat_id=job.target_chat_id,
+            extra_targets=decode_targets(job.extra_targets)
+        )
+        counts = await get_outbox_counts_async(job.id)
+        handled = job.total - counts.get("pending", 0) - counts.get("sending", 0)
+        if handled:
+            logger.info(f"🔁 Reprise du job {job.id}: {handled}/{job.total} messages déjà traités")
+
+        bulk_job = BulkJob(user_id=job.user_id, total_messages=job.total, job_id=f"outbox-{job.id}")
+        processor = MessageProcessor(bulk_job, pipeline=await transform_pipelines.get(prefs))
+        self._active[job.id] = bulk_job
+        job_scheduler.register(bulk_job)
+
+        successful = failed = 0
+        last_progress = handled
+        status = "failed"
+        lease_lost = postponed = False
+        taken_over = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, taken_over), name=f"outbox-lease-{job.id}")
+        try:
+            async for item in processor.items(iter_outbox_messages_async(job.id), prefs):
+                if taken_over.is_set():
+                    lease_lost = True
+                    break
+
+                rows = _item_rows(item)
+                await start_outbox_attempt_async([row.id for row in rows])
+                item_prefs, progress = self._item_prefs(prefs, rows)
+                result = await processor.process_item(item, item_prefs, self.bot, progress)
+                ok, lost, postponed = await self._record(rows, result)
+                successful += ok
+                failed += lost
+                if postponed:
+                    # Ordre préservé : la suite attend le nouvel essai de ce message
+                    break
+                handled += len(rows)
+
+                if handled - last_progress >= 3 and handled < job.total:
+                    await self._show_progress(
+                        job, format_progress(handled, job.total, counts.get("done", 0) + successful,
+                                             counts.get("failed", 0) + failed)
+                    )
+                    last_progress = handled
+            status = "postponed" if postponed else "completed"
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            lease_lost = lease_lost or taken_over.is_set()
+            job_scheduler.unregister(bulk_job, status)
+            self._active.pop(job.id, None)
+            prefs_cache.record_result(job.user_id, processed=successful, failed=failed)
+            self.messages_done += successful
+            self.messages_failed += failed
+            try:
+                if not lease_lost:
+                    counts = await release_publish_job_async(job.id, self.instance_id)
+            except Exception as e:
+                logger.error(f"❌ Erreur libération job {job.id}: {e}")
+                lease_lost = True
+
+        if not lease_lost and counts["completed"]:
+            self.jobs_completed += 1
+            logger.info(f"✅ Job {job.id} terminé ({job.total} messages)")
+            await self._show_progress(
+                job,
+                f"✅ <b>Traitement terminé!</b>\n\n"
+                f"📊 Total: {job.total}\n"
+                f"✅ Réussis: {counts.get('done', 0)}\n"
+                f"❌ Échecs: {counts.get('failed', 0)}\n"
+                f"⏭️ Ignorés: {counts.get('skipped', 0)}\n\n"
+                f"Mode buffer désactivé automatiquement.",
+                final=True
+            )
+
+    def _item_prefs(self, prefs, rows: List):
+        """
+        Échec partiel précédent : seules les cibles restantes sont servies,
+        à partir du premier morceau qu'elles n'ont pas reçu
+
+        Returns:
+            (préférences, morceaux déjà reçus par cible)
+        """
+        progress = decode_pending_targets(rows[0].pending_targets)
+        if not progress:
+            return prefs, None
+        targets = tuple(progress)
+        return prefs._replace(target_chat_id=targets[0], extra_targets=targets[1:]), progress
+
+    async def _record(self, rows: List, result: Dict) -> Tuple[int, int, bool]:
+        """
+        Marque les messages d'un élément selon le résultat
+
+        Returns:
+            (réussis, échecs définitifs, nouvel essai programmé)
+        """
+        message_ids = [row.id for row in rows]
+
+        if result["status"] in ("error", "partial"):
+            attempts = max(row.attempts for row in rows) + 1
+            if attempts >= self.max_attempts:
+                await mark_outbox_messages_async(message_ids, "failed", result.get("error"))
+                return 0, len(rows), False
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            # Échec partiel : les cibles déjà servies ne reçoivent pas de doublon, les
+            # autres reprennent au premier morceau non reçu
+            await mark_outbox_messages_async(
+                message_ids, "pending", result.get("error"),
+                next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay),
+                pending_targets=result.get("failed_targets")
+            )
+            self.retries += len(rows)
+            return 0, 0, True
+
+        ok, lost, _ = result_counts(result)
+        await mark_outbox_messages_async(
+            message_ids, "skipped" if result["status"] == "skipped" else "done"
+        )
+        return ok, lost, False
+
+    async def _show_progress(self, job: PublishJob, text: str, final: bool = False):
+        """Met à jour le message de progression (facultatif, sauf le bilan final)"""
+        if not job.status_chat_id or not job.status_message_id:
+            return
+        if final:
+            await rate_limiter.acquire(job.status_chat_id)
+        elif not await rate_limiter.try_acquire(job.status_chat_id):
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job.status_chat_id,
+                message_id=job.status_message_id,
+                text=text,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            logger.error(f"Erreur MAJ progression job {job.id}: {e}")
+
+    def get_stats(self) -> Dict:
+        """Statistiques des workers de cette instance"""
+        return {
+            "instance": self.instance_id,
+            "workers": self.workers,
+            "active_jobs": sorted(self._active),
+            "jobs_completed": self.jobs_completed,
+            "messages_done": self.messages_done,
+            "messages_failed": self.messages_failed,
+            "retries": self.retries
+        }
+
+
+# Instance globale (une par processus)
+outbox_worker = OutboxWorker(
+    workers=int(os.getenv("OUTBOX_WORKERS", "2")),
+    lease=float(os.getenv("OUTBOX_LEASE", "60")),
+    poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "5")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5")),
+    retry_delay=float(os.getenv("OUTBOX_RETRY_DELAY", "30"))
+)
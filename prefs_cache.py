@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from sqlalchemy import update, bindparam
+
+from coordination import coordinator
+from db import UserPreferences, get_async_db, get_or_create_user_async, get_publish_targets_async
+from transform import PrefsSnapshot, transform_pipelines
+
+logger = logging.getLogger(__name__)
+
+_prefs_table = UserPreferences.__table__
+
+# Une seule requête UPDATE exécutée en lot (executemany) pour tous les utilisateurs
+_FLUSH_STATEMENT = (
+    update(_prefs_table)
+    .where(_prefs_table.c.user_id == bindparam("b_user_id"))
+    .values(
+        messages_processed=_prefs_table.c.messages_processed + bindparam("b_processed"),
+        messages_failed=_prefs_table.c.messages_failed + bindparam("b_failed"),
+        last_activity=bindparam("b_last_activity")
+    )
+)
+
+
+class PreferencesCache:
+    """
+    Cache en mémoire des préférences utilisateur (write-behind)
+
+    - Lecture : LRU + TTL, sous forme de PrefsSnapshot immuables (aucun accès ORM)
+    - Écriture : compteurs et dernière activité cumulés en mémoire,
+      puis écrits périodiquement en un seul UPDATE par lot
+      (les compteurs des objets en cache ne font donc pas foi)
+    - Toute modification des paramètres en base doit appeler invalidate()
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, flush_interval: float = 5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        # user_id -> invalidations reçues pendant un chargement en cours
+        self._generations: Dict[int, int] = {}
+        # user_id -> [messages_processed, messages_failed, last_activity]
+        self._pending: Dict[int, list] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    # --- Lecture ---
+    async def get(self, user_id: int) -> PrefsSnapshot:
+        """Préférences de l'utilisateur (créées si besoin), depuis le cache si possible"""
+        entry = self._entries.get(user_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        # Une seule requête même si plusieurs updates arrivent en même temps
+        loading = self._loading.get(user_id)
+        if loading:
+            try:
+                return await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                # Chargement annulé (pas cet appel) : on recommence
+                if loading.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get(user_id)
+                raise
+
+        self.misses += 1
+        loading = self._loading[user_id] = asyncio.get_running_loop().create_future()
+        generation = self._generations.get(user_id, 0)
+        try:
+            prefs = PrefsSnapshot.from_prefs(await get_or_create_user_async(user_id))._replace(
+                extra_targets=tuple(await get_publish_targets_async(user_id))
+            )
+            # Invalidé pendant la lecture : la valeur lue est peut-être déjà périmée
+            if self._generations.get(user_id, 0) == generation:
+                self._store(user_id, prefs)
+            loading.set_result(prefs)
+            return prefs
+        except Exception as e:
+            loading.set_exception(e)
+            loading.exception()  # Évite l'avertissement si personne n'attend
+            raise
+        finally:
+            # Annulation (CancelledError) : les appels en attente ne doivent pas rester bloqués
+            if not loading.done():
+                loading.cancel()
+            del self._loading[user_id]
+            self._generations.pop(user_id, None)
+
+    def _store(self, user_id: int, prefs: PrefsSnapshot):
+        self._entries[user_id] = (time.monotonic(), prefs)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int, broadcast: bool = True):
+        """
+        Force le rechargement au prochain accès (paramètres modifiés)
+
+        broadcast=False : invalidation reçue d'une autre instance, à ne pas rediffuser
+        """
+        self._entries.pop(user_id, None)
+        if user_id in self._loading:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        transform_pipelines.invalidate(user_id)
+        if broadcast:
+            coordinator.invalidated(user_id)
+
+    # --- Écriture différée ---
+    def touch(self, user_id: int):
+        """Enregistre une activité (écrite au prochain flush)"""
+        self.record_result(user_id)
+
+    def record_result(self, user_id: int, processed: int = 0, failed: int = 0):
+        """Cumule les compteurs et la dernière activité en mémoire"""
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = self._pending[user_id] = [0, 0, None]
+        pending[0] += processed
+        pending[1] += failed
+        pending[2] = datetime.now(timezone.utc)
+
+    async def flush(self) -> int:
+        """Écrit les compteurs cumulés en base (un seul UPDATE par lot)"""
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        rows = [
+            {
+                "b_user_id": user_id,
+                "b_processed": processed,
+                "b_failed": failed,
+                "b_last_activity": last_activity
+            }
+            for user_id, (processed, failed, last_activity) in pending.items()
+        ]
+
+        try:
+            async with get_async_db() as db:
+                await db.execute(_FLUSH_STATEMENT, rows)
+        except Exception as e:
+            # Réintégrer les compteurs pour le prochain essai
+            for user_id, (processed, failed, last_activity) in pending.items():
+                current = self._pending.get(user_id)
+                if current is None:
+                    self._pending[user_id] = [processed, failed, last_activity]
+                else:
+                    current[0] += processed
+                    current[1] += failed
+                    current[2] = current[2] or last_activity
+            logger.error(f"❌ Erreur flush préférences: {e}")
+            raise
+
+        return len(rows)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Déjà loggé, nouvel essai au prochain intervalle
+
+    def start(self):
+        """Démarre le flush périodique"""
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="prefs-cache-flush")
+
+    async def stop(self):
+        """Arrête le flush périodique et écrit ce qui reste"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            pass
+
+    def get_stats(self) -> Dict:
+        """Statistiques du cache"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_users": len(self._pending)
+        }
+
+
+# Instance globale (une par processus)
+prefs_cache = PreferencesCache(
+    max_size=int(os.getenv("PREFS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PREFS_CACHE_TTL", "300")),
+    flush_interval=float(os.getenv("PREFS_FLUSH_INTERVAL", "5"))
+)
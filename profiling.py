@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+span_seconds = metrics.histogram(
+    "bot_span_seconds", "Durée des étapes instrumentées (TRACING)", ("span",)
+)
+loop_lag_seconds = metrics.histogram(
+    "bot_event_loop_lag_seconds", "Retard de la boucle d'événements sur son réveil programmé",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+# Contexte vide partagé : une étape non tracée ne crée aucun objet
+_NO_SPAN = nullcontext()
+
+
+class Tracer:
+    """
+    Étapes instrumentées (parsing, préférences, transformation, envoi...)
+
+    - `with tracer.span("handler.send"):` mesure le bloc (histogramme
+      bot_span_seconds, avertissement au-delà de `slow_threshold`)
+    - Désactivé : span() renvoie un contexte vide partagé
+    """
+
+    def __init__(self, enabled: bool = False, slow_threshold: float = 1.0):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.slow_spans = 0
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NO_SPAN
+        return self._measure(name)
+
+    @contextmanager
+    def _measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            span_seconds.observe(elapsed, name)
+            if elapsed > self.slow_threshold:
+                self.slow_spans += 1
+                logger.warning(f"🐢 Étape {name}: {elapsed:.3f}s")
+
+    def get_stats(self) -> Dict:
+        return {"enabled": self.enabled, "slow_threshold": self.slow_threshold, "slow_spans": self.slow_spans}
+
+
+class LoopLagMonitor:
+    """
+    Détecte les appels bloquants dans la boucle d'événements
+
+    - Une tâche se réveille toutes les `interval` secondes et mesure son
+      retard (histogramme bot_event_loop_lag_seconds)
+    - Un thread de surveillance vérifie ces battements : si la boucle ne
+      répond plus depuis `threshold` secondes, la pile du thread de la
+      boucle est loguée (l'appel bloquant en cours)
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread: Optional[int] = None
+        self._last_beat = 0.0
+        self._reported = False
+
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def start(self):
+        """Démarre la mesure (à appeler dans la boucle d'événements)"""
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat(), name="loop-lag-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"✅ Surveillance de la boucle d'événements (seuil {self.threshold * 1000:.0f}ms)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            loop_lag_seconds.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > self.threshold:
+                self.stalls += 1
+                if not self._reported:
+                    logger.warning(f"🐢 Boucle d'événements en retard de {lag * 1000:.0f}ms")
+            self._last_beat = now
+            self._reported = False
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._last_beat - self.interval
+            if stalled <= self.threshold or self._reported:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._reported = True
+            stack = "".join(traceback.format_stack(frame, limit=20))
+            logger.warning(f"🐢 Boucle d'événements bloquée depuis {stalled * 1000:.0f}ms:\n{stack}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "running": self._task is not None,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls
+        }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """
+    Profil par échantillonnage de la boucle d'événements, à la demande
+
+    Un thread relève la pile du thread de la boucle toutes les `interval`
+    secondes pendant la durée demandée ; rien n'est instrumenté en dehors
+    d'une mesure. Résultat : fonctions les plus présentes (en propre et
+    cumulé) et piles repliées (format flamegraph).
+    """
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60.0):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, thread_id: int = None) -> Dict:
+        """Échantillonne le thread (par défaut celui de la boucle courante)"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Un profil est déjà en cours")
+        try:
+            seconds = min(max(seconds, 0.1), self.max_seconds)
+            thread_id = thread_id or threading.get_ident()
+            return await asyncio.to_thread(self._sample, thread_id, seconds)
+        finally:
+            self._lock.release()
+
+    def _sample(self, thread_id: int, seconds: float) -> Dict:
+        stacks: Counter = Counter()
+        own: Counter = Counter()
+        cumulative: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.reverse()
+                stacks[";".join(labels)] += 1
+                own[labels[-1]] += 1
+                cumulative.update(set(labels))
+                samples += 1
+            time.sleep(self.interval)
+
+        def top(counter: Counter, limit: int = 30):
+            return [
+                {"frame": label, "samples": count, "percent": round(count * 100 / samples, 1)}
+                for label, count in counter.most_common(limit)
+            ]
+
+        return {
+            "seconds": seconds,
+            "interval_ms": self.interval * 1000,
+            "samples": samples,
+            "self": top(own) if samples else [],
+            "cumulative": top(cumulative) if samples else [],
+            "folded": [f"{stack} {count}" for stack, count in stacks.most_common()]
+        }
+
+
+# Instances globales (une par processus)
+tracer = Tracer(
+    enabled=os.getenv("TRACING", "false").lower() == "true",
+    slow_threshold=float(os.getenv("TRACING_SLOW_SPAN", "1.0"))
+)
+loop_monitor = LoopLagMonitor(
+    interval=float(os.getenv("LOOP_MONITOR_INTERVAL", "0.25")),
+    threshold=float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))
+)
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "false").lower() == "true"
+profiler = SamplingProfiler(max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "60")))
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Set, Tuple
+
+from coordination import coordinator
+from db import reserve_rate_tokens_async, block_rate_bucket_async
+from metrics import retry_after_total, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Seau à jetons avec réservation
+
+    Chaque appel réserve ses jetons immédiatement (le solde peut devenir
+    négatif) et attend le temps nécessaire : les appelants sont servis
+    dans l'ordre d'arrivée, sans verrou.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # Jetons par seconde
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Réserve des jetons et retourne le délai d'attente en secondes"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= tokens
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def try_reserve(self, tokens: float = 1) -> bool:
+        """Réserve seulement si les jetons sont disponibles tout de suite"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens < tokens or self.blocked_until > now:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1):
+        """Attend que les jetons soient disponibles"""
+        delay = self.reserve(tokens)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            # Une pénalité RetryAfter a pu arriver pendant l'attente
+            delay = self.blocked_until - time.monotonic()
+
+    def block(self, seconds: float):
+        """Bloque le seau (flood wait imposé par Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Limiteur des envois Telegram : un seau global + un seau par chat_id
+
+    Limites Telegram : ~30 messages/s au total, ~20 messages/min par
+    groupe/canal, ~1 message/s par chat privé.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: float = 30.0,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3.0,
+        private_rate: float = 1.0,
+        private_burst: float = 3.0,
+        max_chats: int = 10000
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.max_chats = max_chats
+        self._chat_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+        self.throttled_count = 0
+        self.penalty_count = 0
+
+    def chat_limits(self, chat_id: int) -> Tuple[float, float]:
+        """(débit, rafale) d'un chat : les IDs de groupe/canal sont négatifs"""
+        if chat_id < 0:
+            return self.group_rate, self.group_burst
+        return self.private_rate, self.private_burst
+
+    def bucket_for(self, chat_id: int) -> TokenBucket:
+        """Seau du chat (créé à la demande, les moins récents sont oubliés)"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(*self.chat_limits(chat_id))
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int, tokens: float = 1):
+        """
+        Attend l'autorisation d'envoyer vers chat_id
+
+        Le seau du chat passe en premier : un canal saturé ne consomme
+        pas la capacité globale des autres chats pendant son attente.
+        """
+        chat_bucket = self.bucket_for(chat_id)
+        delay = chat_bucket.reserve(tokens)
+        if delay > 0:
+            self.throttled_count += 1
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = chat_bucket.blocked_until - time.monotonic()
+
+        await self.global_bucket.acquire(1)
+
+    async def try_acquire(self, chat_id: int) -> bool:
+        """Autorisation immédiate ou refus (envois facultatifs, ex: progression)"""
+        chat_bucket = self.bucket_for(chat_id)
+        if not chat_bucket.try_reserve(1):
+            return False
+        if not self.global_bucket.try_reserve(1):
+            chat_bucket.tokens += 1  # Rendre le jeton du chat
+            return False
+        return True
+
+    def penalize(self, chat_id: int, retry_after: float):
+        """Applique un RetryAfter reçu de Telegram à ce chat"""
+        self.penalty_count += 1
+        retry_after_total.inc()
+        retry_after_seconds.inc(amount=retry_after)
+        self.bucket_for(chat_id).block(retry_after)
+        logger.warning(f"Rate limit: chat {chat_id} bloqué {retry_after}s")
+
+    def get_stats(self) -> Dict:
+        """Statistiques du limiteur"""
+        return {
+            "tracked_chats": len(self._chat_buckets),
+            "throttled": self.throttled_count,
+            "penalties": self.penalty_count
+        }
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Limiteur dont le budget est commun à toutes les instances
+
+    Les seaux (global + par chat) sont stockés en base (table rate_buckets) :
+    chaque réservation est un seul UPSERT atomique, et un RetryAfter reçu
+    par une instance bloque le chat pour toutes. En cas d'erreur base, les
+    seaux locaux prennent le relais.
+    """
+
+    GLOBAL_KEY = "global"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._global_limits = (self.global_bucket.rate, self.global_bucket.capacity)
+        self._tasks: Set[asyncio.Task] = set()
+        self.fallback_count = 0
+
+    async def acquire(self, chat_id: int, tokens: float = 1):
+        """Comme RateLimiter.acquire, seaux partagés"""
+        try:
+            delay = await reserve_rate_tokens_async(f"chat:{chat_id}", *self.chat_limits(chat_id), tokens)
+            if delay > 0:
+                self.throttled_count += 1
+                await asyncio.sleep(delay)
+            delay = await reserve_rate_tokens_async(self.GLOBAL_KEY, *self._global_limits, 1)
+        except Exception as e:
+            self.fallback_count += 1
+            logger.warning(f"⚠️ Seaux partagés indisponibles ({type(e).__name__}), limiteur local")
+            return await super().acquire(chat_id, tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def try_acquire(self, chat_id: int) -> bool:
+        """Comme RateLimiter.try_acquire, seaux partagés"""
+        chat_key = f"chat:{chat_id}"
+        chat_limits = self.chat_limits(chat_id)
+        try:
+            if await reserve_rate_tokens_async(chat_key, *chat_limits, 1, conditional=True) is None:
+                return False
+            if await reserve_rate_tokens_async(self.GLOBAL_KEY, *self._global_limits, 1, conditional=True) is None:
+                await reserve_rate_tokens_async(chat_key, *chat_limits, -1)  # Rendre le jeton du chat
+                return False
+            return True
+        except Exception as e:
+            self.fallback_count += 1
+            logger.warning(f"⚠️ Seaux partagés indisponibles ({type(e).__name__}), limiteur local")
+            return await super().try_acquire(chat_id)
+
+    def penalize(self, chat_id: int, retry_after: float):
+        """Bloque le chat ici tout de suite, puis pour toutes les instances"""
+        super().penalize(chat_id, retry_after)
+        task = asyncio.create_task(self._share_penalty(chat_id, retry_after))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _share_penalty(self, chat_id: int, retry_after: float):
+        try:
+            await block_rate_bucket_async(f"chat:{chat_id}", retry_after)
+        except Exception as e:
+            logger.error(f"❌ Pénalité non partagée (chat {chat_id}): {e}")
+
+    def get_stats(self) -> Dict:
+        """Statistiques du limiteur"""
+        stats = super().get_stats()
+        stats.update(shared=True, fallbacks=self.fallback_count)
+        return stats
+
+
+# Instance partagée par tous les envois du processus
+# (budget commun à toutes les instances en mode multi-instances)
+rate_limiter = (SharedRateLimiter if coordinator.enabled else RateLimiter)(
+    global_rate=float(os.getenv("RATE_GLOBAL_PER_SEC", "30")),
+    global_burst=float(os.getenv("RATE_GLOBAL_PER_SEC", "30")),
+    group_rate=float(os.getenv("RATE_GROUP_PER_MIN", "20")) / 60,
+    group_burst=float(os.getenv("RATE_GROUP_BURST", "3")),
+    private_rate=float(os.getenv("RATE_PRIVATE_PER_SEC", "1")),
+    private_burst=float(os.getenv("RATE_PRIVATE_BURST", "3"))
+)
@@ -0,0 +1,223 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from db import load_scheduled_posts_async, dispatch_scheduled_posts_async
+from outbox import outbox_worker
+
+logger = logging.getLogger(__name__)
+
+# Fuseau des heures saisies dans /schedule et /drip
+SCHEDULE_TIMEZONE = ZoneInfo(os.getenv("SCHEDULE_TIMEZONE", "UTC"))
+
+# Intervalle du mode goutte-à-goutte (minutes)
+MAX_DRIP_INTERVAL = 7 * 24 * 60
+
+_DURATION = re.compile(r"^\+?(\d+)\s*(m|min|h|j|d)?$", re.IGNORECASE)
+_DURATION_UNITS = {None: 60, "m": 60, "min": 60, "h": 3600, "j": 86400, "d": 86400}
+_CLOCK = re.compile(r"^(?:(\d{1,2})/(\d{1,2})(?:/(\d{4}))?\s+)?(\d{1,2})[:hH](\d{2})$")
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """`30`, `30m`, `2h`, `1j` -> secondes (minutes par défaut)"""
+    match = _DURATION.match(text.strip())
+    if not match:
+        return None
+    return int(match.group(1)) * _DURATION_UNITS[(match.group(2) or "").lower() or None]
+
+
+def parse_publish_time(text: str, now: datetime = None) -> Optional[datetime]:
+    """
+    Échéance saisie par l'utilisateur, en UTC
+
+    Formats : `+30m` / `+2h` / `+1j` (délai), `14:30` (aujourd'hui, sinon
+    demain), `25/12 14:30` (cette année, sinon l'an prochain),
+    `25/12/2026 14:30`. Heures dans SCHEDULE_TIMEZONE.
+
+    Returns:
+        None si le format est invalide ou la date passée
+    """
+    now = now or datetime.now(timezone.utc)
+    text = text.strip()
+
+    if text.startswith("+"):
+        seconds = parse_duration(text)
+        return now + timedelta(seconds=seconds) if seconds else None
+
+    match = _CLOCK.match(text)
+    if not match:
+        return None
+    day, month, year, hour, minute = match.groups()
+    local_now = now.astimezone(SCHEDULE_TIMEZONE)
+    try:
+        local = local_now.replace(
+            year=int(year) if year else local_now.year,
+            month=int(month) if month else local_now.month,
+            day=int(day) if day else local_now.day,
+            hour=int(hour), minute=int(minute), second=0, microsecond=0
+        )
+    except ValueError:
+        return None
+
+    # Date incomplète déjà passée : prochaine occurrence
+    if local <= local_now and not year:
+        if day:
+            try:
+                local = local.replace(year=local.year + 1)
+            except ValueError:  # 29/02
+                return None
+        else:
+            local += timedelta(days=1)
+    if local <= local_now:
+        return None
+    return local.astimezone(timezone.utc)
+
+
+def _as_utc(moment: datetime) -> datetime:
+    """SQLite rend des dates sans fuseau : elles sont en UTC"""
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def format_local(moment: datetime) -> str:
+    """Échéance affichée à l'utilisateur (SCHEDULE_TIMEZONE)"""
+    return _as_utc(moment).astimezone(SCHEDULE_TIMEZONE).strftime("%d/%m/%Y %H:%M")
+
+
+class PostScheduler:
+    """
+    Publication à l'échéance des messages programmés (table scheduled_posts)
+
+    - Tas en mémoire des échéances (publish_at, id) : le réveil a lieu à la
+      prochaine échéance, sans sonder la table
+    - Seule la fenêtre [maintenant, maintenant + horizon] est chargée, par une
+      requête sur l'index publish_at, rechargée toutes les horizon/2 secondes
+      (publications programmées par une autre instance) ou après refresh()
+    - À l'échéance, les messages passent dans l'outbox (un job par
+      utilisateur et cible) : envoi, nouveaux essais et reprise après
+      redémarrage sont ceux des traitements massifs
+    """
+
+    def __init__(self, horizon: float = 600.0, max_loaded: int = 10000, batch_size: int = 500):
+        self.horizon = horizon
+        self.max_loaded = max_loaded
+        self.batch_size = batch_size
+
+        self._heap: List[Tuple[float, int]] = []
+        self._queued: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._reload_at = 0.0
+
+        self.reloads = 0
+        self.posts_dispatched = 0
+        self.jobs_created = 0
+
+    def start(self):
+        """Démarre le minuteur (à appeler dans la boucle d'événements)"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="post-scheduler")
+        logger.info(f"✅ Programmation démarrée (horizon {self.horizon:.0f}s)")
+
+    async def stop(self):
+        """Arrête le minuteur ; les publications restent en base"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def refresh(self):
+        """Nouvelles publications en base : recharge la fenêtre tout de suite"""
+        self._reload_at = 0.0
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if time.time() >= self._reload_at:
+                await self._reload()
+
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                _, post_id = heapq.heappop(self._heap)
+                self._queued.discard(post_id)
+                due.append(post_id)
+            if due:
+                await self._dispatch(due)
+                continue
+
+            timeout = self._reload_at - now
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _reload(self):
+        """Charge les échéances de la fenêtre qui ne sont pas déjà dans le tas"""
+        now = time.time()
+        try:
+            rows = await load_scheduled_posts_async(
+                datetime.fromtimestamp(now + self.horizon, timezone.utc), self.max_loaded
+            )
+        except Exception as e:
+            logger.error(f"❌ Chargement des publications programmées: {e}")
+            self._reload_at = now + min(self.horizon / 2, 30)
+            return
+
+        for post_id, publish_at in rows:
+            if post_id not in self._queued:
+                self._queued.add(post_id)
+                heapq.heappush(self._heap, (_as_utc(publish_at).timestamp(), post_id))
+        self.reloads += 1
+
+        self._reload_at = now + self.horizon / 2
+        if len(rows) == self.max_loaded:
+            # Fenêtre tronquée : recharger au plus tard à la dernière échéance chargée
+            self._reload_at = min(self._reload_at, _as_utc(rows[-1].publish_at).timestamp())
+
+    async def _dispatch(self, post_ids: List[int]):
+        """Passe les publications échues dans l'outbox"""
+        try:
+            jobs = await dispatch_scheduled_posts_async(post_ids)
+        except Exception as e:
+            # Restées en base : rechargées au prochain passage
+            logger.error(f"❌ Transfert de {len(post_ids)} publications programmées: {e}")
+            self._reload_at = min(self._reload_at, time.time() + 30)
+            return
+
+        if not jobs:
+            return  # Annulées ou déjà transférées par une autre instance
+        for job_id, user_id, total in jobs:
+            logger.info(f"⏰ Job {job_id} programmé: {total} messages (user {user_id})")
+            self.posts_dispatched += total
+        self.jobs_created += len(jobs)
+        outbox_worker.wake()
+
+    def get_stats(self) -> Dict:
+        """Statistiques du minuteur"""
+        next_due = None
+        if self._heap:
+            next_due = datetime.fromtimestamp(self._heap[0][0], timezone.utc).isoformat()
+        return {
+            "queued": len(self._heap),
+            "next_due": next_due,
+            "reloads": self.reloads,
+            "posts_dispatched": self.posts_dispatched,
+            "jobs_created": self.jobs_created
+        }
+
+
+# Instance globale (une par processus)
+post_scheduler = PostScheduler(
+    horizon=float(os.getenv("SCHEDULER_HORIZON", "600")),
+    max_loaded=int(os.getenv("SCHEDULER_MAX_LOADED", "10000"))
+)
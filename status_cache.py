@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from db import get_global_stats_async
+
+logger = logging.getLogger(__name__)
+
+
+class StatusCache:
+    """
+    Réponses de / et /stats servies depuis la mémoire
+
+    - Identité du bot : lue une fois au démarrage (get_me), elle ne change pas
+    - Infos du webhook : gardées `webhook_ttl` secondes, un seul appel à
+      Telegram pour toutes les requêtes simultanées ; en cas d'erreur, la
+      dernière valeur connue est renvoyée
+    - Compteurs globaux (utilisateurs, messages) : une seule requête
+      d'agrégation, rafraîchie en arrière-plan toutes les `stats_interval`
+      secondes
+    """
+
+    def __init__(self, webhook_ttl: float = 30.0, stats_interval: float = 60.0):
+        self.webhook_ttl = webhook_ttl
+        self.stats_interval = stats_interval
+
+        self._bot = None
+        self.bot_info = None
+        self._webhook_info = None
+        self._webhook_at = 0.0
+        self._webhook_lock: Optional[asyncio.Lock] = None
+        self._stats: Optional[Dict] = None
+        self._stats_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.webhook_refreshes = 0
+        self.webhook_errors = 0
+        self.stats_refreshes = 0
+        self.stats_errors = 0
+
+    def start(self, bot, bot_info):
+        """Mémorise l'identité du bot et lance le rafraîchissement des compteurs"""
+        self._bot = bot
+        self.bot_info = bot_info
+        self._webhook_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run(), name="status-cache")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # --- Webhook ---
+    async def get_webhook_info(self):
+        """Infos du webhook (au plus `webhook_ttl` secondes d'âge)"""
+        if self._webhook_info is not None and time.monotonic() - self._webhook_at < self.webhook_ttl:
+            return self._webhook_info
+
+        async with self._webhook_lock:
+            # Rafraîchi par une autre requête pendant l'attente
+            if self._webhook_info is not None and time.monotonic() - self._webhook_at < self.webhook_ttl:
+                return self._webhook_info
+            try:
+                self._webhook_info = await self._bot.get_webhook_info()
+                self._webhook_at = time.monotonic()
+                self.webhook_refreshes += 1
+            except Exception as e:
+                self.webhook_errors += 1
+                if self._webhook_info is None:
+                    raise
+                logger.warning(f"⚠️ Infos webhook indisponibles, dernière valeur utilisée: {e}")
+            return self._webhook_info
+
+    def invalidate_webhook(self):
+        """Webhook reconfiguré : relire les infos à la prochaine demande"""
+        self._webhook_at = 0.0
+
+    # --- Compteurs globaux ---
+    async def _run(self):
+        while True:
+            await self.refresh_stats()
+            await asyncio.sleep(self.stats_interval)
+
+    async def refresh_stats(self):
+        try:
+            self._stats = await get_global_stats_async()
+            self._stats_at = datetime.now(timezone.utc)
+            self.stats_refreshes += 1
+        except Exception as e:
+            self.stats_errors += 1
+            logger.error(f"❌ Rafraîchissement des statistiques globales: {e}")
+
+    @property
+    def snapshot(self) -> Optional[Dict]:
+        """Dernier instantané des compteurs, None s'il n'a pas encore été calculé"""
+        return self._stats
+
+    async def get_global_stats(self) -> Dict:
+        """Dernier instantané des compteurs (calculé à la demande s'il n'y en a pas encore)"""
+        if self._stats is None:
+            await self.refresh_stats()
+            if self._stats is None:
+                raise RuntimeError("Statistiques globales indisponibles")
+        return self._stats
+
+    def get_stats(self) -> Dict:
+        """Fraîcheur des données en cache"""
+        return {
+            "stats_updated_at": self._stats_at.isoformat() if self._stats_at else None,
+            "stats_refreshes": self.stats_refreshes,
+            "stats_errors": self.stats_errors,
+            "webhook_age": round(time.monotonic() - self._webhook_at, 1) if self._webhook_info else None,
+            "webhook_refreshes": self.webhook_refreshes,
+            "webhook_errors": self.webhook_errors
+        }
+
+
+# Instance globale (une par processus)
+status_cache = StatusCache(
+    webhook_ttl=float(os.getenv("WEBHOOK_INFO_TTL", "30")),
+    stats_interval=float(os.getenv("STATS_REFRESH_INTERVAL", "60"))
+)
@@ -0,0 +1,73 @@
+import asyncio
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from coordination import Coordinator
+
+
+class FakeEngine:
+    """Pool de `size` connexions ; `fail_next` checkouts échouent comme un pool épuisé"""
+
+    def __init__(self, size: int, fail_next: int = 0):
+        self.size = size
+        self.fail_next = fail_next
+        self.in_use = self.max_in_use = 0
+
+    async def connect(self):
+        if self.fail_next:
+            self.fail_next -= 1
+            raise PoolTimeoutError("QueuePool limit reached")
+        assert self.in_use < self.size, "pool épuisé"
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, engine: FakeEngine):
+        self.engine = engine
+
+    async def execute(self, statement, params=None):
+        await asyncio.sleep(0)
+
+    async def close(self):
+        self.engine.in_use -= 1
+
+
+def _coordinator(pool_size: int, engine: FakeEngine) -> Coordinator:
+    coordinator = Coordinator(enabled=True, pool_size=pool_size)
+    coordinator._engine = engine
+    return coordinator
+
+
+async def _handle_all(coordinator: Coordinator, users: int) -> list:
+    locked = []
+
+    async def handle(user_id):
+        async with coordinator.user_lock(user_id):
+            await asyncio.sleep(0.01)
+            locked.append(user_id)
+
+    await asyncio.gather(*(handle(user_id) for user_id in range(users)))
+    return locked
+
+
+def test_concurrent_users_wait_for_a_connection():
+    engine = FakeEngine(size=5)
+    coordinator = _coordinator(3, engine)
+    locked = asyncio.run(_handle_all(coordinator, 20))
+
+    assert sorted(locked) == list(range(20))
+    assert engine.max_in_use == 3
+    assert coordinator.lock_count == 20
+    assert coordinator.lock_errors == 0
+
+
+def test_pool_timeout_is_retried_not_processed_without_lock():
+    engine = FakeEngine(size=5, fail_next=2)
+    coordinator = _coordinator(3, engine)
+    asyncio.run(_handle_all(coordinator, 1))
+
+    assert coordinator.pool_waits == 2
+    assert coordinator.lock_count == 1
+    assert coordinator.lock_errors == 0
@@ -0,0 +1,71 @@
+from keyword_engine import KeywordEngine, Rule, format_rule, parse_rules, validate_rule
+
+
+# --- Validation des règles ---
+def test_parse_rules_reads_options():
+    rules, errors = parse_rules("chat => chien | mot i\n\nc(a|o)t => x | regex")
+    assert errors == []
+    assert rules == [
+        Rule(find="chat", replace="chien", whole_word=True, case_insensitive=True),
+        Rule(find="c(a|o)t", replace="x", is_regex=True),
+    ]
+
+
+def test_text_after_pipe_is_kept_unless_only_options():
+    rules, _ = parse_rules("a => b | c")
+    assert rules == [Rule(find="a", replace="b | c")]
+
+
+def test_parse_rules_reports_errors_by_line():
+    rules, errors = parse_rules("ok => bien\nsans séparateur\n( => x | regex\n => vide")
+    assert rules == [Rule(find="ok", replace="bien")]
+    assert [error.split(":")[0] for error in errors] == ["Ligne 2", "Ligne 3", "Ligne 4"]
+    assert "regex invalide" in errors[1]
+    assert "motif vide" in errors[2]
+
+
+def test_group_references_are_rejected():
+    assert "références de groupe" in validate_rule(Rule(find=r"(a)\1", replace="", is_regex=True))
+    assert "références de groupe" in validate_rule(Rule(find=r"(?P<x>a)", replace="", is_regex=True))
+
+
+def test_pattern_matching_empty_text_is_rejected():
+    assert validate_rule(Rule(find="a*", replace="b", is_regex=True)) is not None
+    # Littéral : "a*" n'est pas une regex
+    assert validate_rule(Rule(find="a*", replace="b")) is None
+
+
+def test_regex_inline_flags_stay_local_to_the_rule():
+    assert validate_rule(Rule(find="(?i)abc", replace="", is_regex=True)) is not None
+    assert validate_rule(Rule(find="(?i:abc)", replace="", is_regex=True)) is None
+
+
+def test_format_rule_round_trips():
+    rule = Rule(find="x", replace="y", whole_word=True, is_regex=True)
+    assert parse_rules(format_rule(rule)) == ([rule], [])
+
+
+# --- Application ---
+def test_all_rules_apply_in_one_pass():
+    engine = KeywordEngine([Rule("chat", "chien"), Rule("chien", "chat")])
+    assert engine.apply("chat et chien") == "chien et chat"
+
+
+def test_longest_literal_wins_at_same_position():
+    engine = KeywordEngine([Rule("bon", "mauvais"), Rule("bonjour", "salut")])
+    assert engine.apply("bonjour, bon appétit") == "salut, mauvais appétit"
+
+
+def test_whole_word_and_case_options():
+    engine = KeywordEngine([Rule("chat", "chien", whole_word=True, case_insensitive=True)])
+    assert engine.apply("Chat, chaton, CHAT") == "chien, chaton, chien"
+
+
+def test_regex_with_inner_groups_uses_its_own_replacement():
+    engine = KeywordEngine([Rule(r"(\d+)(€)", "prix", is_regex=True), Rule("a", "b")])
+    assert engine.apply("a 12€") == "b prix"
+
+
+def test_edits_match_apply():
+    engine = KeywordEngine([Rule("un", "1"), Rule("deux", "2")])
+    assert engine.edits("un, deux") == [(0, 2, "1"), (4, 8, "2")]
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import message_processor
+from db import decode_pending_targets, encode_pending_targets
+from message_processor import send_parts_to_target
+
+PARTS = [("un", None), ("deux", None), ("trois", None)]
+
+
+class Calls(list):
+    """Envois réussis, et textes à faire échouer une fois (`fail`)"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = set()
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Envois simulés : (chat_id, texte)"""
+    calls = Calls()
+
+    async def send_message_to_target(bot, chat_id, text, *args, **kwargs):
+        if text in calls.fail:
+            calls.fail.discard(text)
+            raise RuntimeError("chat not found")
+        calls.append((chat_id, text))
+
+    monkeypatch.setattr(message_processor, "send_message_to_target", send_message_to_target)
+    return calls
+
+
+def test_progress_records_parts_received(sent):
+    progress = {}
+    asyncio.run(send_parts_to_target(None, 1, PARTS, "text", progress=progress))
+    assert progress == {1: 3}
+    assert [text for _, text in sent] == ["un", "deux", "trois"]
+
+
+def test_failure_keeps_progress_and_retry_resumes_after_it(sent):
+    progress = {}
+    sent.fail.add("deux")
+    with pytest.raises(RuntimeError):
+        asyncio.run(send_parts_to_target(None, 1, PARTS, "text", progress=progress))
+    assert progress == {1: 1}
+
+    asyncio.run(send_parts_to_target(None, 1, PARTS, "text", progress=progress))
+    assert [text for _, text in sent] == ["un", "deux", "trois"]
+    assert progress == {1: 3}
+
+
+def test_send_first_replaces_the_first_part(sent):
+    async def album():
+        sent.append((1, "album"))
+
+    asyncio.run(send_parts_to_target(None, 1, PARTS[:2], "text", send_first=album))
+    assert [text for _, text in sent] == ["album", "deux"]
+
+
+def test_pending_targets_round_trip():
+    progress = {-100: 0, -200: 2}
+    assert encode_pending_targets(progress) == "-100,-200:2"
+    assert decode_pending_targets("-100,-200:2") == progress
+    # Ancien format : liste de cibles seule
+    assert decode_pending_targets("-100,-200") == {-100: 0, -200: 0}
+    assert encode_pending_targets({}) is None
+    assert decode_pending_targets(None) == {}
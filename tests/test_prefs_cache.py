@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import prefs_cache
+from prefs_cache import PreferencesCache
+from transform import PrefsSnapshot
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Préférences en base (user_id -> préfixe) ; `gate` retient les lectures tant qu'il n'est pas levé"""
+    state = {"prefix": {1: "avant"}, "gate": None, "reads": 0}
+
+    async def get_or_create_user_async(user_id):
+        state["reads"] += 1
+        prefix = state["prefix"][user_id]
+        if state["gate"] is not None:
+            await state["gate"].wait()
+        return PrefsSnapshot(user_id=user_id, prefix=prefix)
+
+    async def get_publish_targets_async(user_id):
+        return []
+
+    monkeypatch.setattr(prefs_cache, "get_or_create_user_async", get_or_create_user_async)
+    monkeypatch.setattr(prefs_cache, "get_publish_targets_async", get_publish_targets_async)
+    return state
+
+
+def test_concurrent_reads_share_one_load(store):
+    async def scenario():
+        cache = PreferencesCache()
+        results = await asyncio.gather(*(cache.get(1) for _ in range(5)))
+        assert {prefs.prefix for prefs in results} == {"avant"}
+
+    asyncio.run(scenario())
+    assert store["reads"] == 1
+
+
+def test_invalidation_during_load_is_not_overwritten(store):
+    async def scenario():
+        cache = PreferencesCache()
+        store["gate"] = asyncio.Event()
+        loading = asyncio.create_task(cache.get(1))
+        await asyncio.sleep(0)
+
+        # Modifiée pendant la lecture : le snapshot lu avant ne doit pas rester en cache
+        store["prefix"][1] = "après"
+        cache.invalidate(1)
+        store["gate"].set()
+        assert (await loading).prefix == "avant"
+
+        store["gate"] = None
+        assert (await cache.get(1)).prefix == "après"
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_load_does_not_block_waiters(store):
+    async def scenario():
+        cache = PreferencesCache()
+        store["gate"] = asyncio.Event()
+        loading = asyncio.create_task(cache.get(1))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get(1))
+        await asyncio.sleep(0)
+
+        loading.cancel()
+        await asyncio.sleep(0)
+        store["gate"].set()
+        # Le second appel recharge lui-même au lieu d'attendre indéfiniment
+        assert (await asyncio.wait_for(waiter, timeout=1)).prefix == "avant"
+        assert loading.cancelled()
+
+    asyncio.run(scenario())
+    assert store["reads"] == 2
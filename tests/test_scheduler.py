@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import scheduler
+from scheduler import parse_duration, parse_publish_time
+
+
+@pytest.fixture(autouse=True)
+def utc(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULE_TIMEZONE", ZoneInfo("UTC"))
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+NOW = _utc(2026, 6, 15, 10, 0)
+
+
+def test_parse_duration_units():
+    assert parse_duration("30") == 1800
+    assert parse_duration("+2h") == 7200
+    assert parse_duration("1j") == 86400
+    assert parse_duration("abc") is None
+
+
+def test_delay():
+    assert parse_publish_time("+30m", NOW) == NOW + timedelta(minutes=30)
+    assert parse_publish_time("+0", NOW) is None
+
+
+def test_clock_later_today():
+    assert parse_publish_time("14:30", NOW) == _utc(2026, 6, 15, 14, 30)
+    assert parse_publish_time("14h30", NOW) == _utc(2026, 6, 15, 14, 30)
+
+
+def test_clock_already_passed_rolls_over_to_tomorrow():
+    assert parse_publish_time("09:00", NOW) == _utc(2026, 6, 16, 9, 0)
+    assert parse_publish_time("10:00", NOW) == _utc(2026, 6, 16, 10, 0)
+
+
+def test_clock_rolls_over_month_and_year():
+    assert parse_publish_time("08:00", _utc(2026, 6, 30, 23, 0)) == _utc(2026, 7, 1, 8, 0)
+    assert parse_publish_time("00:10", _utc(2026, 12, 31, 23, 50)) == _utc(2027, 1, 1, 0, 10)
+
+
+def test_day_already_passed_rolls_over_to_next_year():
+    assert parse_publish_time("25/12 14:30", NOW) == _utc(2026, 12, 25, 14, 30)
+    assert parse_publish_time("01/06 12:00", NOW) == _utc(2027, 6, 1, 12, 0)
+
+
+def test_full_date_is_not_rolled_over():
+    assert parse_publish_time("01/06/2026 12:00", NOW) is None
+    assert parse_publish_time("01/06/2027 12:00", NOW) == _utc(2027, 6, 1, 12, 0)
+
+
+def test_february_29():
+    assert parse_publish_time("29/02 12:00", _utc(2028, 1, 10, 0, 0)) == _utc(2028, 2, 29, 12, 0)
+    # Passé, et l'année suivante n'est pas bissextile
+    assert parse_publish_time("29/02 12:00", _utc(2028, 3, 1, 0, 0)) is None
+
+
+def test_invalid_values():
+    for text in ("25:00", "12:60", "31/02 10:00", "demain", ""):
+        assert parse_publish_time(text, NOW) is None
+
+
+def test_rollover_uses_the_schedule_timezone(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULE_TIMEZONE", ZoneInfo("Europe/Paris"))
+    # 23:30 UTC = 01:30 le lendemain à Paris (UTC+2) : 01:00 est déjà passé là-bas
+    now = _utc(2026, 7, 1, 23, 30)
+    assert parse_publish_time("01:00", now) == _utc(2026, 7, 2, 23, 0)
+    assert parse_publish_time("02:00", now) == _utc(2026, 7, 2, 0, 0)
+
+
+def test_result_is_utc_across_dst_change(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULE_TIMEZONE", ZoneInfo("Europe/Paris"))
+    # Passage à l'heure d'été le 29/03/2026 : le lendemain, 12:00 à Paris = 10:00 UTC
+    now = _utc(2026, 3, 28, 12, 0)
+    assert parse_publish_time("12:00", now) == _utc(2026, 3, 29, 10, 0)
@@ -0,0 +1,112 @@
+from keyword_engine import KeywordEngine, Rule
+from transform import PrefsSnapshot, TransformPipeline, _apply_edits, split_message, utf16_len
+
+BOLD = {"type": "bold"}
+
+
+def _pipeline(prefix="", suffix="", rules=()):
+    return TransformPipeline.build(PrefsSnapshot(user_id=1, prefix=prefix, suffix=suffix), KeywordEngine(rules))
+
+
+def _entity(offset, length, kind="bold"):
+    return {"type": kind, "offset": offset, "length": length}
+
+
+# --- Décalage des entités (_apply_edits, index Python) ---
+def test_insertion_at_entity_start_shifts_it():
+    assert _apply_edits("abcdef", [(2, 4, BOLD)], [(2, 2, "++")]) == ("ab++cdef", [(4, 6, BOLD)])
+
+
+def test_insertion_at_entity_end_leaves_it_intact():
+    assert _apply_edits("abcdef", [(2, 4, BOLD)], [(4, 4, "++")]) == ("abcd++ef", [(2, 4, BOLD)])
+
+
+def test_replacement_inside_entity_resizes_it():
+    text, spans = _apply_edits("ab cd ef", [(0, 8, BOLD)], [(3, 5, "xyz!")])
+    assert text == "ab xyz! ef"
+    assert spans == [(0, 10, BOLD)]
+
+
+def test_replacement_across_entity_end_stops_at_replacement_end():
+    # L'entité couvre "cd", le remplacement "de" déborde : elle s'arrête après le remplacement
+    assert _apply_edits("abcdef", [(2, 4, BOLD)], [(3, 5, "XYZ")]) == ("abcXYZf", [(2, 6, BOLD)])
+
+
+def test_entity_fully_replaced_by_nothing_is_dropped():
+    assert _apply_edits("abcdef", [(2, 4, BOLD)], [(2, 4, "")]) == ("abef", [])
+
+
+def test_several_edits_apply_right_to_left():
+    text, spans = _apply_edits(
+        "one two three",
+        [(0, 3, BOLD), (4, 7, BOLD), (8, 13, BOLD)],
+        [(0, 3, "1"), (8, 13, "3")]
+    )
+    assert text == "1 two 3"
+    assert spans == [(0, 1, BOLD), (2, 5, BOLD), (6, 7, BOLD)]
+
+
+# --- Offsets Telegram (unités UTF-16) ---
+def test_prefix_with_emoji_shifts_offsets_in_utf16_units():
+    text, entities = _pipeline(prefix="😀 ").apply_with_entities("a b", [_entity(2, 1)])
+    assert text == "😀 a b"
+    # "😀" compte pour deux unités UTF-16
+    assert entities == [_entity(5, 1)]
+
+
+def test_entity_after_surrogate_pair_keeps_its_position():
+    text, entities = _pipeline(suffix="!").apply_with_entities("😀 gras", [_entity(3, 4)])
+    assert text == "😀 gras!"
+    assert entities == [_entity(3, 4)]
+
+
+def test_keyword_replacement_with_emoji_grows_entity():
+    pipeline = _pipeline(rules=[Rule(find="ok", replace="👍👍")])
+    text, entities = pipeline.apply_with_entities("c'est ok 😀 fin", [_entity(6, 2), _entity(12, 3, "italic")])
+    assert text == "c'est 👍👍 😀 fin"
+    assert entities == [_entity(6, 4), _entity(14, 3, "italic")]
+
+
+def test_stage_without_edits_drops_entities():
+    pipeline = _pipeline(prefix=">")
+    pipeline.stages += (str.upper,)
+    assert pipeline.apply_with_entities("abc", [_entity(0, 3)]) == (">ABC", [])
+
+
+# --- Découpage (split_message) ---
+def test_short_text_is_a_single_piece():
+    assert split_message("bonjour", [(0, 7, BOLD)]) == [("bonjour", [_entity(0, 7)])]
+
+
+def test_empty_text_gives_one_empty_piece():
+    assert split_message("") == [("", [])]
+
+
+def test_cut_prefers_paragraph_then_word():
+    text = "premier bloc\n\nsecond bloc un peu plus long"
+    pieces = [piece for piece, _ in split_message(text, first_limit=20, limit=20)]
+    assert pieces == ["premier bloc", "second bloc un peu", "plus long"]
+
+
+def test_first_limit_applies_to_first_piece_only():
+    pieces = [piece for piece, _ in split_message("aaaa bbbb cccc dddd", first_limit=5, limit=10)]
+    assert pieces == ["aaaa", "bbbb cccc", "dddd"]
+
+
+def test_entity_across_cut_is_split_between_pieces():
+    assert split_message("aaaa bbbb", [(2, 7, BOLD)], first_limit=5, limit=5) == [
+        ("aaaa", [_entity(2, 2)]),
+        ("bbbb", [_entity(0, 2)]),
+    ]
+
+
+def test_cut_never_splits_a_surrogate_pair():
+    text = "a" + "😀" * 5
+    pieces = split_message(text, first_limit=4, limit=4)
+    assert [piece for piece, _ in pieces] == ["a😀", "😀😀", "😀😀"]
+    assert all(utf16_len(piece) <= 4 for piece, _ in pieces)
+
+
+def test_entity_offsets_of_later_pieces_are_in_utf16_units():
+    pieces = split_message("😀 😀😀", [(0, 4, BOLD)], first_limit=4, limit=4)
+    assert pieces == [("😀", [_entity(0, 2)]), ("😀😀", [_entity(0, 4)])]
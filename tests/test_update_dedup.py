@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import update_dedup
+from update_dedup import UpdateDeduplicator
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """bot_settings en mémoire : clé -> valeur"""
+    store = {}
+
+    async def get_setting_async(key):
+        return (store[key], datetime.now(timezone.utc)) if key in store else None
+
+    async def set_setting_async(key, value):
+        store[key] = value
+
+    monkeypatch.setattr(update_dedup, "get_setting_async", get_setting_async)
+    monkeypatch.setattr(update_dedup, "set_setting_async", set_setting_async)
+    return store
+
+
+def _restart(store, **options) -> UpdateDeduplicator:
+    """Nouvelle instance rechargée depuis la base, sans tâche d'écriture différée"""
+    dedup = UpdateDeduplicator(flush_interval=3600, **options)
+
+    async def start():
+        await dedup.start()
+        dedup._flush_task.cancel()
+        await asyncio.gather(dedup._flush_task, return_exceptions=True)
+        dedup._flush_task = None
+
+    asyncio.run(start())
+    return dedup
+
+
+def _accept(dedup, *update_ids):
+    for update_id in update_ids:
+        assert not dedup.is_duplicate(update_id)
+        dedup.confirm(update_id)
+
+
+# --- Fenêtre ---
+def test_same_update_is_a_duplicate():
+    dedup = UpdateDeduplicator()
+    assert not dedup.is_duplicate(1)
+    assert dedup.is_duplicate(1)
+    assert dedup.get_stats()["duplicates"] == 1
+
+
+def test_update_without_id_is_never_a_duplicate():
+    dedup = UpdateDeduplicator()
+    assert not dedup.is_duplicate(None)
+    assert not dedup.is_duplicate(None)
+
+
+def test_out_of_order_updates_inside_the_window_are_accepted():
+    dedup = UpdateDeduplicator(window=10)
+    _accept(dedup, 10, 5, 7)
+    assert dedup.high_water == 10
+
+
+def test_updates_older_than_the_window_are_duplicates():
+    dedup = UpdateDeduplicator(window=3)
+    _accept(dedup, 1, 2, 3, 4, 5)
+    assert dedup.get_stats()["window"] == 3
+    # Sorti de l'anneau mais sous high_water - window : déjà traité
+    assert dedup.is_duplicate(2)
+    assert dedup.is_duplicate(4)
+    assert not dedup.is_duplicate(6)
+
+
+def test_filter_resets_after_a_long_silence():
+    dedup = UpdateDeduplicator(reset_after=60)
+    _accept(dedup, 1000)
+    dedup._last_at -= 61
+    assert not dedup.is_duplicate(5)
+    assert dedup.high_water == 5
+
+
+# --- Marque haute persistée ---
+def test_floor_is_reloaded_after_a_restart(settings):
+    dedup = _restart(settings)
+    _accept(dedup, 100, 101)
+    asyncio.run(dedup.stop())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "101"
+
+    dedup = _restart(settings)
+    assert dedup.is_duplicate(101)
+    assert dedup.is_duplicate(50)
+    assert not dedup.is_duplicate(102)
+
+
+def test_persisted_value_stays_below_updates_in_progress(settings):
+    dedup = _restart(settings)
+    _accept(dedup, 5)
+    assert not dedup.is_duplicate(6)  # En cours
+    _accept(dedup, 7)
+    asyncio.run(dedup.flush())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "5"
+
+    dedup.confirm(6)
+    asyncio.run(dedup.flush())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "7"
+
+
+def test_persisted_value_never_goes_down(settings):
+    settings[UpdateDeduplicator.SETTING_KEY] = "100"
+    dedup = _restart(settings)
+    assert not dedup.is_duplicate(101)  # En cours : persistable jusqu'à 100
+    asyncio.run(dedup.flush())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "100"
+
+
+def test_other_instance_value_is_not_overwritten_lower(settings):
+    settings[UpdateDeduplicator.SETTING_KEY] = "5"
+    dedup = _restart(settings)
+    _accept(dedup, 10)
+    settings[UpdateDeduplicator.SETTING_KEY] = "20"
+    asyncio.run(dedup.flush())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "20"
+
+
+def test_value_is_rewritten_after_a_reset(settings):
+    settings[UpdateDeduplicator.SETTING_KEY] = "1000"
+    dedup = _restart(settings, reset_after=60)
+    dedup._last_at -= 61
+    _accept(dedup, 5)
+    asyncio.run(dedup.flush())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "5"
+
+
+# --- Update refusée (503) ---
+def test_forgotten_update_is_accepted_again():
+    dedup = UpdateDeduplicator()
+    _accept(dedup, 5)
+    assert not dedup.is_duplicate(6)
+    dedup.forget(6)
+    assert dedup.high_water == 5
+    assert not dedup.is_duplicate(6)
+
+
+def test_forgotten_update_survives_a_restart(settings):
+    dedup = _restart(settings)
+    _accept(dedup, 5)
+    assert not dedup.is_duplicate(6)
+    dedup.forget(6)
+    asyncio.run(dedup.stop())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "5"
+
+    # Renvoyée par Telegram après le redémarrage : acceptée
+    dedup = _restart(settings)
+    assert not dedup.is_duplicate(6)
+
+
+def test_forget_down_to_the_floor(settings):
+    settings[UpdateDeduplicator.SETTING_KEY] = "100"
+    dedup = _restart(settings)
+    assert not dedup.is_duplicate(101)
+    dedup.forget(101)
+    assert dedup.high_water == 100
+    asyncio.run(dedup.flush())
+    assert settings[UpdateDeduplicator.SETTING_KEY] == "100"
+
+    dedup = _restart(settings)
+    assert not dedup.is_duplicate(101)
@@ -0,0 +1,426 @@
+import os
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from keyword_engine import KeywordEngine, Rule, keyword_engines
+
+# Limites Telegram (unités UTF-16 : un emoji hors BMP compte double)
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+
+class PrefsSnapshot(NamedTuple):
+    """
+    Copie immuable des préférences utilisateur (aucun accès ORM)
+
+    Partageable sans risque entre coroutines ; les écritures passent
+    toujours par une session (get_async_db) puis une invalidation du cache.
+    """
+    user_id: int
+    prefix: str = ""
+    suffix: str = ""
+    keyword_find: str = ""
+    keyword_replace: str = ""
+    publish_mode: bool = False
+    target_chat_id: Optional[int] = None
+    conversation_state: str = ""
+    buffer_mode: bool = False
+    keep_formatting: bool = False
+    # Cibles supplémentaires (table publish_targets, chargées par prefs_cache)
+    extra_targets: Tuple[int, ...] = ()
+
+    @property
+    def targets(self) -> Tuple[int, ...]:
+        """Canaux de publication : le principal puis les supplémentaires, sans doublon"""
+        if not self.target_chat_id:
+            return ()
+        return tuple(dict.fromkeys((self.target_chat_id, *self.extra_targets)))
+
+    @classmethod
+    def from_prefs(cls, prefs) -> "PrefsSnapshot":
+        """Snapshot d'un objet UserPreferences (inchangé si c'est déjà un snapshot)"""
+        if isinstance(prefs, cls):
+            return prefs
+        return cls(
+            user_id=prefs.user_id,
+            prefix=prefs.prefix or "",
+            suffix=prefs.suffix or "",
+            keyword_find=prefs.keyword_find or "",
+            keyword_replace=prefs.keyword_replace or "",
+            publish_mode=bool(prefs.publish_mode),
+            target_chat_id=prefs.target_chat_id,
+            conversation_state=prefs.conversation_state or "",
+            buffer_mode=bool(prefs.buffer_mode),
+            keep_formatting=bool(prefs.keep_formatting)
+        )
+
+
+# --- Étapes ---
+# Une fabrique reçoit (snapshot, moteur de mots-clés) et retourne une
+# fonction texte -> texte, ou None si l'étape est inutile pour cet utilisateur.
+# Une étape qui expose aussi edits(texte) -> [(début, fin, remplacement)]
+# conserve la mise en forme (entités) ; sinon les entités sont abandonnées.
+Stage = Callable[[str], str]
+Edit = Tuple[int, int, str]
+StageFactory = Callable[[PrefsSnapshot, KeywordEngine], Optional[Stage]]
+
+_STAGE_FACTORIES: List[StageFactory] = []
+
+
+def register_stage(factory: StageFactory) -> StageFactory:
+    """Ajoute une étape à tous les pipelines (dans l'ordre d'enregistrement)"""
+    _STAGE_FACTORIES.append(factory)
+    return factory
+
+
+class KeywordStage:
+    """Remplacement des mots-clés (toutes les règles en une passe)"""
+
+    def __init__(self, keywords: KeywordEngine):
+        self.keywords = keywords
+
+    def __call__(self, text: str) -> str:
+        return self.keywords.apply(text)
+
+    def edits(self, text: str) -> List[Edit]:
+        return self.keywords.edits(text)
+
+
+class AffixStage:
+    """Ajout préfixe/suffixe"""
+
+    def __init__(self, prefix: str, suffix: str):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __call__(self, text: str) -> str:
+        return f"{self.prefix}{text}{self.suffix}"
+
+    def edits(self, text: str) -> List[Edit]:
+        edits = []
+        if self.prefix:
+            edits.append((0, 0, self.prefix))
+        if self.suffix:
+            edits.append((len(text), len(text), self.suffix))
+        return edits
+
+
+@register_stage
+def keyword_stage(snapshot: PrefsSnapshot, keywords: KeywordEngine) -> Optional[Stage]:
+    if not len(keywords):
+        return None
+    return KeywordStage(keywords)
+
+
+@register_stage
+def affix_stage(snapshot: PrefsSnapshot, keywords: KeywordEngine) -> Optional[Stage]:
+    if not snapshot.prefix and not snapshot.suffix:
+        return None
+    return AffixStage(snapshot.prefix, snapshot.suffix)
+
+
+# --- Entités (mise en forme) ---
+# Telegram exprime offset/length en unités UTF-16 ; les calculs se font en
+# index Python puis sont reconvertis une seule fois à la fin.
+def _utf16_positions(text: str) -> Optional[List[int]]:
+    """Position UTF-16 de chaque index (None si identique : aucun caractère hors BMP)"""
+    if not text or text.isascii() or max(text) <= "\uffff":
+        return None
+    positions = [0]
+    for char in text:
+        positions.append(positions[-1] + (2 if char > "\uffff" else 1))
+    return positions
+
+
+def _entity_spans(text: str, entities: List[Dict]) -> List[tuple]:
+    """Entités -> (début, fin, entité) en index Python"""
+    positions = _utf16_positions(text)
+    spans = []
+    for entity in entities:
+        start, end = entity["offset"], entity["offset"] + entity["length"]
+        if positions is not None:
+            start, end = bisect_left(positions, start), bisect_left(positions, end)
+        spans.append((start, end, entity))
+    return spans
+
+
+def _apply_edits(text: str, spans: List[tuple], edits: List[Edit]) -> Tuple[str, List[tuple]]:
+    """
+    Applique des remplacements triés et disjoints, et décale les entités
+
+    Une insertion au début d'une entité la décale, à sa fin la laisse
+    intacte ; un remplacement à l'intérieur d'une entité l'agrandit ou la réduit.
+    """
+    if not edits:
+        return text, spans
+
+    parts, last = [], 0
+    for start, end, replacement in edits:
+        parts.append(text[last:start])
+        parts.append(replacement)
+        last = end
+    parts.append(text[last:])
+
+    # De droite à gauche : les positions à gauche de chaque remplacement restent valides
+    for start, end, replacement in reversed(edits):
+        delta = len(replacement) - (end - start)
+        shifted = []
+        for a, b, entity in spans:
+            a = a if a < start else (a + delta if a >= end else start)
+            b = b if b <= start else (b + delta if b >= end else start + len(replacement))
+            if b > a:
+                shifted.append((a, b, entity))
+        spans = shifted
+
+    return "".join(parts), spans
+
+
+def _spans_to_entities(text: str, spans: List[tuple]) -> List[Dict]:
+    """(début, fin, entité) en index Python -> entités en unités UTF-16"""
+    positions = _utf16_positions(text)
+    entities = []
+    for start, end, entity in spans:
+        if positions is not None:
+            start, end = positions[start], positions[end]
+        entities.append({**entity, "offset": start, "length": end - start})
+    return entities
+
+
+# --- Découpage ---
+# Coupures préférées, de la plus naturelle à la plus brutale ; la coupure a
+# lieu après le séparateur (les espaces en bordure de morceau sont retirés)
+_BOUNDARIES = (
+    re.compile(r"\n[ \t]*\n"),      # paragraphe
+    re.compile(r"\n"),               # ligne
+    re.compile(r"[.!?…]+[\"»)]?\s"),  # phrase
+    re.compile(r"\s"),               # mot
+)
+
+
+def utf16_len(text: str) -> int:
+    """Longueur d'un texte telle que comptée par Telegram"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def check_length(text: str, limit: int):
+    """Refuse un texte trop long avant l'appel API (requête vouée à l'échec)"""
+    length = utf16_len(text or "")
+    if length > limit:
+        raise ValueError(f"Texte trop long ({length} > {limit} unités UTF-16)")
+
+
+def _fit(positions: Optional[List[int]], start: int, limit: int, size: int) -> int:
+    """Plus grand index de fin tel que text[start:fin] tienne dans la limite"""
+    if positions is None:
+        return min(start + limit, size)
+    return bisect_right(positions, positions[start] + limit) - 1
+
+
+def _boundary(text: str, start: int, end: int) -> int:
+    """Meilleure coupure dans text[start:end], dans la seconde moitié du morceau"""
+    low = start + (end - start) // 2
+    for pattern in _BOUNDARIES:
+        cut = None
+        for match in pattern.finditer(text, low, end):
+            cut = match.end()
+        if cut is not None:
+            return cut
+    return end  # Aucun séparateur : coupure au milieu d'un mot
+
+
+def split_message(
+    text: str,
+    spans: List[tuple] = (),
+    first_limit: int = MESSAGE_LIMIT,
+    limit: int = MESSAGE_LIMIT
+) -> List[Tuple[str, List[Dict]]]:
+    """
+    Découpe un texte aux limites Telegram au lieu de le tronquer
+
+    Coupe de préférence entre deux paragraphes, puis lignes, phrases et
+    mots. Le premier morceau respecte first_limit (légende d'un média),
+    les suivants limit. Une entité à cheval sur une coupure est répartie
+    entre les deux morceaux.
+
+    Returns:
+        [(texte, entités)] dans l'ordre d'envoi (au moins un morceau)
+    """
+    text = text or ""
+    positions = _utf16_positions(text)
+    parts: List[Tuple[str, List[Dict]]] = []
+    start, max_units = 0, first_limit
+
+    while True:
+        end = _fit(positions, start, max_units, len(text))
+        cut = end if end >= len(text) else _boundary(text, start, end)
+        piece = text[start:cut].rstrip()
+        stop = start + len(piece)
+
+        if piece or not parts:
+            piece_spans = [
+                (max(a, start) - start, min(b, stop) - start, entity)
+                for a, b, entity in spans
+                if a < stop and b > start
+            ]
+            parts.append((piece, _spans_to_entities(piece, piece_spans)))
+
+        start = cut
+        while start < len(text) and text[start].isspace():
+            start += 1
+        if start >= len(text):
+            return parts
+        max_units = limit
+
+
+class TransformPipeline:
+    """
+    Transformations d'un utilisateur, compilées une seule fois
+
+    - Étapes construites depuis un PrefsSnapshot (aucun accès ORM par message)
+    - render() découpe le résultat selon la limite (message ou légende)
+    - Pas de variante par liste (apply_many) : l'outbox rend chaque message
+      avec ses entités et sa limite propres, au fil des pages ; le pipeline
+      compilé une fois par job suffit à sortir l'ORM de la boucle
+    """
+
+    def __init__(self, snapshot: PrefsSnapshot, keywords: KeywordEngine, stages: Iterable[Stage]):
+        self.snapshot = snapshot
+        self.keywords = keywords
+        self.stages = tuple(stages)
+
+    @classmethod
+    def build(cls, snapshot: PrefsSnapshot, keywords: KeywordEngine = None) -> "TransformPipeline":
+        """
+        Compile le pipeline
+
+        Sans moteur fourni, seul le couple keyword_find/keyword_replace
+        du snapshot est utilisé (pas de lecture des règles en base).
+        """
+        if keywords is None:
+            rules = []
+            if snapshot.keyword_find and snapshot.keyword_replace:
+                rules.append(Rule(find=snapshot.keyword_find, replace=snapshot.keyword_replace))
+            keywords = KeywordEngine(rules)
+
+        stages = []
+        for factory in _STAGE_FACTORIES:
+            stage = factory(snapshot, keywords)
+            if stage is not None:
+                stages.append(stage)
+        return cls(snapshot, keywords, stages)
+
+    def apply(self, text: str) -> str:
+        """Transforme un texte (sans limite de longueur, voir render())"""
+        text = text or ""
+        for stage in self.stages:
+            text = stage(text)
+        return text
+
+    @property
+    def is_identity(self) -> bool:
+        """Aucune étape : le message peut être republié tel quel (copy_message)"""
+        return not self.stages
+
+    @property
+    def preserves_entities(self) -> bool:
+        """Toutes les étapes savent décrire leurs remplacements"""
+        return all(hasattr(stage, "edits") for stage in self.stages)
+
+    def _apply_spans(self, text: str, entities: Optional[List[Dict]]) -> Tuple[str, List[tuple]]:
+        """
+        Transforme un texte en conservant sa mise en forme
+
+        Les entités (dicts Telegram : type, offset, length...) sont décalées
+        par simple arithmétique, sans produire ni relire de HTML. Si une
+        étape ne sait pas décrire ses remplacements, le texte est transformé
+        normalement et les entités sont abandonnées.
+        """
+        if not entities or not self.preserves_entities:
+            return self.apply(text), []
+
+        text = text or ""
+        spans = _entity_spans(text, entities)
+        for stage in self.stages:
+            text, spans = _apply_edits(text, spans, stage.edits(text))
+        return text, spans
+
+    def apply_with_entities(self, text: str, entities: Optional[List[Dict]]) -> Tuple[str, List[Dict]]:
+        """Texte transformé complet et ses entités (sans limite de longueur)"""
+        text, spans = self._apply_spans(text, entities)
+        return text, _spans_to_entities(text, spans)
+
+    def render(
+        self,
+        text: str,
+        entities: Optional[List[Dict]] = None,
+        first_limit: int = MESSAGE_LIMIT
+    ) -> List[Tuple[str, List[Dict]]]:
+        """
+        Transforme puis découpe un texte en morceaux prêts à envoyer
+
+        Args:
+            entities: Mise en forme d'origine (None : texte brut)
+            first_limit: CAPTION_LIMIT si le premier morceau est une légende
+
+        Returns:
+            [(texte, entités)] : le premier accompagne le média éventuel,
+            les suivants sont des messages de continuation
+        """
+        text, spans = self._apply_spans(text, entities)
+        return split_message(text, spans, first_limit)
+
+
+class TransformPipelineCache:
+    """
+    Pipelines compilés, par utilisateur (LRU)
+
+    Réutilisé tant que le snapshot et le moteur de mots-clés sont inchangés ;
+    invalidate() après une modification des paramètres.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, TransformPipeline]" = OrderedDict()
+
+        self.hits = 0
+        self.builds = 0
+
+    async def get(self, prefs) -> TransformPipeline:
+        """Pipeline de l'utilisateur (UserPreferences ou PrefsSnapshot)"""
+        snapshot = PrefsSnapshot.from_prefs(prefs)
+        keywords = await keyword_engines.get(snapshot)
+
+        pipeline = self._entries.get(snapshot.user_id)
+        if pipeline and pipeline.snapshot == snapshot and pipeline.keywords is keywords:
+            self._entries.move_to_end(snapshot.user_id)
+            self.hits += 1
+            return pipeline
+
+        pipeline = TransformPipeline.build(snapshot, keywords)
+        self.builds += 1
+
+        self._entries[snapshot.user_id] = pipeline
+        self._entries.move_to_end(snapshot.user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return pipeline
+
+    def invalidate(self, user_id: int):
+        """Force la recompilation au prochain accès"""
+        self._entries.pop(user_id, None)
+
+    def get_stats(self) -> Dict:
+        """Statistiques du cache"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "builds": self.builds
+        }
+
+
+# Instance globale (une par processus)
+transform_pipelines = TransformPipelineCache(
+    max_size=int(os.getenv("TRANSFORM_CACHE_SIZE", "10000"))
+)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import timezone
+from typing import Deque, Dict, Optional, Set
+
+from db import get_setting_async, set_setting_async
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Filtre des updates renvoyées par Telegram (même update_id)
+
+    Telegram renvoie une update quand la réponse du webhook tarde : sans
+    filtre, le message est publié deux fois et compté deux fois.
+
+    - Fenêtre chaude : les `window` derniers update_id acceptés (anneau +
+      ensemble), vérifiés en O(1) avant Update.de_json
+    - Plus ancien que la fenêtre : considéré comme déjà traité
+    - Plus haut update_id accepté persisté en base (bot_settings, écriture
+      différée) : après un redémarrage, tout ce qui est en dessous est ignoré.
+      Une update en cours (ni confirmée ni oubliée) borne la valeur persistée :
+      refusée en 503 puis renvoyée après un redémarrage, elle reste acceptée
+    - Après `reset_after` secondes sans update, Telegram peut repartir d'un
+      identifiant aléatoire : le filtre repart alors de zéro
+    """
+
+    SETTING_KEY = "webhook_high_water"
+
+    def __init__(self, window: int = 10000, flush_interval: float = 5.0, reset_after: float = 6 * 86400):
+        self.window = window
+        self.flush_interval = flush_interval
+        self.reset_after = reset_after
+
+        self._ring: Deque[int] = deque()
+        self._seen: Set[int] = set()
+        self._inflight: Set[int] = set()  # Acceptées, pas encore confirmées
+        self._floor = 0  # Plus haut update_id persisté au démarrage
+        self._last_at = 0.0
+        self._persisted = 0
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.high_water = 0
+        self.accepted = 0
+        self.duplicates = 0
+
+    # --- Filtrage ---
+    def is_duplicate(self, update_id) -> bool:
+        """Vrai si l'update a déjà été reçue ; sinon la marque comme reçue"""
+        if not isinstance(update_id, int):
+            return False
+
+        now = time.time()
+        if self._last_at and now - self._last_at > self.reset_after:
+            logger.info(f"🔄 Aucune update depuis {self.reset_after:.0f}s, filtre réinitialisé")
+            self._reset()
+
+        if (
+            update_id in self._seen
+            or update_id <= self._floor
+            or update_id <= self.high_water - self.window
+        ):
+            self.duplicates += 1
+            return True
+
+        if len(self._ring) >= self.window:
+            self._seen.discard(self._ring.popleft())
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+        self._inflight.add(update_id)
+        self.high_water = max(self.high_water, update_id)
+        self._last_at = now
+        self.accepted += 1
+        return False
+
+    def confirm(self, update_id):
+        """Update traitée ou mise en file : la marque haute peut la dépasser"""
+        self._inflight.discard(update_id)
+
+    def forget(self, update_id):
+        """Update refusée (503) : Telegram la renverra, elle doit être acceptée"""
+        if update_id not in self._seen:
+            return
+        self._seen.discard(update_id)
+        self._inflight.discard(update_id)
+        self._ring.remove(update_id)
+        self.high_water = max(self._ring, default=self._floor)
+
+    def _committed(self) -> int:
+        """Marque haute persistable : sous la plus ancienne update encore en cours"""
+        if self._inflight:
+            return min(self.high_water, min(self._inflight) - 1)
+        return self.high_water
+
+    def _reset(self):
+        self._ring.clear()
+        self._seen.clear()
+        self._inflight.clear()
+        self._floor = 0
+        self.high_water = 0
+
+    # --- Persistance ---
+    async def start(self):
+        """Recharge la marque haute et lance l'écriture différée"""
+        try:
+            setting = await get_setting_async(self.SETTING_KEY)
+        except Exception as e:
+            logger.error(f"❌ Lecture de la marque haute des updates: {e}")
+            setting = None
+
+        if setting and setting[0]:
+            value, written_at = setting
+            if written_at.tzinfo is None:
+                written_at = written_at.replace(tzinfo=timezone.utc)
+            self._floor = self.high_water = self._persisted = int(value)
+            self._last_at = written_at.timestamp()
+            logger.info(f"✅ Updates déjà traitées jusqu'à {self._floor}")
+
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="update-dedup-flush")
+
+    async def stop(self):
+        """Écrit la marque haute une dernière fois"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Persiste la marque haute si elle a changé (jamais à la baisse entre instances)"""
+        high_water = self._committed()
+        # Jamais à la baisse (update en cours plus ancienne), sauf après une réinitialisation
+        if high_water == self._persisted or (high_water < self._persisted and self._floor):
+            return
+        try:
+            setting = await get_setting_async(self.SETTING_KEY)
+            stored = int(setting[0]) if setting and setting[0] else 0
+            # Une autre instance a pu écrire plus haut ; après une réinitialisation, on repart d'ici
+            if high_water > stored or self._floor == 0:
+                await set_setting_async(self.SETTING_KEY, str(high_water))
+            self._persisted = high_water
+        except Exception as e:
+            logger.error(f"❌ Écriture de la marque haute des updates: {e}")
+
+    def get_stats(self) -> Dict:
+        """Statistiques du filtre"""
+        return {
+            "high_water": self.high_water,
+            "persisted": self._persisted,
+            "window": len(self._ring),
+            "inflight": len(self._inflight),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates
+        }
+
+
+# Instance globale (une par processus)
+update_deduplicator = UpdateDeduplicator(
+    window=int(os.getenv("UPDATE_DEDUP_WINDOW", "10000")),
+    flush_interval=float(os.getenv("UPDATE_DEDUP_FLUSH_INTERVAL", "5"))
+)
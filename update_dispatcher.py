@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from telegram import Update
+
+from coordination import coordinator
+from webhook_ingest import webhook_timings
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDispatcher:
+    """
+    Pool de workers pour traiter les updates hors de la requête webhook
+
+    - Le webhook met l'update en file et répond 200 immédiatement
+    - Capacité bornée : au-delà, enqueue() attend puis refuse (backpressure)
+    - Ordre préservé par utilisateur : une seule update à la fois par user_id
+    """
+
+    def __init__(
+        self,
+        application,
+        workers: int = 8,
+        max_pending: int = 1000,
+        enqueue_timeout: float = 5.0
+    ):
+        self.application = application
+        self.workers = workers
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+        # Updates en attente pour un utilisateur déjà en cours de traitement
+        self._active: Dict[int, Deque[Update]] = {}
+
+        self.pending_count = 0
+        self.processed_count = 0
+        self.failed_count = 0
+        self.rejected_count = 0
+
+    def start(self):
+        """Démarre les workers (à appeler dans la boucle d'événements)"""
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"update-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"✅ Dispatcher démarré: {self.workers} workers, {self.max_pending} updates max")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Laisse les workers vider la file puis les arrête"""
+        if self._queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Arrêt du dispatcher avec {self.pending_count} updates non traitées")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @staticmethod
+    def partition_key(update: Update) -> int:
+        """Clé d'ordonnancement : l'utilisateur, sinon le chat, sinon l'update"""
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return update.update_id
+
+    async def enqueue(self, update: Update) -> bool:
+        """
+        Met une update en file
+
+        Returns:
+            True si acceptée, False si la capacité est saturée après le délai
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_count += 1
+            logger.warning(f"⚠️ File saturée ({self.pending_count} updates), update {update.update_id} refusée")
+            return False
+
+        self.pending_count += 1
+        self._queue.put_nowait(update)
+        return True
+
+    async def _worker(self):
+        """Boucle d'un worker : traite les updates d'un utilisateur dans l'ordre"""
+        while True:
+            update = await self._queue.get()
+            key = self.partition_key(update)
+
+            pending = self._active.get(key)
+            if pending is not None:
+                # Un autre worker traite déjà cet utilisateur : il prendra la suite
+                pending.append(update)
+                continue
+
+            pending = self._active[key] = deque()
+            try:
+                while True:
+                    await self._process(update)
+                    if not pending:
+                        break
+                    update = pending.popleft()
+            finally:
+                del self._active[key]
+
+    async def _process(self, update: Update):
+        """Traite une update et libère sa place dans la file"""
+        try:
+            with webhook_timings.measure("process"):
+                async with coordinator.user_lock(self.partition_key(update)):
+                    await self.application.process_update(update)
+            self.processed_count += 1
+        except Exception as e:
+            self.failed_count += 1
+            logger.error(f"❌ Erreur traitement update {update.update_id}: {e}", exc_info=True)
+        finally:
+            self.pending_count -= 1
+            self._slots.release()
+            self._queue.task_done()
+
+    def get_stats(self) -> Dict:
+        """Statistiques du dispatcher"""
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending_count,
+            "active_users": len(self._active),
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+            "rejected": self.rejected_count
+        }
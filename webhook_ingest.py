@@ -0,0 +1,93 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from metrics import webhook_stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# orjson si installé (plusieurs fois plus rapide), sinon json standard
+try:
+    import orjson
+    _loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _loads = json.loads
+    JSON_BACKEND = "json"
+
+# Types d'update traités par les handlers : les seuls demandés à Telegram
+# (allowed_updates), les autres sont ignorés avant toute désérialisation
+HANDLED_UPDATES = ("message", "callback_query")
+
+
+def parse_update_body(body: bytes) -> dict:
+    """Corps brut de la requête webhook -> dict (sans passer par une chaîne)"""
+    return _loads(body)
+
+
+def is_handled(data: dict) -> bool:
+    """L'update contient-elle un type traité par les handlers ?"""
+    return any(key in data for key in HANDLED_UPDATES)
+
+
+def describe_update(data: dict) -> str:
+    """Résumé d'une update pour les logs de debug (appeler seulement si DEBUG est actif)"""
+    if "message" in data:
+        message = data["message"]
+        text = message.get("text") or message.get("caption") or ""
+        return f"📨 Message reçu de {message.get('from', {}).get('id')}: {text[:50]}"
+    if "callback_query" in data:
+        query = data["callback_query"]
+        return f"🔘 Callback de {query.get('from', {}).get('id')}: {query.get('data', '')}"
+    return f"Update {data.get('update_id')}"
+
+
+class StageTimings:
+    """
+    Durée cumulée de chaque étape du webhook (lecture, parsing, filtrage,
+    désérialisation, traitement) pour comparer leur coût
+    """
+
+    def __init__(self):
+        # étape -> [nombre, total, max] (secondes)
+        self._stages: Dict[str, list] = {}
+
+    def record(self, stage: str, seconds: float):
+        entry = self._stages.get(stage)
+        if entry is None:
+            entry = self._stages[stage] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        webhook_stage_seconds.observe(seconds, stage)
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Mesure le bloc, même s'il lève une exception"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def reset(self):
+        self._stages.clear()
+
+    def get_stats(self) -> Dict:
+        """Par étape : nombre, moyenne et max en millisecondes"""
+        return {
+            stage: {
+                "count": count,
+                "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                "max_ms": round(maximum * 1000, 3),
+                "total_ms": round(total * 1000, 1)
+            }
+            for stage, (count, total, maximum) in self._stages.items()
+        }
+
+
+# Instance globale (une par processus)
+webhook_timings = StageTimings()